@@ -6,9 +6,7 @@ load_dotenv()
 
 import requests
 import base64
-from plaid.model.country_code import CountryCode
-from plaid.model.products import Products
-from flask import Flask, jsonify, request, session, redirect, send_from_directory
+from flask import Flask, jsonify, request, session, redirect, send_from_directory, Response, stream_with_context
 from flask_cors import CORS
 import sqlite3
 from datetime import datetime, timedelta, date
@@ -27,35 +25,50 @@ import time  # if not already imported
 
 from functools import wraps
 from discogs_handler import DiscogsHandler 
+from handlers.migration_handler import MigrationHandler
+from handlers.query_console_handler import QueryConsoleHandler, QueryCancelled, QueryNotAllowed
+from handlers.image_handler import ImageDerivativeHandler
+from handlers.discogs_mirror_handler import DiscogsMirrorHandler, DiscogsLookupError
+from handlers.price_estimate_handler import PriceEstimateHandler, PriceEstimateError
+from handlers.scan_session_handler import ScanSessionHandler, ScanSessionError, apply_location_updates
+from handlers.table_version_handler import TableVersionHandler
+from handlers.dimension_cache_handler import DimensionCacheHandler
+from handlers.response_cache_handler import ResponseCacheHandler
+from handlers.serialization_handler import FastJSONProvider, json_list_response, wants_columnar
+from handlers.shared_state_handler import SharedStateHandler, SharedDict
+from handlers.job_queue_handler import JobQueueHandler, JobError, JOB_STATUSES, TERMINAL_STATUSES, report_progress
+from handlers.http_client_handler import HttpClient
+from handlers.balance_cache_handler import BalanceCacheHandler
+from handlers.discogs_orders_handler import DiscogsOrdersHandler, DiscogsOrdersError
+from handlers.record_changes_handler import RecordChangesHandler
+from handlers.kiosk_catalog_handler import KioskCatalogHandler
+from handlers.discogs_inventory_handler import (DiscogsInventoryHandler, DiscogsInventoryError, SOLD_STATUS_IDS,
+                                                markup_percent as markup_for_age)
+from handlers.square_webhook_handler import SquareWebhookHandler, SquareWebhookError, SIGNATURE_HEADER, event_object
+from handlers.record_fields_handler import (RecordFieldsHandler, FieldSelectionError, RECORDS_FIELDS,
+                                            SEARCH_FIELDS, FILTER_FIELDS)
 import hmac
 import traceback
 import subprocess
 import os
-import discogs_client
 from flask import session, request, jsonify
 from functools import wraps
 from werkzeug.utils import secure_filename
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 from datetime import datetime
 import re
 
 # ===== NEW IMPORTS FOR ACCOUNTING =====
 from decimal import Decimal
 import csv
+import gzip
 import io
 
-# ===== NEW IMPORTS FOR PLAID =====
-import plaid
-from plaid.api import plaid_api
-from plaid.model.transactions_get_request import TransactionsGetRequest
-from plaid.model.transactions_get_request_options import TransactionsGetRequestOptions
-from plaid.model.link_token_create_request import LinkTokenCreateRequest
-from plaid.model.link_token_create_request_user import LinkTokenCreateRequestUser
-from plaid.model.item_public_token_exchange_request import ItemPublicTokenExchangeRequest
+# Plaid, discogs_client, smtplib and email.mime are imported where they are used:
+# the Plaid SDK alone costs ~200ms per process, and most requests never touch them.
+# Track the import budget with profile_startup.py.
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 
 
 app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'a7f8e9d3c5b1n2m4k6l7j8h9g0f1d2s3')
@@ -73,21 +86,16 @@ ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp', 'svg'}
 UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'static', 'images', 'misc')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp', 'svg'}
 
-# Create upload folder if it doesn't exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-
 def allowed_file(filename):
     """Check if file extension is allowed for accessory images"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# Create upload folder if it doesn't exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-
 # Square Configuration - ALL FROM ENVIRONMENT VARIABLES
 SQUARE_ENVIRONMENT = os.environ.get('SQUARE_ENVIRONMENT')
 SQUARE_LOCATION_ID = os.environ.get('SQUARE_LOCATION_ID')
 SQUARE_TERMINAL_DEVICE_ID = os.environ.get('SQUARE_TERMINAL_DEVICE_ID', '0446')
 SQUARE_WEBHOOK_SIGNATURE_KEY = os.environ.get('SQUARE_WEBHOOK_SIGNATURE_KEY')
+SQUARE_WEBHOOK_URL = os.environ.get('SQUARE_WEBHOOK_URL')  # exact notification URL registered with Square (signed)
 SQUARE_APPLICATION_ID = os.environ.get('SQUARE_APPLICATION_ID')
 SQUARE_ACCESS_TOKEN = os.environ.get('SQUARE_ACCESS_TOKEN')
 DISCOGS_USER_TOKEN = os.environ.get('DISCOGS_USER_TOKEN')
@@ -111,58 +119,44 @@ CORS(app,
          "https://arjanshaw.github.io",
          "https://pigstylerecords.github.io"
      ],
-     allow_headers=["Content-Type", "Authorization", "Accept", "Origin", "X-Requested-With"],
-     expose_headers=["Content-Type", "Authorization"],
+     allow_headers=["Content-Type", "Authorization", "Accept", "Origin", "X-Requested-With", "If-None-Match"],
+     expose_headers=["Content-Type", "Authorization", "ETag"],
      methods=["GET", "POST", "PUT", "DELETE", "OPTIONS", "PATCH"])
 
 # Database configuration
 DB_PATH = os.path.join(os.path.dirname(__file__), "data", "records.db")
 
+# Longest one status stream may hold a gunicorn thread (4 per worker); clients reconnect for more
+STREAM_WINDOW_S = 30
+
 # Spotify configuration
 SPOTIFY_CLIENT_ID = os.environ.get('SPOTIFY_CLIENT_ID', '1a2b3c4d5e6f7g8h9i0j')
 SPOTIFY_CLIENT_SECRET = os.environ.get('SPOTIFY_CLIENT_SECRET', 'k1l2m3n4o5p6q7r8s9t0')
 SPOTIFY_REDIRECT_URI = '/spotify/callback'
  
 
-# Token storage and background job storage
-user_tokens = {}
-background_jobs = {}
-square_payment_sessions = {}  # Store active payment sessions
+# Token storage and background job storage, shared by all worker processes
+shared_state = SharedStateHandler(DB_PATH)
+user_tokens = SharedDict(shared_state, 'user_tokens')
+square_payment_sessions = SharedDict(shared_state, 'square_payment_sessions', ttl=24 * 3600)  # Store active payment sessions
 
 
 def get_account_id(code):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT id FROM accounts WHERE code = ?', (code,))
-    row = cursor.fetchone()
-    conn.close()
-    return row['id'] if row else None
+    return dimensions.account_id(code)
 
 # ==================== HELPER: GET CASH ACCOUNT BY SOURCE TYPE ====================
 
 def get_cogs_rates():
     """Get COGS assumption rates from app_config. Raises error if not found."""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT config_key, config_value FROM app_config WHERE config_key IN ('cogs_new_record_rate', 'cogs_used_record_rate')")
-    rows = cursor.fetchall()
-    conn.close()
-    
-    new_rate = None
-    used_rate = None
-    
-    for row in rows:
-        if row['config_key'] == 'cogs_new_record_rate':
-            new_rate = float(row['config_value'])
-        elif row['config_key'] == 'cogs_used_record_rate':
-            used_rate = float(row['config_value'])
+    new_rate = dimensions.config('cogs_new_record_rate')
+    used_rate = dimensions.config('cogs_used_record_rate')
     
     if new_rate is None:
         raise ValueError("cogs_new_record_rate not found in app_config")
     if used_rate is None:
         raise ValueError("cogs_used_record_rate not found in app_config")
     
-    return new_rate, used_rate
+    return float(new_rate), float(used_rate)
 
 def get_cash_account_id(source_type):
     """
@@ -172,42 +166,25 @@ def get_cash_account_id(source_type):
         cash_account_historic -> account id for Bluevine (e.g., '1010')
     If not set, fallback to account with code '1010'.
     """
-    conn = get_db()
-    cursor = conn.cursor()
     if source_type == 'plaid':
         key = 'cash_account_plaid'
     elif source_type == 'historic':
         key = 'cash_account_historic'
     else:
         # fallback to default cash account
-        cursor.execute('SELECT id FROM accounts WHERE code = ?', ('1010',))
-        row = cursor.fetchone()
-        conn.close()
-        return row['id'] if row else None
+        return dimensions.account_id('1010')
 
-    cursor.execute('SELECT config_value FROM app_config WHERE config_key = ?', (key,))
-    row = cursor.fetchone()
-    conn.close()
-    if row:
+    config_value = dimensions.config(key)
+    if config_value:
         try:
-            acc_id = int(row['config_value'])
+            acc_id = int(config_value)
             # verify it exists
-            conn2 = get_db()
-            cur2 = conn2.cursor()
-            cur2.execute('SELECT id FROM accounts WHERE id = ?', (acc_id,))
-            if cur2.fetchone():
-                conn2.close()
+            if dimensions.get('accounts', acc_id):
                 return acc_id
-            conn2.close()
         except:
             pass
     # fallback to default
-    conn3 = get_db()
-    cur3 = conn3.cursor()
-    cur3.execute('SELECT id FROM accounts WHERE code = ?', ('1010',))
-    row3 = cur3.fetchone()
-    conn3.close()
-    return row3['id'] if row3 else None
+    return dimensions.account_id('1010')
 
 def get_transactions_matching_filter(search, unprocessed_only, source_type):
     # Fetch Plaid transactions
@@ -390,13 +367,117 @@ def setup_logging():
     console_handler.setLevel(logging.DEBUG)
     app.logger.addHandler(console_handler)
 
-setup_logging()
-
 def get_db():
     conn = sqlite3.connect(DB_PATH)
     conn.row_factory = sqlite3.Row
     return conn
 
+def ensure_schema():
+    """Check schema_version with one query at startup and apply pending migrations if behind"""
+    if not os.path.exists(DB_PATH):
+        app.logger.warning(f"Database not found at {DB_PATH} - skipping schema check")
+        return
+    try:
+        version = MigrationHandler(DB_PATH, log=app.logger.info).ensure_current()
+        app.logger.info(f"Database schema version: {version}")
+    except Exception as e:
+        app.logger.error(f"Schema migration failed: {str(e)}")
+        app.logger.error(traceback.format_exc())
+
+# Every outbound call to Square, Discogs and YouTube goes through this pooled client
+http_client = HttpClient()
+query_console = QueryConsoleHandler(DB_PATH, store=shared_state)
+image_derivatives = ImageDerivativeHandler(
+    DB_PATH,
+    os.path.join(os.path.dirname(__file__), 'static'),
+    user_agent=DISCOGS_USER_AGENT,
+    http=http_client
+)
+discogs_mirror = DiscogsMirrorHandler(
+    DISCOGS_USER_TOKEN,
+    os.path.join(os.path.dirname(__file__), 'data', 'discogs_mirror.db'),
+    http=http_client,
+    store=shared_state
+)
+price_estimator = PriceEstimateHandler(discogs_mirror)
+scan_sessions = ScanSessionHandler(DB_PATH)
+table_versions = TableVersionHandler(DB_PATH)
+dimensions = DimensionCacheHandler(DB_PATH, table_versions)
+response_cache = ResponseCacheHandler(table_versions)
+record_fields = RecordFieldsHandler(DB_PATH, dimensions, image_derivatives)
+record_changes = RecordChangesHandler(DB_PATH, shared_state)
+kiosk_catalog = KioskCatalogHandler(
+    DB_PATH,
+    os.path.join(os.path.dirname(__file__), 'data', 'kiosk_catalog.json.gz'),
+    record_changes,
+    record_fields,
+    table_versions
+)
+job_queue = JobQueueHandler(DB_PATH, app)
+square_webhooks = SquareWebhookHandler(DB_PATH, SQUARE_WEBHOOK_SIGNATURE_KEY, SQUARE_WEBHOOK_URL)
+external_balances = BalanceCacheHandler(shared_state)
+discogs_orders = DiscogsOrdersHandler(DB_PATH, shared_state)
+# Shares the mirror's rate limiter so inventory syncs and lookups draw on one Discogs request budget
+discogs_inventory = DiscogsInventoryHandler(
+    DB_PATH,
+    DISCOGS_USER_TOKEN,
+    shared_state,
+    discogs_mirror.rate_limiter,
+    username=os.environ.get('DISCOGS_USERNAME', 'pigstyle'),
+    http=http_client
+)
+
+# Tables behind each cached catalog read (listing rows are decorated with image srcsets)
+RECORD_LISTING_TABLES = ('records', 'formats', 'd_status', 'locations', 'd_condition', 'image_variants')
+
+
+_app_initialized = False
+
+
+def create_app(start_workers=True):
+    """
+    Application factory used by wsgi.py (gunicorn) and the dev server.
+
+    Routes are registered on the module-level app at import time; this runs
+    the startup work that must happen once per deployment rather than on
+    every import: logging, upload folders, schema migrations and switching
+    the database to WAL so several worker processes can read while one
+    writes. Safe to call again.
+
+    start_workers starts this process's job queue threads. gunicorn preloads
+    the app in its master, so wsgi.py passes False and each forked worker
+    starts its own threads in post_fork (gunicorn.conf.py).
+    """
+    global _app_initialized
+    if _app_initialized:
+        if start_workers:
+            job_queue.start()
+        return app
+    setup_logging()
+    for folder in (UPLOAD_FOLDER, BILLS_UPLOAD_FOLDER):
+        os.makedirs(folder, exist_ok=True)
+    ensure_schema()
+    if os.path.exists(DB_PATH):
+        conn = sqlite3.connect(DB_PATH)
+        try:
+            # Persistent per database file; readers no longer block behind a writer
+            conn.execute('PRAGMA journal_mode=WAL')
+        finally:
+            conn.close()
+    _app_initialized = True
+    schedule_records_changes_compaction()
+    if start_workers:
+        job_queue.start()
+    return app
+
+
+@app.after_request
+def expire_table_versions(response):
+    """After any write request, re-read change counters so this worker never serves its own stale data"""
+    if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+        table_versions.expire()
+    return response
+
 # ==================== EMAIL HELPER FUNCTIONS ====================
 
 def send_email(to_email, subject, body, from_name="PigStyle Music"):
@@ -419,6 +500,10 @@ def send_email(to_email, subject, body, from_name="PigStyle Music"):
     if not to_email or not subject or not body:
         return False, "Missing required email fields (to_email, subject, or body)"
     
+    import smtplib
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
     try:
         # Create message
         msg = MIMEMultipart()
@@ -475,11 +560,12 @@ def square_api_request(endpoint, method='GET', data=None):
         app.logger.info(f"Square API request: {method} {url}")
         
         if method == 'GET':
-            response = requests.get(url, headers=headers)
+            response = http_client.get(url, headers=headers)
         elif method == 'POST':
-            response = requests.post(url, headers=headers, json=data)
+            # Square POSTs carry an idempotency_key, which makes them safe to retry
+            response = http_client.post(url, headers=headers, json=data, idempotent=bool(data and data.get('idempotency_key')))
         elif method == 'DELETE':
-            response = requests.delete(url, headers=headers)
+            response = http_client.delete(url, headers=headers)
         else:
             return None, f"Unsupported method: {method}"
         
@@ -610,11 +696,12 @@ def create_square_terminal_checkout(
     print("====================================\n")
 
     try:
-        response = requests.post(
+        response = http_client.post(
             f"{base_url}/v2/terminals/checkouts",
             headers=headers,
             json=checkout_data,
-            timeout=30
+            timeout=30,
+            idempotent=True
         )
     except requests.RequestException as exc:
         return None, f"Unable to contact Square: {exc}"
@@ -648,12 +735,12 @@ def get_terminal_checkout_status(checkout_id):
     status = checkout.get('status', 'UNKNOWN')
     
     if checkout_id in square_payment_sessions:
-        square_payment_sessions[checkout_id]['status'] = status
+        square_payment_sessions.update_item(checkout_id, status=status)
         
         if status == 'COMPLETED':
             payment_id = checkout.get('payment_ids', [None])[0]
             if payment_id:
-                square_payment_sessions[checkout_id]['payment_id'] = payment_id
+                square_payment_sessions.update_item(checkout_id, payment_id=payment_id)
     
     return checkout, None
 
@@ -666,7 +753,7 @@ def cancel_terminal_checkout(checkout_id):
         return None, error
     
     if checkout_id in square_payment_sessions:
-        square_payment_sessions[checkout_id]['status'] = 'CANCELED'
+        square_payment_sessions.update_item(checkout_id, status='CANCELED')
     
     return result, None
 
@@ -730,6 +817,7 @@ def get_discogs_client():
     consumer_key = os.environ.get('DISCOGS_CONSUMER_KEY')
     consumer_secret = os.environ.get('DISCOGS_CONSUMER_SECRET')
     
+    import discogs_client
     d = discogs_client.Client(
         'PigStyleMusic/1.0',
         consumer_key=consumer_key,
@@ -756,7 +844,7 @@ def require_discogs_auth(f):
 # ==================== NEW: SELF-CONTAINED BATCH MARKUP ENDPOINT ====================
 # This is the ONLY endpoint that calculates Discogs prices.
 # No try/catch – it raises exceptions on invalid data.
-# No helper functions – all logic is inlined.
+# Interpolation is markup_percent() in handlers/discogs_inventory_handler.py, shared with the listing diff.
 # ================================================================================
 
 @app.route('/api/discogs/calculate-markup-batch', methods=['POST'])
@@ -815,25 +903,7 @@ def calculate_markup_batch():
             created_date = created_at_str
 
         days_old = (today - created_date).days
-
-        # --- Inline interpolation (no helper) ---
-        if days_old <= rules[0][0]:
-            markup_percent = rules[0][1]
-        elif days_old >= rules[-1][0]:
-            markup_percent = rules[-1][1]
-        else:
-            markup_percent = 0.0
-            for i in range(len(rules) - 1):
-                x1, y1 = rules[i]
-                x2, y2 = rules[i + 1]
-                if x1 <= days_old <= x2:
-                    if x2 == x1:
-                        markup_percent = y1
-                    else:
-                        t = (days_old - x1) / (x2 - x1)
-                        markup_percent = y1 + t * (y2 - y1)
-                    break
-
+        markup_percent = markup_for_age(rules, days_old)
         discogs_price = round(store_price * (1 + markup_percent / 100), 2)
 
         results.append({
@@ -847,6 +917,7 @@ def calculate_markup_batch():
 
 
 @app.route('/api/discogs/create-listing-single', methods=['POST'])
+@job_queue.offloadable('discogs.create_listing')
 def create_discogs_listing_single():
     """Create a single listing on Discogs with dynamic markup based on record age"""
     try:
@@ -876,7 +947,7 @@ def create_discogs_listing_single():
         if not db_record:
             return jsonify({'success': False, 'error': f'Record #{record["id"]} not found'}), 404
         
-        # ---- Inline markup calculation ----
+        # ---- Markup calculation ----
         from datetime import date, datetime
         
         # Fetch rules
@@ -901,27 +972,9 @@ def create_discogs_listing_single():
             created_date = created_at_str
 
         days_old = (date.today() - created_date).days
-
-        # Inline interpolation
-        if days_old <= rules[0][0]:
-            markup_percent = rules[0][1]
-        elif days_old >= rules[-1][0]:
-            markup_percent = rules[-1][1]
-        else:
-            markup_percent = 0.0
-            for i in range(len(rules) - 1):
-                x1, y1 = rules[i]
-                x2, y2 = rules[i + 1]
-                if x1 <= days_old <= x2:
-                    if x2 == x1:
-                        markup_percent = y1
-                    else:
-                        t = (days_old - x1) / (x2 - x1)
-                        markup_percent = y1 + t * (y2 - y1)
-                    break
-
+        markup_percent = markup_for_age(rules, days_old)
         discogs_price = round(db_record['store_price'] * (1 + markup_percent / 100), 2)
-        # ---- End of inline calculation ----
+        # ---- End of markup calculation ----
         
         headers = {
             'Authorization': f'Discogs token={TOKEN}',
@@ -953,7 +1006,7 @@ def create_discogs_listing_single():
             'per_page': 50
         }
         
-        search_response = requests.get(search_url, headers=headers, params=search_params)
+        search_response = http_client.get(search_url, headers=headers, params=search_params)
         
         if search_response.status_code != 200:
             app.logger.error(f"Search failed: {search_response.status_code}")
@@ -1018,7 +1071,7 @@ def create_discogs_listing_single():
         
         app.logger.info(f"Creating listing for release {release_id} at price ${discogs_price} (Record age: {days_old} days, Markup: {markup_percent}%)")
         
-        listing_response = requests.post(listing_url_endpoint, headers=headers, json=listing_data)
+        listing_response = http_client.post(listing_url_endpoint, headers=headers, json=listing_data)
         
         if listing_response.status_code in [200, 201]:
             listing_result = listing_response.json()
@@ -1354,7 +1407,8 @@ def process_checkout():
         }
         
         square_base_url = 'https://connect.squareup.com'
-        response = requests.post(f'{square_base_url}/v2/online-checkout/payment-links', headers=headers, json=payload)
+        response = http_client.post(f'{square_base_url}/v2/online-checkout/payment-links', headers=headers, json=payload,
+                                    idempotent=True)
         
         if response.status_code != 200:
             return jsonify({'status': 'error', 'error': 'Failed to create payment link'}), 400
@@ -1423,7 +1477,7 @@ def api_get_terminals():
             'Square-Version': '2026-01-22'
         }
         
-        response = requests.get('https://connect.squareup.com/v2/devices', headers=headers)
+        response = http_client.get('https://connect.squareup.com/v2/devices', headers=headers)
         data = response.json()
         
         if response.status_code != 200:
@@ -1496,7 +1550,16 @@ def api_create_terminal_checkout():
         if error:
             return jsonify({'status': 'error', 'message': error}), 400
         
-        return jsonify({'status': 'success', 'checkout': result.get('checkout', {})}), 200
+        checkout = result.get('checkout', {})
+        if checkout.get('id'):
+            square_payment_sessions[checkout['id']] = {
+                'status': checkout.get('status', 'PENDING'),
+                'amount_cents': amount_cents,
+                'record_ids': record_ids,
+                'device_id': device_id,
+                'created_at': datetime.now().isoformat()
+            }
+        return jsonify({'status': 'success', 'checkout': checkout}), 200
         
     except Exception as e:
         app.logger.error(f"Error in api_create_terminal_checkout: {e}")
@@ -1539,6 +1602,155 @@ def api_cancel_checkout(checkout_id):
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
+# ==================== SQUARE WEBHOOKS ====================
+
+# Terminal checkout statuses after which nothing else will happen
+TERMINAL_CHECKOUT_FINAL_STATUSES = ('COMPLETED', 'CANCELED')
+
+
+@app.route('/api/square/webhook', methods=['POST'])
+def square_webhook():
+    """
+    Square notification endpoint. The signature is checked against the raw
+    body, the event is stored once per event_id and applied by the job
+    queue, so Square gets its 200 straight away. Redeliveries are no-ops once
+    the event has a job; until then (the enqueue failed) they queue it again.
+    """
+    try:
+        event, needs_job = square_webhooks.receive(request.get_data(), request.headers.get(SIGNATURE_HEADER),
+                                                   request.url)
+        if not needs_job:
+            return jsonify({'status': 'success', 'duplicate': True})
+        job = job_queue.enqueue('square.webhook_event', {'event_id': event['event_id']})
+        square_webhooks.mark(event['event_id'], 'received', job_id=job['id'])
+        return jsonify({'status': 'success', 'event_id': event['event_id'], 'job_id': job['id']})
+    except SquareWebhookError as e:
+        app.logger.warning(f"Rejected Square webhook: {str(e)}")
+        return jsonify(e.to_dict()), e.status_code
+    except Exception as e:
+        app.logger.error(f"Square webhook error: {str(e)}")
+        app.logger.error(traceback.format_exc())
+        return jsonify({'status': 'error', 'error': str(e)}), 500
+
+
+@job_queue.register('square.webhook_event', max_attempts=5, priority=20, public=False)
+def apply_square_webhook_event(job):
+    """Apply one stored Square event: terminal checkout status, or completion of a website order"""
+    event_id = job.payload['event_id']
+    stored = square_webhooks.get(event_id)
+    if not stored:
+        raise JobError(f'Square event {event_id} not found', retry=False)
+    event = stored['payload']
+    event_type = event['type']
+    _, object_id, obj = event_object(event)
+
+    try:
+        action = 'ignored'
+        if event_type.startswith('terminal.checkout.'):
+            checkout_id = obj.get('id') or object_id
+            fields = {'status': obj.get('status', 'UNKNOWN'), 'updated_at': event.get('created_at')}
+            if obj.get('payment_ids'):
+                fields['payment_id'] = obj['payment_ids'][0]
+            if square_payment_sessions.update_item(checkout_id, **fields) is not None:
+                action = f"checkout {checkout_id} {fields['status']}"
+        elif event_type in ('payment.created', 'payment.updated'):
+            if obj.get('status') == 'COMPLETED' and obj.get('order_id'):
+                conn = get_db()
+                order = conn.execute('SELECT id FROM orders WHERE square_order_id = ?', (obj['order_id'],)).fetchone()
+                conn.close()
+                if order:
+                    record_count = complete_order_payment(order['id'], obj['id'], obj)
+                    action = (f"order {order['id']} already completed" if record_count is None
+                              else f"order {order['id']} completed, {record_count} records sold")
+        square_webhooks.mark(event_id, 'ignored' if action == 'ignored' else 'processed', job_id=job.id)
+        return {'event_id': event_id, 'type': event_type, 'action': action}
+    except Exception as e:
+        square_webhooks.mark(event_id, 'failed', job_id=job.id, error=str(e))
+        raise
+
+
+@app.route('/api/square/webhook/events', methods=['GET'])
+@login_required
+@role_required(['admin'])
+def list_square_webhook_events():
+    """Recently received Square events, newest first (?type=, ?limit=)"""
+    events = square_webhooks.recent(limit=request.args.get('limit', 50, type=int),
+                                    event_type=request.args.get('type'))
+    return jsonify({'status': 'success', 'events': events, 'count': len(events)})
+
+
+@app.route('/api/square/terminal/checkout/<checkout_id>/events', methods=['GET'])
+@login_required
+@role_required(['admin'])
+def stream_checkout_status(checkout_id):
+    """
+    Server-sent events for a terminal checkout. Status comes from the shared
+    payment session, which the terminal.checkout.updated webhook keeps
+    current; Square is only asked directly if nothing has arrived for a
+    while (webhook not configured or delayed). The stream ends once the
+    checkout is COMPLETED or CANCELED.
+
+    ?timeout= bounds the whole wait, but one response lasts at most
+    STREAM_WINDOW_S so a waiting till never pins a worker thread. The
+    browser's EventSource reconnects by itself when a window closes, sending
+    back the event id, which carries when the wait started.
+    """
+    if checkout_id not in square_payment_sessions:
+        return jsonify({'status': 'error', 'error': 'Unknown checkout'}), 404
+    timeout = min(request.args.get('timeout', 300, type=int), 1800)
+    now = time.time()
+    try:
+        started = min(max(int(request.headers.get('Last-Event-ID', now)), now - timeout), now)
+    except ValueError:
+        started = now
+
+    def sse(event, data):
+        return f"id: {started:.0f}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+    def generate():
+        yield f'retry: 1000\nid: {started:.0f}\n\n'
+        last_status = None
+        last_change = last_sent = last_poll = time.time()
+        deadline = started + timeout
+        window_end = min(time.time() + STREAM_WINDOW_S, deadline)
+        while True:
+            now = time.time()
+            payment_session = square_payment_sessions.get(checkout_id)
+            if payment_session is None:
+                yield sse('error', {'checkout_id': checkout_id, 'error': 'Checkout session expired'})
+                return
+            status = payment_session.get('status')
+            if status != last_status:
+                last_status = status
+                last_change = last_sent = now
+                yield sse('status', {
+                    'checkout_id': checkout_id,
+                    'status': status,
+                    'payment_id': payment_session.get('payment_id')
+                })
+            if status in TERMINAL_CHECKOUT_FINAL_STATUSES:
+                return
+            if now >= deadline:
+                yield sse('timeout', {'checkout_id': checkout_id, 'status': status})
+                return
+            if now >= window_end:
+                return
+            if now - last_change > 20 and now - last_poll > 10:
+                # Fallback for a missing webhook; updates the session as a side effect
+                last_poll = now
+                get_terminal_checkout_status(checkout_id)
+                continue
+            if now - last_sent >= 15:
+                last_sent = now
+                yield ': keepalive\n\n'
+            time.sleep(0.5)
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
 
 # ==================== AUTHENTICATION ENDPOINTS ====================
 
@@ -1692,7 +1904,7 @@ def youtube_search():
             'key': youtube_api_key
         }
         
-        response = requests.get(search_url, params=params)
+        response = http_client.get(search_url, params=params)
         
         if response.status_code != 200:
             return jsonify({'status': 'error', 'error': f'YouTube API error: {response.status_code}'}), response.status_code
@@ -2130,42 +2342,233 @@ def create_record():
         conn.close()
         return jsonify({'status': 'error', 'error': f"Database error: {str(e)}"}), 500
 
+
+BULK_RECORD_LIMIT = 1000
+
+def load_record_lookups(cursor):
+    """Condition, format and location lookups for validating many records with three queries"""
+    cursor.execute('SELECT id, condition_name, abbreviation FROM d_condition')
+    conditions = {}
+    condition_ids = set()
+    for row in cursor.fetchall():
+        condition_ids.add(row['id'])
+        conditions[row['condition_name'].lower()] = row['id']
+        if row['abbreviation']:
+            conditions.setdefault(row['abbreviation'].lower(), row['id'])
+    cursor.execute('SELECT id, name FROM formats')
+    formats = {row['name'].lower(): row['id'] for row in cursor.fetchall()}
+    cursor.execute('SELECT id, name FROM locations')
+    locations = {row['name'].lower(): row['id'] for row in cursor.fetchall()}
+    return {
+        'conditions': conditions,
+        'condition_ids': condition_ids,
+        'formats': formats,
+        'format_ids': set(formats.values()),
+        'locations': locations,
+        'location_ids': set(locations.values())
+    }
+
+
+def normalize_bulk_record(data, lookups, default_batch_id):
+    """Validate one /records/bulk row. Returns (insert params, list of errors)."""
+    errors = []
+    if not isinstance(data, dict):
+        return None, ['Row must be an object']
+
+    for field in ('artist', 'title'):
+        if not str(data.get(field) or '').strip():
+            errors.append(f'{field} is required')
+
+    try:
+        store_price = float(data.get('store_price'))
+        if store_price < 0:
+            errors.append('store_price must not be negative')
+    except (TypeError, ValueError):
+        store_price = None
+        errors.append('store_price is required and must be a number')
+
+    batch_id = data.get('batch_id') or default_batch_id
+    if not batch_id:
+        errors.append('batch_id must be a valid draft ID')
+
+    def resolve(id_value, name_value, by_name, valid_ids, label):
+        if id_value not in (None, ''):
+            try:
+                id_value = int(id_value)
+            except (TypeError, ValueError):
+                errors.append(f'{label} id must be an integer')
+                return None
+            if id_value not in valid_ids:
+                errors.append(f'Unknown {label} id: {id_value}')
+            return id_value
+        if name_value:
+            resolved = by_name.get(str(name_value).strip().lower())
+            if resolved is None:
+                errors.append(f'Unknown {label}: {name_value}')
+            return resolved
+        return None
+
+    # 'condition' sets both sleeve and disc, as in create_record()
+    condition = data.get('condition')
+    condition_sleeve_id = resolve(data.get('condition_sleeve_id'), data.get('sleeve_condition') or condition,
+                                  lookups['conditions'], lookups['condition_ids'], 'condition')
+    condition_disc_id = resolve(data.get('condition_disc_id'), data.get('disc_condition') or condition,
+                                lookups['conditions'], lookups['condition_ids'], 'condition')
+    format_id = resolve(data.get('format_id'), data.get('format'), lookups['formats'], lookups['format_ids'], 'format')
+    location_id = resolve(data.get('location_id'), data.get('location'), lookups['locations'],
+                          lookups['location_ids'], 'location')
+
+    commission_rate = data.get('commission_rate')
+    try:
+        commission_rate = float(commission_rate) if commission_rate else None
+        status_id = int(data.get('status_id', 1))
+    except (TypeError, ValueError):
+        errors.append('commission_rate and status_id must be numbers')
+
+    if errors:
+        return None, list(dict.fromkeys(errors))
+
+    return (
+        str(data.get('artist')).strip(),
+        str(data.get('title')).strip(),
+        data.get('barcode', '') or '',
+        data.get('image_url', '') or '',
+        data.get('catalog_number', '') or '',
+        condition_sleeve_id,
+        condition_disc_id,
+        store_price,
+        data.get('consignor_id'),
+        commission_rate,
+        status_id,
+        data.get('discogs_genre_raw', '') or '',
+        data.get('notes', '') or '',
+        batch_id,
+        format_id,
+        location_id,
+        data.get('location_index')
+    ), []
+
+
+@app.route('/records/bulk', methods=['POST'])
+@login_required
+@role_required(['admin'])
+def create_records_bulk():
+    """
+    Insert a whole intake batch in one transaction.
+
+    Body: {"records": [...], "batch_id": default draft id, "allow_partial": false}.
+    Rows take the same fields as POST /records; condition, format and location
+    may also be given by name. Every row is validated before anything is
+    written. Unless allow_partial is set, any invalid row rejects the whole
+    batch. Returns ids and barcodes in input order (the barcode falls back to
+    the record id, which is what the labels print).
+    Store-credit trade-ins still go through POST /records.
+    """
+    data = request.get_json(silent=True)
+    if isinstance(data, list):
+        data = {'records': data}
+    if not data or not isinstance(data.get('records'), list) or not data['records']:
+        return jsonify({'status': 'error', 'error': 'records must be a non-empty list'}), 400
+
+    rows = data['records']
+    if len(rows) > BULK_RECORD_LIMIT:
+        return jsonify({'status': 'error', 'error': f'At most {BULK_RECORD_LIMIT} records per request'}), 400
+    allow_partial = bool(data.get('allow_partial'))
+
+    conn = get_db()
+    conn.isolation_level = None
+    cursor = conn.cursor()
+    try:
+        start = time.time()
+        lookups = load_record_lookups(cursor)
+
+        params = []
+        valid_indexes = []
+        errors = []
+        for index, row in enumerate(rows):
+            row_params, row_errors = normalize_bulk_record(row, lookups, data.get('batch_id'))
+            if row_errors:
+                errors.append({'index': index, 'errors': row_errors})
+            else:
+                params.append(row_params)
+                valid_indexes.append(index)
+
+        if errors and not allow_partial:
+            conn.close()
+            return jsonify({
+                'status': 'error',
+                'error': f'{len(errors)} of {len(rows)} records failed validation - nothing was saved',
+                'errors': errors
+            }), 400
+
+        created = []
+        if params:
+            # The write lock is held from here to COMMIT, so the new ids are exactly those above max_id
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('SELECT COALESCE(MAX(id), 0) FROM records')
+            max_id = cursor.fetchone()[0]
+            cursor.executemany('''
+                INSERT INTO records (
+                    artist, title, barcode, image_url, catalog_number,
+                    condition_sleeve_id, condition_disc_id, store_price,
+                    consignor_id, commission_rate, status_id, discogs_genre_raw, notes,
+                    batch_id, format_id, location_id, location_index,
+                    created_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ''', params)
+            cursor.execute('SELECT id, barcode FROM records WHERE id > ? ORDER BY id', (max_id,))
+            inserted = cursor.fetchall()
+            if len(inserted) != len(params):
+                raise RuntimeError(f'Expected {len(params)} new records, found {len(inserted)}')
+            cursor.execute('COMMIT')
+
+            for index, row in zip(valid_indexes, inserted):
+                created.append({
+                    'index': index,
+                    'id': row['id'],
+                    'barcode': row['barcode'] or str(row['id'])
+                })
+
+        conn.close()
+        app.logger.info(f"Bulk intake: {len(created)} records inserted, {len(errors)} rejected "
+                        f"in {(time.time() - start) * 1000:.0f}ms")
+        return jsonify({
+            'status': 'success',
+            'inserted': len(created),
+            'records': created,
+            'errors': errors,
+            'message': f'{len(created)} records added'
+        })
+
+    except Exception as e:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        conn.close()
+        app.logger.error(f"Error in bulk record insert: {str(e)}")
+        app.logger.error(traceback.format_exc())
+        return jsonify({'status': 'error', 'error': f"Database error: {str(e)}"}), 500
+
 @app.route('/records', methods=['GET'])
+@response_cache.cached(RECORD_LISTING_TABLES)
 def get_records():
     """Get records with filtering, pagination, and a generic search."""
     try:
+        # ---------- Projection (?fields=) ----------
+        try:
+            projection = record_fields.parse(request.args.get('fields'), RECORDS_FIELDS)
+        except FieldSelectionError as e:
+            return jsonify(e.to_dict()), e.status_code
+
         conn = get_db()
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
 
-        # ---------- Base query (all joins) ----------
-        # ADDED: LEFT JOIN locations to get genre_id
-        base_query = """
-            SELECT 
-                r.*,
-                f.name AS format_name,
-                s.status_name AS status_name,
-                l.name AS location_name,
-                l.genre_id,                     -- <-- ADD THIS LINE
-                cd.condition_name AS disc_condition_name,
-                cd.abbreviation AS disc_abbr,
-                cd.quality_index AS disc_quality,
-                cs.condition_name AS sleeve_condition_name,
-                cs.abbreviation AS sleeve_abbr,
-                cs.quality_index AS sleeve_quality,
-                cd.display_name AS disc_display,
-                cs.display_name AS sleeve_display,
-                CASE 
-                    WHEN cd.quality_index IS NOT NULL AND cs.quality_index IS NOT NULL 
-                    THEN (cd.quality_index + cs.quality_index) / 2.0 
-                    ELSE NULL 
-                END AS combined_quality
+        # ---------- Base query ----------
+        # Format, status, location and condition names come from the dimension
+        # cache (record_fields.apply) instead of five joins per row
+        base_query = f"""
+            SELECT {projection.select_sql}
             FROM records r
-            LEFT JOIN formats f ON r.format_id = f.id
-            LEFT JOIN d_status s ON r.status_id = s.id
-            LEFT JOIN locations l ON r.location_id = l.id       -- <-- ADD THIS JOIN
-            LEFT JOIN d_condition cd ON r.condition_disc_id = cd.id
-            LEFT JOIN d_condition cs ON r.condition_sleeve_id = cs.id
             WHERE 1=1
         """
 
@@ -2244,10 +2647,14 @@ def get_records():
         if genre_ids_param:
             ids = [int(x.strip()) for x in genre_ids_param.split(',') if x.strip()]
             if ids:
-                placeholders = ','.join(['?'] * len(ids))
-                # Filter by locations.genre_id (joined table)
-                where_clauses.append(f"l.genre_id IN ({placeholders})")
-                params.extend(ids)
+                # Filter by locations.genre_id, resolved to location ids from the cache
+                location_ids = dimensions.location_ids_for_genres(ids)
+                if location_ids:
+                    placeholders = ','.join(['?'] * len(location_ids))
+                    where_clauses.append(f"r.location_id IN ({placeholders})")
+                    params.extend(location_ids)
+                else:
+                    where_clauses.append("1 = 0")
 
         # --- Legacy 'genres' filter (string-based, OR LIKE on discogs_genre_raw) ---
         genres = request.args.get('genres')
@@ -2299,7 +2706,7 @@ def get_records():
             where_sql = ""
 
         # ---------- Count query (no ORDER BY / LIMIT / OFFSET) ----------
-        count_query = f"SELECT COUNT(*) AS total FROM records r LEFT JOIN locations l ON r.location_id = l.id WHERE 1=1 {where_sql}"
+        count_query = f"SELECT COUNT(*) AS total FROM records r WHERE 1=1 {where_sql}"
         cursor.execute(count_query, params)
         total = cursor.fetchone()['total']
 
@@ -2328,16 +2735,16 @@ def get_records():
         # ---------- Final query ----------
         final_query = base_query + where_sql + order_sql + pagination_sql
         cursor.execute(final_query, params)
-        records = [dict(row) for row in cursor.fetchall()]
-
-        conn.close()
 
-        return jsonify({
-            'status': 'success',
-            'total': total,
-            'count': len(records),
-            'records': records
-        })
+        # Large exports stream from the cursor; rows are decorated a chunk at a time
+        return json_list_response(
+            cursor, 'records',
+            head={'status': 'success', 'total': total},
+            columnar=wants_columnar(request.args),
+            prepare=lambda chunk: record_fields.apply(conn, chunk, projection),
+            on_close=conn.close,
+            default=app.json.default
+        )
 
     except Exception as e:
         print(f"❌ Error in get_records: {e}")
@@ -2495,31 +2902,16 @@ def get_markup_analysis():
 
         chart_max_days = max(max(record_ages) if record_ages else 0, max_rule_days, 365) + 30
 
-        def get_markup(days):
-            if days <= rules_list[0][0]:
-                return rules_list[0][1]
-            if days >= rules_list[-1][0]:
-                return rules_list[-1][1]
-            for i in range(len(rules_list)-1):
-                x1, y1 = rules_list[i]
-                x2, y2 = rules_list[i+1]
-                if x1 <= days <= x2:
-                    if x2 == x1:
-                        return y1
-                    t = (days - x1) / (x2 - x1)
-                    return y1 + t * (y2 - y1)
-            return rules_list[-1][1]
-
         curve_points = []
         for d in range(0, chart_max_days + 1):
             curve_points.append({
                 'days': d,
-                'markup_percent': round(get_markup(d), 1)
+                'markup_percent': round(markup_for_age(rules_list, d), 1)
             })
 
         distribution = {}
         for age in record_ages:
-            markup = get_markup(age)
+            markup = markup_for_age(rules_list, age)
             bucket = round(markup / 5) * 5
             label = f"+{bucket}%" if bucket >= 0 else f"{bucket}%"
             distribution[label] = distribution.get(label, 0) + 1
@@ -2552,9 +2944,8 @@ def get_markup_analysis():
         return jsonify({'status': 'error', 'error': str(e)}), 500
 
 
-# Create upload folder for bills of sale if not exists
+# Upload folder for bills of sale (created by create_app)
 BILLS_UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'static', 'uploads', 'bills')
-os.makedirs(BILLS_UPLOAD_FOLDER, exist_ok=True)
 
 def parse_purchase_from_journal(entry):
     """
@@ -3107,6 +3498,8 @@ def upload_bill_of_sale():
         # Return the relative URL path
         file_url = f"/static/uploads/bills/{filename}"
         app.logger.info(f"File saved to: {filepath}")
+        # Resized copies double as previews and drop EXIF (GPS, device) from photos of bills
+        image_derivatives.enqueue(file_url)
         
         return jsonify({
             'status': 'success',
@@ -3175,6 +3568,10 @@ def search_records():
     query = request.args.get('q', '').strip()
     if not query:
         return jsonify({'status': 'error', 'error': 'Search query required'}), 400
+    try:
+        projection = record_fields.parse(request.args.get('fields'), SEARCH_FIELDS)
+    except FieldSelectionError as e:
+        return jsonify(e.to_dict()), e.status_code
     
     conn = get_db()
     cursor = conn.cursor()
@@ -3184,16 +3581,9 @@ def search_records():
     if is_numeric:
         id_value = int(query)
         
-        cursor.execute('''
-            SELECT r.*, s.status_name, cs.condition_name as sleeve_condition_name, cd.condition_name as disc_condition_name,
-            f.name as format_name,
-            l.name as location_name
+        cursor.execute(f'''
+            SELECT {projection.select_sql}
             FROM records r
-            LEFT JOIN d_status s ON r.status_id = s.id
-            LEFT JOIN d_condition cs ON r.condition_sleeve_id = cs.id
-            LEFT JOIN d_condition cd ON r.condition_disc_id = cd.id
-            LEFT JOIN formats f ON r.format_id = f.id
-            LEFT JOIN locations l ON r.location_id = l.id
             WHERE r.id = ? OR r.barcode = ?
             ORDER BY 
                 CASE 
@@ -3207,35 +3597,17 @@ def search_records():
     else:
         search_term = f'%{query}%'
         
-        cursor.execute('''
-            SELECT r.*, s.status_name, cs.condition_name as sleeve_condition_name, cd.condition_name as disc_condition_name,
-            f.name as format_name,
-            l.name as location_name
+        cursor.execute(f'''
+            SELECT {projection.select_sql}
             FROM records r
-            LEFT JOIN d_status s ON r.status_id = s.id
-            LEFT JOIN d_condition cs ON r.condition_sleeve_id = cs.id
-            LEFT JOIN d_condition cd ON r.condition_disc_id = cd.id
-            LEFT JOIN formats f ON r.format_id = f.id
-            LEFT JOIN locations l ON r.location_id = l.id
             WHERE r.artist LIKE ? OR r.title LIKE ? OR r.catalog_number LIKE ?
             ORDER BY r.created_at DESC
         ''', (search_term, search_term, search_term))
     
-    records = cursor.fetchall()
-    conn.close()
-    
-    records_list = []
-    for record in records:
-        record_dict = dict(record)
-        if record_dict.get('sleeve_condition_name'):
-            record_dict['condition'] = record_dict['sleeve_condition_name']
-        records_list.append(record_dict)
-    
-    return jsonify({
-        'status': 'success', 
-        'records': records_list, 
-        'count': len(records_list)
-    })
+    return json_list_response(cursor, 'records', head={'status': 'success'},
+                              columnar=wants_columnar(request.args),
+                              prepare=lambda chunk: record_fields.apply(conn, chunk, projection),
+                              on_close=conn.close, default=app.json.default)
 
 
 
@@ -3258,6 +3630,137 @@ def get_records_count():
 
 
 
+# ==================== RECORDS DELTA SYNC ====================
+
+RECORDS_CHANGES_COMPACT_INTERVAL = 24 * 3600
+
+
+def schedule_records_changes_compaction(delay=0):
+    """Queue the next change-log compaction unless one is already waiting"""
+    try:
+        if not job_queue.list(status='queued', job_type='records.compact_changes', limit=1):
+            job_queue.enqueue('records.compact_changes', delay=delay)
+    except sqlite3.OperationalError as e:
+        # No jobs table yet (database not migrated)
+        app.logger.warning(f"Could not schedule records_changes compaction: {str(e)}")
+
+
+@job_queue.register('records.compact_changes', public=False)
+def compact_records_changes_job(job):
+    """Drop superseded change-log entries and old delete tombstones, then schedule the next run"""
+    try:
+        return record_changes.compact()
+    finally:
+        schedule_records_changes_compaction(delay=RECORDS_CHANGES_COMPACT_INTERVAL)
+
+
+@app.route('/records/changes', methods=['GET'])
+def get_records_changes():
+    """
+    Records changed since a change-log version, for clients that keep a local copy.
+    
+    Query params:
+        since: Last version the client has applied (0 = everything)
+        limit: Changed records per page (default 5000, max 20000)
+        fields: Record fields for upserted rows, as for /records (id is always included)
+        format: 'columnar' for columns + rows instead of objects
+    
+    Returns upserts (current rows), deletes (record ids) and version, the
+    since for the next call; has_more means call again right away. reset
+    means changes before since were compacted: reload from since=0.
+    """
+    try:
+        since = request.args.get('since', type=int)
+        if since is None or since < 0:
+            return jsonify({'status': 'error', 'error': 'since must be a non-negative integer version'}), 400
+        limit = record_changes.clamp_limit(request.args.get('limit', type=int))
+        
+        fields_param = request.args.get('fields')
+        if fields_param and 'id' not in [f.strip() for f in fields_param.split(',')]:
+            fields_param = 'id,' + fields_param
+        try:
+            projection = record_fields.parse(fields_param, RECORDS_FIELDS)
+        except FieldSelectionError as e:
+            return jsonify(e.to_dict()), e.status_code
+        
+        if record_changes.needs_reset(since):
+            return jsonify({
+                'status': 'success',
+                'reset': True,
+                'since': since,
+                'latest': record_changes.horizon(),
+                'error': 'Changes before this version have been compacted; reload from since=0'
+            })
+        
+        conn = get_db()
+        cursor = conn.cursor()
+        # One read transaction: deletes and upserts come from the same snapshot
+        cursor.execute('BEGIN')
+        deletes, version, latest, has_more = record_changes.page(conn, since, limit)
+        cursor.execute(record_changes.upsert_sql(projection.select_sql), (since, limit))
+        
+        return json_list_response(
+            cursor, 'upserts',
+            head={'status': 'success', 'reset': False, 'since': since, 'version': version,
+                  'latest': latest, 'has_more': has_more, 'deletes': deletes},
+            columnar=wants_columnar(request.args),
+            prepare=lambda chunk: record_fields.apply(conn, chunk, projection),
+            on_close=conn.close,
+            default=app.json.default
+        )
+    
+    except Exception as e:
+        app.logger.error(f"Error reading records changes: {str(e)}")
+        app.logger.error(traceback.format_exc())
+        return jsonify({'status': 'error', 'error': str(e)}), 500
+
+
+@app.route('/records/changes/compact', methods=['POST'])
+@login_required
+@role_required(['admin'])
+def compact_records_changes():
+    """Compact the records change log now; returns counts and the new reset horizon"""
+    try:
+        return jsonify({'status': 'success', **record_changes.compact()})
+    except Exception as e:
+        app.logger.error(f"Error compacting records changes: {str(e)}")
+        return jsonify({'status': 'error', 'error': str(e)}), 500
+
+
+@app.route('/api/kiosk/catalog', methods=['GET'])
+def get_kiosk_catalog():
+    """
+    Every active record with the fields the kiosk displays, as one gzip'd
+    columnar document ({version, columns, rows}) for local search.
+    
+    Updated from the records change log on request and served with an ETag:
+    send If-None-Match to get a 304 when nothing changed. Clients that do not
+    accept gzip get the same document uncompressed. The two encodings are
+    different bytes, so each has its own strong ETag (the gzip one ends in
+    -gzip) and a cache never serves one as the other.
+    """
+    try:
+        etag, body = kiosk_catalog.snapshot()
+        gzipped = 'gzip' in request.accept_encodings
+        if gzipped:
+            etag = f'{etag}-gzip'
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        elif gzipped:
+            response = Response(body, mimetype='application/json')
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = Response(gzip.decompress(body), mimetype='application/json')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+    except Exception as e:
+        app.logger.error(f"Error building kiosk catalog: {str(e)}")
+        app.logger.error(traceback.format_exc())
+        return jsonify({'status': 'error', 'error': str(e)}), 500
+
+
 @app.route('/records/update-status', methods=['POST'])
 def update_records_status():
     data = request.get_json()
@@ -3310,18 +3813,15 @@ def get_user_records(user_id):
 # ==================== CONDITIONS ENDPOINTS ====================
 
 @app.route('/api/conditions', methods=['GET'])
+@response_cache.cached(['d_condition'], vary=lambda: session.get('role', ''))
 def get_conditions():
     try:
         user_role = request.args.get('role', session.get('role', 'admin'))
-        conn = get_db()
-        cursor = conn.cursor()
+        conditions = dimensions.rows('d_condition')
         if user_role == 'consignor':
-            cursor.execute('SELECT id, condition_name, display_name, abbreviation, description, quality_index FROM d_condition WHERE is_consignor_allowed = 1 ORDER BY quality_index')
-        else:
-            cursor.execute('SELECT id, condition_name, display_name, abbreviation, description, quality_index FROM d_condition ORDER BY quality_index')
-        conditions = cursor.fetchall()
-        conn.close()
-        return jsonify({'status': 'success', 'conditions': [dict(c) for c in conditions]})
+            conditions = [c for c in conditions if c.get('is_consignor_allowed') == 1]
+        columns = ('id', 'condition_name', 'display_name', 'abbreviation', 'description', 'quality_index')
+        return jsonify({'status': 'success', 'conditions': [{k: c.get(k) for k in columns} for c in conditions]})
     except Exception as e:
         return jsonify({'status': 'error', 'error': str(e)}), 500
 
@@ -3331,26 +3831,14 @@ def get_conditions():
 
 @app.route('/config', methods=['GET'])
 def get_all_config():
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT config_key, config_value, description FROM app_config ORDER BY config_key')
-    configs = cursor.fetchall()
-    conn.close()
+    configs = dimensions.rows('app_config')
     config_dict = {row['config_key']: {'value': row['config_value'], 'description': row['description']} for row in configs}
     return jsonify({'status': 'success', 'configs': config_dict})
 
 
 @app.route('/config/<config_key>', methods=['GET'])
 def get_config(config_key):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT config_value FROM app_config WHERE config_key = ?', (config_key,))
-    result = cursor.fetchone()
-    conn.close()
-    if result:
-        return jsonify({'status': 'success', 'config_value': result['config_value']})
-    else:
-        return jsonify({'status': 'success', 'config_value': None})
+    return jsonify({'status': 'success', 'config_value': dimensions.config(config_key)})
 
 
 @app.route('/config/<config_key>', methods=['PUT'])
@@ -3368,6 +3856,7 @@ def update_config(config_key):
         cursor.execute('INSERT INTO app_config (config_key, config_value) VALUES (?, ?)', (config_key, config_value))
     conn.commit()
     conn.close()
+    dimensions.invalidate('app_config')
     return jsonify({'status': 'success', 'message': 'Config updated'})
 
 
@@ -3375,15 +3864,19 @@ def update_config(config_key):
 
 @app.route('/statuses', methods=['GET'])
 def get_statuses():
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, status_name, description FROM d_status ORDER BY id')
-    statuses = cursor.fetchall()
-    conn.close()
-    return jsonify({'status': 'success', 'count': len(statuses), 'statuses': [dict(s) for s in statuses]})
+    statuses = [{k: s.get(k) for k in ('id', 'status_name', 'description')} for s in dimensions.rows('d_status')]
+    return jsonify({'status': 'success', 'count': len(statuses), 'statuses': statuses})
 
 
 
+def add_condition_alias(records):
+    """Consignor listings show the sleeve grade as 'condition'"""
+    for record in records:
+        if record.get('sleeve_condition_name'):
+            record['condition'] = record['sleeve_condition_name']
+    return records
+
+
 @app.route('/api/consignor/records', methods=['GET'])
 @role_required(['consignor', 'admin'])
 def get_consignor_records():
@@ -3420,25 +3913,17 @@ def get_consignor_records():
             WHERE r.consignor_id = ?
             ORDER BY r.created_at DESC
         ''', (session['user_id'],))
-    records = cursor.fetchall()
-    conn.close()
-    records_list = []
-    for record in records:
-        record_dict = dict(record)
-        if record_dict.get('sleeve_condition_name'):
-            record_dict['condition'] = record_dict['sleeve_condition_name']
-        records_list.append(record_dict)
-    return jsonify({'status': 'success', 'count': len(records_list), 'records': records_list})
+    return json_list_response(cursor, 'records', head={'status': 'success'},
+                              columnar=wants_columnar(request.args),
+                              prepare=add_condition_alias, on_close=conn.close,
+                              default=app.json.default)
 
 @app.route('/api/genres', methods=['GET'])
+@response_cache.cached(['genres'])
 def get_genres():
     """Get all genres from the genres table"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, name FROM genres ORDER BY name')
-    genres = cursor.fetchall()
-    conn.close()
-    return jsonify({'status': 'success', 'genres': [dict(g) for g in genres]})
+    genres = [{'id': g['id'], 'name': g['name']} for g in dimensions.rows('genres')]
+    return jsonify({'status': 'success', 'genres': genres})
 
 
 @app.route('/consignment/records', methods=['GET'])
@@ -3513,11 +3998,6 @@ def discogs_search_proxy():
     if not TOKEN:
         return jsonify({'status': 'error', 'error': 'Discogs token not configured'}), 500
     
-    headers = {
-        'Authorization': f'Discogs token={TOKEN}',
-        'User-Agent': 'PigStyleMusic/1.0'
-    }
-    
     # Map format filter to Discogs format parameter
     format_map = {
         'vinyl': 'Vinyl',
@@ -3526,24 +4006,15 @@ def discogs_search_proxy():
         'shellac': 'Shellac'
     }
     
-    params = {'q': search_term, 'type': 'release', 'per_page': 20}
-    
-    if format_filter in format_map:
-        params['format'] = format_map[format_filter]
-    
-    response = requests.get(
-        'https://api.discogs.com/database/search',
-        headers=headers,
-        params=params
-    )
-    
-    if response.status_code != 200:
-        return jsonify({'status': 'error', 'error': 'Discogs search failed'}), response.status_code
+    # Answered from the local release mirror when it has the query, catalog number or barcode
+    try:
+        search_results = discogs_mirror.search_results(search_term, format_map.get(format_filter), per_page=20)
+    except DiscogsLookupError as e:
+        return jsonify({'status': 'error', 'error': 'Discogs search failed'}), e.status_code
     
-    data = response.json()
     results = []
     
-    for item in data.get('results', []):
+    for item in search_results:
         # Get artist from response or extract from title
         artist = item.get('artist', '')
         title = item.get('title', '')
@@ -3651,6 +4122,7 @@ def health_check():
 # ==================== ACCESSORIES (MERCHANDISE) ENDPOINTS ====================
 
 @app.route('/accessories', methods=['GET'])
+@response_cache.cached(['accessories', 'image_variants'])
 def get_all_accessories():
     """Get all active accessories"""
     try:
@@ -3674,7 +4146,6 @@ def get_all_accessories():
         ''')
         
         accessories = cursor.fetchall()
-        conn.close()
         
         accessories_list = []
         for acc in accessories:
@@ -3689,6 +4160,8 @@ def get_all_accessories():
                 'created_at': acc['created_at'],
                 'updated_at': acc['updated_at']
             })
+        image_derivatives.attach_srcsets(conn, accessories_list)
+        conn.close()
         
         return jsonify({
             'status': 'success',
@@ -3794,6 +4267,7 @@ def upload_accessory_image():
         file.save(filepath)
         
         image_url = f"/static/images/misc/{unique_filename}"
+        image_derivatives.enqueue(image_url)
         
         accessory_id = request.form.get('accessory_id')
         if accessory_id:
@@ -3810,6 +4284,36 @@ def upload_accessory_image():
         return jsonify({'status': 'error', 'error': str(e)}), 500
 
 
+@app.route('/api/admin/images/derivatives/backfill', methods=['POST'])
+@login_required
+@role_required(['admin'])
+def backfill_image_derivatives():
+    """Queue WebP/AVIF derivative generation for accessory and record images that have none yet"""
+    try:
+        if not image_derivatives.available:
+            return jsonify({'status': 'error', 'error': 'Pillow with WebP support is not installed'}), 503
+
+        conn = get_db()
+        cursor = conn.cursor()
+        cursor.execute("SELECT image_url FROM accessories WHERE image_url IS NOT NULL AND image_url != ''")
+        urls = [row['image_url'] for row in cursor.fetchall()]
+        cursor.execute("SELECT image_url FROM records WHERE image_url IS NOT NULL AND image_url != '' ORDER BY created_at DESC")
+        urls.extend(row['image_url'] for row in cursor.fetchall())
+        conn.close()
+
+        queued = image_derivatives.backfill(urls)
+        return jsonify({
+            'status': 'success',
+            'queued': queued,
+            'formats': image_derivatives.formats,
+            'widths': list(image_derivatives.WIDTHS)
+        })
+
+    except Exception as e:
+        app.logger.error(f"Error backfilling image derivatives: {str(e)}")
+        return jsonify({'status': 'error', 'error': str(e)}), 500
+
+
 @app.route('/accessories/<int:accessory_id>', methods=['GET'])
 def get_accessory(accessory_id):
     """Get a single accessory by ID"""
@@ -4534,14 +5038,14 @@ def admin_execute_query():
         # Log the query for audit
         app.logger.info(f"Admin user {session.get('username')} executing query: {query[:200]}")
         
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        start_time = datetime.now()
+        mode = data.get('mode', 'execute')
+        output_format = data.get('format', 'json')
+        max_rows, timeout_ms = query_console.clamp_limits(data.get('max_rows'), data.get('timeout_ms'))
+        query_id = data.get('query_id')
         
         # Determine query type
         query_type = 'UNKNOWN'
-        if query_upper.startswith('SELECT'):
+        if query_upper.startswith(('SELECT', 'WITH', 'VALUES')):
             query_type = 'SELECT'
         elif query_upper.startswith('INSERT'):
             query_type = 'INSERT'
@@ -4553,83 +5057,80 @@ def admin_execute_query():
             query_type = 'PRAGMA'
         
         try:
-            if query_type == 'SELECT':
-                cursor.execute(query)
-                results = cursor.fetchall()
-                # Convert to list of dicts
-                results_list = [dict(row) for row in results]
-                
-                execution_time = (datetime.now() - start_time).total_seconds() * 1000
-                
-                response_data = {
-                    'status': 'success',
-                    'query_type': 'SELECT',
-                    'results': results_list,
-                    'row_count': len(results_list),
-                    'execution_time': round(execution_time, 2)
-                }
-                
-                response = jsonify(response_data)
-                response.headers.add('Access-Control-Allow-Origin', 'http://localhost:8000')
-                response.headers.add('Access-Control-Allow-Credentials', 'true')
-                return response
-                
-            elif query_type in ['INSERT', 'UPDATE', 'DELETE']:
-                cursor.execute(query)
-                conn.commit()
-                affected_rows = cursor.rowcount
-                
-                execution_time = (datetime.now() - start_time).total_seconds() * 1000
-                
-                response_data = {
+            if query_type == 'PRAGMA':
+                query_console.check_pragma(query)
+            
+            if mode == 'explain':
+                result = query_console.explain(query, timeout_ms)
+                response = jsonify({
                     'status': 'success',
-                    'query_type': query_type,
-                    'affected_rows': affected_rows,
-                    'execution_time': round(execution_time, 2),
-                    'message': f'{query_type} executed successfully'
-                }
-                
-                # For INSERT, also return the last insert ID if available
-                if query_type == 'INSERT' and cursor.lastrowid:
-                    response_data['last_insert_id'] = cursor.lastrowid
-                
-                response = jsonify(response_data)
+                    'query_type': 'EXPLAIN',
+                    **result
+                })
                 response.headers.add('Access-Control-Allow-Origin', 'http://localhost:8000')
                 response.headers.add('Access-Control-Allow-Credentials', 'true')
                 return response
-                
-            elif query_type == 'PRAGMA':
-                cursor.execute(query)
-                results = cursor.fetchall()
-                results_list = [dict(row) for row in results]
-                
-                response = jsonify({
-                    'status': 'success',
-                    'query_type': 'PRAGMA',
-                    'results': results_list,
-                    'row_count': len(results_list)
-                })
+            
+            if query_type in ['SELECT', 'PRAGMA'] and output_format == 'ndjson':
+                # Stream rows in chunks from a read-only connection
+                response = Response(
+                    stream_with_context(query_console.stream_ndjson(query, max_rows, timeout_ms, query_id)),
+                    mimetype='application/x-ndjson'
+                )
                 response.headers.add('Access-Control-Allow-Origin', 'http://localhost:8000')
                 response.headers.add('Access-Control-Allow-Credentials', 'true')
+                response.headers['X-Accel-Buffering'] = 'no'
                 return response
-                
-            else:
-                # Try to execute anyway for other query types
-                cursor.execute(query)
-                conn.commit()
-                
+            
+            if query_type in ['SELECT', 'PRAGMA'] or query_console.is_read_query(query):
+                result = query_console.execute_read(query, max_rows, timeout_ms, query_id)
                 response = jsonify({
                     'status': 'success',
-                    'query_type': 'UNKNOWN',
-                    'message': 'Query executed successfully',
-                    'affected_rows': cursor.rowcount
+                    'query_type': query_type if query_type != 'UNKNOWN' else 'SELECT',
+                    **result
                 })
                 response.headers.add('Access-Control-Allow-Origin', 'http://localhost:8000')
                 response.headers.add('Access-Control-Allow-Credentials', 'true')
                 return response
+            
+            result = query_console.execute_write(query, timeout_ms, query_id)
+            response_data = {
+                'status': 'success',
+                'query_type': query_type,
+                'query_id': result['query_id'],
+                'affected_rows': result['affected_rows'],
+                'execution_time': result['execution_time'],
+                'message': f'{query_type} executed successfully' if query_type != 'UNKNOWN' else 'Query executed successfully'
+            }
+            
+            # For INSERT, also return the last insert ID if available
+            if query_type == 'INSERT' and result['last_insert_id']:
+                response_data['last_insert_id'] = result['last_insert_id']
+            
+            response = jsonify(response_data)
+            response.headers.add('Access-Control-Allow-Origin', 'http://localhost:8000')
+            response.headers.add('Access-Control-Allow-Credentials', 'true')
+            return response
                 
+        except QueryCancelled as e:
+            response = jsonify({
+                'status': 'error',
+                'message': str(e)
+            })
+            response.headers.add('Access-Control-Allow-Origin', 'http://localhost:8000')
+            response.headers.add('Access-Control-Allow-Credentials', 'true')
+            return response, 408
+        
+        except QueryNotAllowed as e:
+            response = jsonify({
+                'status': 'error',
+                'message': str(e)
+            })
+            response.headers.add('Access-Control-Allow-Origin', 'http://localhost:8000')
+            response.headers.add('Access-Control-Allow-Credentials', 'true')
+            return response, 400
+            
         except sqlite3.Error as e:
-            conn.rollback()
             response = jsonify({
                 'status': 'error',
                 'message': f'SQL Error: {str(e)}'
@@ -4637,9 +5138,6 @@ def admin_execute_query():
             response.headers.add('Access-Control-Allow-Origin', 'http://localhost:8000')
             response.headers.add('Access-Control-Allow-Credentials', 'true')
             return response, 400
-            
-        finally:
-            conn.close()
         
     except Exception as e:
         app.logger.error(f"Error executing admin query: {str(e)}")
@@ -4652,6 +5150,15 @@ def admin_execute_query():
         response.headers.add('Access-Control-Allow-Credentials', 'true')
         return response, 500
 
+@app.route('/api/admin/execute-query/<query_id>/cancel', methods=['POST'])
+@role_required(['admin'])
+def admin_cancel_query(query_id):
+    """Cancel a running admin console query"""
+    if not query_console.cancel(query_id):
+        return jsonify({'status': 'error', 'message': 'Query is not running'}), 404
+    app.logger.info(f"Admin user {session.get('username')} cancelled query {query_id}")
+    return jsonify({'status': 'success', 'query_id': query_id})
+
 # ==================== STATS ENDPOINTS ====================
 
 @app.route('/api/stats/top-artists', methods=['GET'])
@@ -4789,6 +5296,7 @@ def get_sales_over_time_daily_stats():
 
 
 @app.route('/api/locations', methods=['GET'])
+@response_cache.cached(['locations'])
 def get_locations():
     """Get all locations from the locations table"""
     try:
@@ -4963,9 +5471,6 @@ def delete_markup_rule(rule_id):
 @app.route('/api/price-estimate-v3', methods=['POST'])
 def price_estimate_v3():
     """Price estimate - uses Discogs price suggestions directly"""
-    import requests
-    import re
-    
     app.logger.info("=" * 60)
     app.logger.info("🔍 PRICE ESTIMATE V3 CALLED")
     
@@ -4987,160 +5492,90 @@ def price_estimate_v3():
     if not discogs_token:
         return jsonify({'status': 'error', 'error': 'DISCOGS_USER_TOKEN not configured'}), 500
     
-    headers = {
-        'User-Agent': 'PigStyleMusic/1.0',
-        'Authorization': f'Discogs token={discogs_token}'
-    }
-    
-    # Step 1: Search for release
-    app.logger.info(f"🔍 Searching for catalog: {catalog_number}")
-    search_url = "https://api.discogs.com/database/search"
-    params = {'q': catalog_number, 'type': 'release', 'per_page': 10}
-    
-    search_response = requests.get(search_url, headers=headers, params=params, timeout=10)
-    
-    if search_response.status_code != 200:
-        return jsonify({'status': 'error', 'error': f'Discogs search failed: {search_response.status_code}'}), 500
-    
-    search_data = search_response.json()
-    results = search_data.get('results', [])
-    
-    if not results:
-        return jsonify({'status': 'error', 'error': f'No release found for catalog: {catalog_number}'}), 404
-    
-    # Find exact catalog match
-    release = None
-    catalog_normalized = catalog_number.lower().replace(' ', '').replace('-', '')
-    
-    for result in results:
-        catno = result.get('catno', '').lower().replace(' ', '').replace('-', '')
-        if catalog_normalized in catno:
-            release = result
-            break
-    
-    if not release:
-        return jsonify({
-            'status': 'error',
-            'error': f'No exact match for: {catalog_number}',
-            'suggestions': [r.get('catno', '') for r in results[:5]]
-        }), 404
-    
-    release_id = release['id']
-    app.logger.info(f"✅ Found release ID: {release_id}")
-    
-    # Step 2: Get price suggestions - THIS RETURNS CONDITION-SPECIFIC PRICES!
-    app.logger.info(f"💰 Getting price suggestions for release: {release_id}")
-    price_url = f"https://api.discogs.com/marketplace/price_suggestions/{release_id}"
-    
-    price_response = requests.get(price_url, headers=headers, timeout=10)
-    
-    if price_response.status_code != 200:
-        return jsonify({
-            'status': 'error',
-            'error': f'Failed to get price suggestions: {price_response.status_code}'
-        }), 500
-    
-    price_data = price_response.json()
-    
-    if not price_data:
-        return jsonify({
-            'status': 'error',
-            'error': f'No price data available for release {release_id}'
-        }), 404
-    
-    # Step 3: Get the price for the specific condition
-    # Map user-friendly condition names to Discogs condition names
-    condition_map = {
-        'mint': 'Mint (M)',
-        'near mint': 'Near Mint (NM or M-)',
-        'very good plus': 'Very Good Plus (VG+)',
-        'very good': 'Very Good (VG)',
-        'good plus': 'Good Plus (G+)',
-        'good': 'Good (G)',
-        'fair': 'Fair (F)',
-        'poor': 'Poor (P)'
-    }
-    
-    # Clean the media condition input
-    media_clean = media_condition.lower().strip()
-    media_clean = re.sub(r'\s*\([^)]*\)', '', media_clean).strip()
-    
-    # Find matching condition key
-    condition_key = None
-    for key in condition_map:
-        if key in media_clean:
-            condition_key = condition_map[key]
-            break
-    
-    if not condition_key:
-        return jsonify({
-            'status': 'error',
-            'error': f'Unknown condition: {media_condition}',
-            'valid_conditions': list(condition_map.values())
-        }), 400
-    
-    # Get the price for the condition
-    if condition_key not in price_data:
-        return jsonify({
-            'status': 'error',
-            'error': f'No price data for condition: {condition_key}',
-            'available_conditions': list(price_data.keys())
-        }), 404
-    
-    condition_price = price_data[condition_key]
-    estimated_price = condition_price.get('value')
-    
-    if estimated_price is None or estimated_price == 0:
-        return jsonify({
-            'status': 'error',
-            'error': f'Price is $0 for condition: {condition_key}'
-        }), 404
-    
-    app.logger.info(f"💰 Price for {condition_key}: ${estimated_price}")
-    
-    # Step 4: Get community stats for confidence
-    stats_url = f"https://api.discogs.com/releases/{release_id}/stats"
-    stats_response = requests.get(stats_url, headers=headers, timeout=10)
-    stats = stats_response.json() if stats_response.status_code == 200 else {}
-    
-    wants = stats.get('community', {}).get('want', 0)
-    haves = stats.get('community', {}).get('have', 0)
-    
-    # Calculate confidence based on community data
-    confidence = 50  # Base confidence
-    if wants > 0:
-        confidence += 10
-    if haves > 0:
-        confidence += 10
-    if wants > 100:
-        confidence += 10
-    if haves > 100:
-        confidence += 10
-    
-    # Get min and max prices from all conditions
-    all_prices = [data.get('value', 0) for data in price_data.values() if data.get('value')]
-    min_price = min(all_prices) if all_prices else estimated_price
-    max_price = max(all_prices) if all_prices else estimated_price
-    
-    result = {
-        'status': 'success',
-        'catalog_number': catalog_number,
-        'release_id': release_id,
-        'condition': condition_key,
-        'estimated_price': round(estimated_price, 2),
-        'price_range_low': round(min_price, 2),
-        'price_range_high': round(max_price, 2),
-        'confidence_score': min(confidence, 100),
-        'condition_multiplier': 1.0,  # Not needed since Discogs gives condition-specific prices
-        'demand_adjustment': 1.0,  # Not needed
-        'base_median_price': round(estimated_price, 2),
-        'want_have_ratio': round(wants / haves, 2) if haves > 0 else 0,
-        'num_sales': 0  # Not available from price_suggestions
-    }
+    # Search, then price suggestions and community stats in parallel (see PriceEstimateHandler)
+    app.logger.info(f"🔍 Estimating catalog: {catalog_number}")
+    try:
+        result = price_estimator.estimate(catalog_number, media_condition)
+    except PriceEstimateError as e:
+        return jsonify(e.to_dict()), e.status_code
     
-    app.logger.info(f"✅ Returning price: ${result['estimated_price']}")
+    app.logger.info(f"✅ Returning price: ${result['estimated_price']} for release {result['release_id']} "
+                    f"in {result['estimate_time']}ms{'' if result['stats_complete'] else ' (without stats)'}")
     return jsonify(result)
 
+@app.route('/api/price-estimate/batch', methods=['POST'])
+@login_required
+@role_required(['admin'])
+def price_estimate_batch():
+    """
+    Price a whole purchase lot. Accepts a JSON list (or {"rows": [...]}), CSV
+    text/csv, or an uploaded CSV file with catalog_number, media_condition and
+    sleeve_condition columns. Streams one NDJSON line per row as it finishes
+    (format=json returns them all at once, in input order). Each priced row
+    carries store_price ready for the purchase draft.
+    """
+    try:
+        if not os.environ.get('DISCOGS_USER_TOKEN'):
+            return jsonify({'status': 'error', 'error': 'DISCOGS_USER_TOKEN not configured'}), 500
+
+        if 'file' in request.files:
+            payload = request.files['file'].read().decode('utf-8-sig')
+        elif request.mimetype in ('text/csv', 'text/plain'):
+            payload = request.get_data(as_text=True)
+        else:
+            payload = request.get_json(silent=True)
+            if isinstance(payload, dict):
+                payload = payload.get('rows')
+
+        rows = price_estimator.parse_batch_rows(payload)
+        if not rows:
+            return jsonify({'status': 'error', 'error': 'No rows provided'}), 400
+        if len(rows) > 1000:
+            return jsonify({'status': 'error', 'error': 'At most 1000 rows per batch'}), 400
+
+        max_workers = max(1, min(request.args.get('concurrency', 4, type=int), 8))
+        output_format = request.args.get('format', 'ndjson')
+        app.logger.info(f"💰 Batch price estimate: {len(rows)} rows, concurrency {max_workers}")
+
+        if output_format == 'json':
+            start = time.time()
+            results = sorted(price_estimator.estimate_batch(rows, max_workers), key=lambda r: r['index'])
+            return jsonify({
+                'status': 'success',
+                'results': results,
+                'total': len(results),
+                'priced': sum(1 for r in results if r['status'] == 'success'),
+                'execution_time': round((time.time() - start) * 1000, 2)
+            })
+
+        def generate():
+            start = time.time()
+            priced = failed = 0
+            for result in price_estimator.estimate_batch(rows, max_workers):
+                if result['status'] == 'success':
+                    priced += 1
+                else:
+                    failed += 1
+                yield json.dumps({'type': 'row', **result}, default=str) + '\n'
+            yield json.dumps({
+                'type': 'end',
+                'total': len(rows),
+                'priced': priced,
+                'failed': failed,
+                'execution_time': round((time.time() - start) * 1000, 2)
+            }) + '\n'
+
+        response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+    except PriceEstimateError as e:
+        return jsonify(e.to_dict()), e.status_code
+    except Exception as e:
+        app.logger.error(f"Error in batch price estimate: {str(e)}")
+        app.logger.error(traceback.format_exc())
+        return jsonify({'status': 'error', 'error': str(e)}), 500
+
 # ==================== SUBSCRIPTION ENDPOINTS ====================
 
  
@@ -6368,6 +6803,8 @@ def get_plaid_client():
     env = os.environ.get('PLAID_ENV', 'sandbox')
     if not client_id or not secret:
         raise Exception("PLAID_CLIENT_ID or PLAID_SECRET not configured")
+    import plaid
+    from plaid.api import plaid_api
     host = plaid.Environment.Production if env == 'production' else plaid.Environment.Sandbox
     configuration = plaid.Configuration(host=host, api_key={'clientId': client_id, 'secret': secret})
     api_client = plaid.ApiClient(configuration)
@@ -6396,6 +6833,7 @@ def set_plaid_access_token(token, item_id=None, institution_name=None):
         cursor.execute("UPDATE app_config SET config_value = ? WHERE config_key = 'plaid_institution_name'", (institution_name,))
     conn.commit()
     conn.close()
+    dimensions.invalidate('app_config')
 
 # ===== CATEGORISATION RULES FUNCTIONS =====
 
@@ -6420,6 +6858,7 @@ def apply_rule(rule_id, dry_run=False):
     cursor.execute('SELECT * FROM categorisation_rules WHERE id = ?', (rule_id,))
     rule = cursor.fetchone()
     if not rule:
+        conn.close()
         raise Exception("Rule not found")
 
     pattern = rule['pattern'].upper()
@@ -6447,35 +6886,83 @@ def apply_rule(rule_id, dry_run=False):
     processed_count = 0
     # Get cash account for historic transactions
     cash_id = get_cash_account_id('historic')
-    for tx in matched:
-        amount_cents = int(round(tx['amount'] * 100))
-        # Create journal entry with source_type 'historic'
-        cursor.execute('''
-            INSERT INTO journal_entries (transaction_date, description, source_type, source_id)
-            VALUES (?, ?, ?, ?)
-        ''', (tx['transaction_date'], f"Bank expense: {tx['description']}", 'historic', str(tx['id'])))
-        entry_id = cursor.lastrowid
-
-        # Debit expense account
-        cursor.execute('''
-            INSERT INTO journal_lines (journal_entry_id, account_id, debit_amount, credit_amount)
-            VALUES (?, ?, ?, ?)
-        ''', (entry_id, account_id, amount_cents, 0))
+    try:
+        for tx in matched:
+            amount_cents = int(round(tx['amount'] * 100))
+            # Create journal entry with source_type 'historic'
+            cursor.execute('''
+                INSERT INTO journal_entries (transaction_date, description, source_type, source_id)
+                VALUES (?, ?, ?, ?)
+            ''', (tx['transaction_date'], f"Bank expense: {tx['description']}", 'historic', str(tx['id'])))
+            entry_id = cursor.lastrowid
 
-        # Credit cash account (specific to historic)
-        cursor.execute('''
-            INSERT INTO journal_lines (journal_entry_id, account_id, debit_amount, credit_amount)
-            VALUES (?, ?, ?, ?)
-        ''', (entry_id, cash_id, 0, amount_cents))
+            # Debit expense account
+            cursor.execute('''
+                INSERT INTO journal_lines (journal_entry_id, account_id, debit_amount, credit_amount)
+                VALUES (?, ?, ?, ?)
+            ''', (entry_id, account_id, amount_cents, 0))
 
-        # Mark processed
-        cursor.execute('UPDATE bank_transactions SET processed = 1 WHERE id = ?', (tx['id'],))
-        processed_count += 1
+            # Credit cash account (specific to historic)
+            cursor.execute('''
+                INSERT INTO journal_lines (journal_entry_id, account_id, debit_amount, credit_amount)
+                VALUES (?, ?, ?, ?)
+            ''', (entry_id, cash_id, 0, amount_cents))
 
-    conn.commit()
-    conn.close()
+            # Mark processed
+            cursor.execute('UPDATE bank_transactions SET processed = 1 WHERE id = ?', (tx['id'],))
+            processed_count += 1
+        conn.commit()
+    except Exception:
+        # Roll back so a failed rule does not leave the database write-locked
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
     return {'transactions': matched, 'count': processed_count}
 
+
+@job_queue.register('accounting.apply_rules')
+def apply_rules_job(job):
+    """Apply categorisation rules (payload rule_ids, default: all active) one after another"""
+    rule_ids = job.payload.get('rule_ids') or [rule['id'] for rule in get_categorisation_rules(active_only=True)]
+    dry_run = bool(job.payload.get('dry_run'))
+    results = []
+    for i, rule_id in enumerate(rule_ids):
+        if job.cancelled:
+            raise JobError(f'Cancelled after {i} of {len(rule_ids)} rules', retry=False)
+        job.progress(i / len(rule_ids), f'Applying rule {rule_id} ({i + 1}/{len(rule_ids)})')
+        try:
+            outcome = apply_rule(rule_id, dry_run=dry_run)
+            results.append({'rule_id': rule_id, 'count': outcome['count']})
+        except Exception as e:
+            app.logger.error(f"Error applying rule {rule_id}: {str(e)}")
+            results.append({'rule_id': rule_id, 'count': 0, 'error': str(e)})
+    return {
+        'status': 'success',
+        'dry_run': dry_run,
+        'rules': results,
+        'count': sum(r['count'] for r in results)
+    }
+
+
+@app.route('/api/accounting/rules/apply', methods=['POST'])
+@login_required
+@role_required(['admin'])
+def apply_rules_async():
+    """Queue apply_rule for the given rule_ids (default: all active rules); returns a job id"""
+    try:
+        data = request.get_json(silent=True) or {}
+        rule_ids = data.get('rule_ids')
+        if rule_ids is not None and (not isinstance(rule_ids, list) or
+                                     not all(isinstance(r, int) for r in rule_ids)):
+            return jsonify({'status': 'error', 'error': 'rule_ids must be a list of integers'}), 400
+        job = job_queue.enqueue('accounting.apply_rules', {'rule_ids': rule_ids, 'dry_run': bool(data.get('dry_run'))},
+                                created_by=session.get('user_id'))
+        return jsonify({'status': 'success', 'job_id': job['id'], 'job': job_queue.public(job)}), 202
+    except Exception as e:
+        app.logger.error(f"Error queueing rule application: {str(e)}")
+        return jsonify({'status': 'error', 'error': str(e)}), 500
+
  
 
 def fetch_bank_transactions(date_from=None, date_to=None):
@@ -6499,6 +6986,8 @@ def fetch_bank_transactions(date_from=None, date_to=None):
     else:
         start_date = datetime.strptime(date_from, '%Y-%m-%d').date()
 
+    from plaid.model.transactions_get_request import TransactionsGetRequest
+    from plaid.model.transactions_get_request_options import TransactionsGetRequestOptions
     request = TransactionsGetRequest(
         access_token=access_token,
         start_date=start_date,
@@ -6550,66 +7039,105 @@ def accounting_get_bank_transactions():
  
 # ==================== DISCOGS ORDERS ENDPOINTS ====================
 
+# Orders are served from the local store (handlers/discogs_orders_handler.py); older than this, a sync is queued
+DISCOGS_ORDERS_MAX_AGE = int(os.environ.get('DISCOGS_ORDERS_MAX_AGE', 300))
+
+# GET /api/discogs/orders used to run as a job itself; orders now come from discogs.sync_orders
+job_queue.retire('discogs.fetch_orders', 'GET /api/discogs/orders no longer runs as a job; '
+                                         'it reads the local orders store (see discogs.sync_orders)')
+
+
+@job_queue.register('discogs.sync_orders', max_attempts=3, priority=5)
+def sync_discogs_orders_job(job):
+    """Pull new and changed Discogs orders into discogs_orders (payload full=true re-reads every page)"""
+    token = os.environ.get('DISCOGS_USER_TOKEN')
+    if not token:
+        raise JobError('Discogs token not configured', retry=False)
+    try:
+        return discogs_orders.sync(DiscogsHandler(token, http=http_client),
+                                   full=bool(job.payload.get('full')), progress=job.progress)
+    except Exception as e:
+        discogs_orders.record_failure(str(e))
+        raise
+
+
+def queue_discogs_orders_sync(full=False):
+    """Queue a sync unless one is already waiting or running; returns the job"""
+    for status in ('running', 'queued'):
+        pending = job_queue.list(status=status, job_type='discogs.sync_orders', limit=1)
+        if pending:
+            return pending[0]
+    return job_queue.enqueue('discogs.sync_orders', {'full': full})
+
+
 @app.route('/api/discogs/orders', methods=['GET'])
 def get_discogs_orders():
     """
-    Get orders from Discogs API.
+    Get Discogs orders from the local store.
     
     Query params:
         status: Filter by status (New, Paid, Shipped, etc.)
+        date_from, date_to: Filter on the order's created date (YYYY-MM-DD)
+        search: Order id, buyer, or item artist/title
         page: Page number (default: 1)
         per_page: Items per page (default: 50, max: 100)
-        all: If 'true', fetch all pages (default: false)
+        all: If 'true', return every matching order (default: false)
+        refresh: If 'true', sync from Discogs before answering
+    
+    The first request (empty store) and refresh=true sync inline; otherwise
+    a stale store is answered as is and a background sync is queued.
     """
     try:
-        # Check if Discogs token exists
-        TOKEN = os.environ.get('DISCOGS_USER_TOKEN')
-        if not TOKEN:
-            return jsonify({
-                'status': 'error',
-                'error': 'Discogs token not configured'
-            }), 500
-        
-        # Get query parameters
         status = request.args.get('status')
         page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 50, type=int)
+        per_page = min(max(request.args.get('per_page', 50, type=int), 1), 100)
         fetch_all = request.args.get('all', 'false').lower() == 'true'
-        
-        # Initialize Discogs handler
-        handler = DiscogsHandler(TOKEN)
-        
-        if fetch_all:
-            # Fetch all orders (handles pagination internally)
-            orders = handler.get_all_orders(status=status)
-            
-            return jsonify({
-                'status': 'success',
-                'orders': orders,
-                'total': len(orders),
-                'pagination': {
-                    'page': 1,
-                    'per_page': len(orders),
-                    'pages': 1,
-                    'items': len(orders)
-                }
-            })
-        else:
-            # Fetch a single page
-            result = handler.get_orders(status=status, page=page, per_page=per_page)
-            
-            if not result['success']:
+        refresh = request.args.get('refresh', 'false').lower() == 'true'
+        
+        sync = discogs_orders.sync_state()
+        sync_job = None
+        if refresh or not sync or not sync.get('synced_ts'):
+            # Check if Discogs token exists
+            TOKEN = os.environ.get('DISCOGS_USER_TOKEN')
+            if not TOKEN:
                 return jsonify({
                     'status': 'error',
-                    'error': result.get('error', 'Failed to fetch orders')
+                    'error': 'Discogs token not configured'
                 }), 500
+            try:
+                sync = discogs_orders.sync(DiscogsHandler(TOKEN, http=http_client))
+            except Exception as e:
+                discogs_orders.record_failure(str(e))
+                raise
+        elif discogs_orders.is_stale(DISCOGS_ORDERS_MAX_AGE):
+            sync_job = queue_discogs_orders_sync()
+        
+        orders, total = discogs_orders.list(
+            status=status,
+            date_from=request.args.get('date_from'),
+            date_to=request.args.get('date_to'),
+            search=(request.args.get('search') or '').strip() or None,
+            page=page,
+            per_page=None if fetch_all else per_page
+        )
+        
+        if fetch_all:
+            pagination = {'page': 1, 'per_page': total, 'pages': 1, 'items': total}
+        else:
+            pagination = {'page': page, 'per_page': per_page, 'pages': (total + per_page - 1) // per_page,
+                          'items': total}
+        
+        return jsonify({
+            'status': 'success',
+            'orders': orders,
+            'total': total,
+            'pagination': pagination,
+            'synced_at': sync.get('synced_at'),
+            'sync_job_id': sync_job['id'] if sync_job else None
+        })
             
-            return jsonify({
-                'status': 'success',
-                'orders': result['orders'],
-                'pagination': result['pagination']
-            })
-            
+    except DiscogsOrdersError as e:
+        return jsonify(e.to_dict()), e.status_code
     except Exception as e:
         app.logger.error(f"Error fetching Discogs orders: {str(e)}")
         app.logger.error(traceback.format_exc())
@@ -6619,58 +7147,55 @@ def get_discogs_orders():
         }), 500
 
 
+@app.route('/api/discogs/orders/sync', methods=['POST'])
+@login_required
+@role_required(['admin'])
+def sync_discogs_orders():
+    """Queue a Discogs orders sync ({"full": true} re-reads every page); returns the job and last sync state"""
+    try:
+        data = request.get_json(silent=True) or {}
+        job = queue_discogs_orders_sync(full=bool(data.get('full')))
+        return jsonify({
+            'status': 'success',
+            'job_id': job['id'],
+            'job': job_queue.public(job),
+            'sync': discogs_orders.sync_state()
+        }), 202
+    except Exception as e:
+        app.logger.error(f"Error queueing Discogs orders sync: {str(e)}")
+        return jsonify({'status': 'error', 'error': str(e)}), 500
+
+
 @app.route('/api/discogs/orders/<order_id>', methods=['GET'])
 @login_required
 @role_required(['admin'])
 def get_discogs_order_detail(order_id):
     """
-    Get detailed information for a specific Discogs order.
-    Adds record_status_id for each item (if the PigStyle ID is found).
+    Get detailed information for a specific Discogs order from the local store.
+    Each item carries record_id (from its PIGSTYLE ID tag) and record_status_id.
+    An order not synced yet is fetched from Discogs and stored.
     """
     try:
-        TOKEN = os.environ.get('DISCOGS_USER_TOKEN')
-        if not TOKEN:
-            return jsonify({
-                'status': 'error',
-                'error': 'Discogs token not configured'
-            }), 500
-        
-        handler = DiscogsHandler(TOKEN)
-        result = handler.get_order_details(order_id)
-        
-        if not result['success']:
-            return jsonify({
-                'status': 'error',
-                'error': result.get('error', 'Failed to fetch order')
-            }), 500
-        
-        order = result['order']
-        items = order.get('items', [])
-        
-        # Connect to DB to lookup record status by PigStyle ID
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        for item in items:
-            # Extract PigStyle ID from condition_comments
-            condition_comments = item.get('condition_comments', '')
-            pigstyle_id = None
-            if condition_comments:
-                match = re.search(r'\[PIGSTYLE ID:\s*(\d+)\]', condition_comments, re.IGNORECASE)
-                if match:
-                    pigstyle_id = int(match.group(1))
+        order = discogs_orders.get(order_id)
+        if order is None:
+            TOKEN = os.environ.get('DISCOGS_USER_TOKEN')
+            if not TOKEN:
+                return jsonify({
+                    'status': 'error',
+                    'error': 'Discogs token not configured'
+                }), 500
             
-            if pigstyle_id:
-                cursor.execute('SELECT status_id FROM records WHERE id = ?', (pigstyle_id,))
-                row = cursor.fetchone()
-                if row:
-                    item['record_status_id'] = row['status_id']
-                else:
-                    item['record_status_id'] = None
-            else:
-                item['record_status_id'] = None
-        
-        conn.close()
+            handler = DiscogsHandler(TOKEN, http=http_client)
+            result = handler.get_order_details(order_id)
+            
+            if not result['success']:
+                return jsonify({
+                    'status': 'error',
+                    'error': result.get('error', 'Failed to fetch order')
+                }), 500
+            
+            discogs_orders.store_orders([result['order']])
+            order = discogs_orders.get(order_id)
         
         return jsonify({
             'status': 'success',
@@ -6686,6 +7211,151 @@ def get_discogs_order_detail(order_id):
         }), 500
 
 
+# ==================== DISCOGS INVENTORY ====================
+
+@job_queue.register('discogs.sync_inventory', max_attempts=3, priority=5)
+def sync_discogs_inventory_job(job):
+    """Replace discogs_listings with the shop's current Discogs inventory"""
+    try:
+        return discogs_inventory.sync(progress=job.progress)
+    except DiscogsInventoryError as e:
+        discogs_inventory.record_failure(str(e))
+        raise JobError(str(e), e.status_code, retry=e.status_code >= 500)
+    except Exception as e:
+        discogs_inventory.record_failure(str(e))
+        raise
+
+
+@job_queue.register('discogs.inventory_actions', priority=5)
+def discogs_inventory_actions_job(job):
+    """Apply a batch of listing update/delete actions; the result reports each one"""
+    return discogs_inventory.apply(job.payload['actions'], progress=job.progress,
+                                   cancelled=lambda: job.cancelled)
+
+
+@app.route('/api/discogs/inventory', methods=['GET'])
+@login_required
+@role_required(['admin'])
+def get_discogs_inventory():
+    """
+    Listings from the local inventory mirror.
+    
+    Query params:
+        status: Listing status (For Sale, Draft, Expired, ...)
+        record_id, release_id: Filter by PigStyle record or Discogs release
+        page, per_page: Paging (default 1, 100; max 500)
+    """
+    try:
+        per_page = min(max(request.args.get('per_page', 100, type=int), 1), 500)
+        listings, total = discogs_inventory.list(
+            status=request.args.get('status'),
+            record_id=request.args.get('record_id', type=int),
+            release_id=request.args.get('release_id', type=int),
+            page=request.args.get('page', 1, type=int),
+            per_page=per_page
+        )
+        return jsonify({
+            'status': 'success',
+            'listings': listings,
+            'total': total,
+            'sync': discogs_inventory.sync_state()
+        })
+    except Exception as e:
+        app.logger.error(f"Error reading Discogs inventory: {str(e)}")
+        return jsonify({'status': 'error', 'error': str(e)}), 500
+
+
+@app.route('/api/discogs/inventory/sync', methods=['POST'])
+@login_required
+@role_required(['admin'])
+def sync_discogs_inventory():
+    """Queue an inventory sync unless one is already waiting or running; returns the job"""
+    try:
+        job = None
+        for status in ('running', 'queued'):
+            pending = job_queue.list(status=status, job_type='discogs.sync_inventory', limit=1)
+            if pending:
+                job = pending[0]
+                break
+        if job is None:
+            job = job_queue.enqueue('discogs.sync_inventory', created_by=session.get('user_id'))
+        return jsonify({
+            'status': 'success',
+            'job_id': job['id'],
+            'job': job_queue.public(job),
+            'sync': discogs_inventory.sync_state()
+        }), 202
+    except Exception as e:
+        app.logger.error(f"Error queueing Discogs inventory sync: {str(e)}")
+        return jsonify({'status': 'error', 'error': str(e)}), 500
+
+
+@app.route('/api/discogs/inventory/diff', methods=['GET'])
+@login_required
+@role_required(['admin'])
+def get_discogs_inventory_diff():
+    """
+    Compare the inventory mirror with records: listed but sold locally,
+    active locally but not listed, and price drift from the markup curve.
+    
+    Query params:
+        tolerance: Dollars a listing may differ from the markup price (default 0.50)
+    
+    The returned actions can be posted as-is to /api/discogs/inventory/actions.
+    """
+    try:
+        tolerance = request.args.get('tolerance', type=float)
+        return jsonify({'status': 'success', **discogs_inventory.diff(tolerance)})
+    except Exception as e:
+        app.logger.error(f"Error diffing Discogs inventory: {str(e)}")
+        app.logger.error(traceback.format_exc())
+        return jsonify({'status': 'error', 'error': str(e)}), 500
+
+
+@app.route('/api/discogs/inventory/actions', methods=['POST'])
+@login_required
+@role_required(['admin'])
+def apply_discogs_inventory_actions():
+    """
+    Queue a batch of listing actions; returns a job whose result reports each one.
+    
+    Request body, either explicit actions:
+    {"actions": [{"action": "delete", "listing_id": 123}, {"action": "update", "listing_id": 456, "price": 24.99}]}
+    or the actions of the current diff, by reason:
+    {"from_diff": ["sold_locally", "price_drift"], "tolerance": 0.5}
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        if data.get('from_diff'):
+            if not isinstance(data['from_diff'], list) or not all(isinstance(r, str) for r in data['from_diff']):
+                raise DiscogsInventoryError('from_diff must be a list of diff reasons', 400)
+            reasons = set(data['from_diff'])
+            tolerance = data.get('tolerance')
+            if tolerance is not None:
+                try:
+                    tolerance = float(tolerance)
+                except (TypeError, ValueError):
+                    raise DiscogsInventoryError('tolerance must be a number of dollars', 400)
+            actions = [a for a in discogs_inventory.diff(tolerance)['actions'] if a['reason'] in reasons]
+            if not actions:
+                return jsonify({'status': 'success', 'job_id': None, 'message': 'Nothing to reconcile'})
+        else:
+            actions = data.get('actions')
+        actions = DiscogsInventoryHandler.validate_actions(actions)
+        job = job_queue.enqueue('discogs.inventory_actions', {'actions': actions}, created_by=session.get('user_id'))
+        return jsonify({
+            'status': 'success',
+            'job_id': job['id'],
+            'job': job_queue.public(job),
+            'actions': len(actions)
+        }), 202
+    except DiscogsInventoryError as e:
+        return jsonify(e.to_dict()), e.status_code
+    except Exception as e:
+        app.logger.error(f"Error queueing Discogs inventory actions: {str(e)}")
+        return jsonify({'status': 'error', 'error': str(e)}), 500
+
+
 @app.route('/api/records/mark-sold-on-discogs', methods=['POST'])
 @login_required
 @role_required(['admin'])
@@ -7151,7 +7821,7 @@ def mark_discogs_sold(record_id):
         
         # 5. Initialize Discogs handler
         app.logger.info(f"📡 [DISOOGS_SOLD] Initializing DiscogsHandler")
-        handler = DiscogsHandler(token)
+        handler = DiscogsHandler(token, http=http_client)
         
         # 6. Search for the record in ALL Discogs orders
         app.logger.info(f"🔍 [DISOOGS_SOLD] Searching for PIGSTYLE ID {pigstyle_id} in Discogs orders...")
@@ -7278,6 +7948,253 @@ def mark_discogs_sold(record_id):
         app.logger.error(traceback.format_exc())
         return jsonify({'status': 'error', 'error': str(e)}), 500
 
+# Discogs sales: paid into PayPal, revenue to Sales Revenue - PayPal (as in the sale entry mapping)
+DISCOGS_SALE_ACCOUNTS = {'cash': '1020', 'revenue': '4003', 'fees': '5020', 'cogs': '5000', 'inventory': '1050'}
+
+
+def discogs_sale_cogs(cursor, records, sale_prices):
+    """
+    COGS per record id, as the monthly COGS report computes it: a batch
+    record's share of the batch purchase cost by store price, otherwise the
+    new/used assumption rate applied to the sale price. None when neither
+    is available.
+    """
+    batch_ids = sorted({r['batch_id'] for r in records if r['batch_id']})
+    batch_costs, batch_totals = {}, {}
+    if batch_ids:
+        placeholders = ','.join('?' * len(batch_ids))
+        cursor.execute(f'''
+            SELECT je.id, jl.debit_amount / 100.0 AS total_cost
+            FROM journal_lines jl
+            JOIN journal_entries je ON jl.journal_entry_id = je.id
+            WHERE je.id IN ({placeholders}) AND jl.account_id = (SELECT id FROM accounts WHERE code = '1050')
+        ''', batch_ids)
+        batch_costs = {row['id']: row['total_cost'] for row in cursor.fetchall()}
+        cursor.execute(f'''
+            SELECT batch_id, SUM(store_price) AS total_store_price
+            FROM records WHERE batch_id IN ({placeholders})
+            GROUP BY batch_id
+        ''', batch_ids)
+        batch_totals = {row['batch_id']: row['total_store_price'] for row in cursor.fetchall()}
+    try:
+        new_rate, used_rate = get_cogs_rates()
+    except ValueError:
+        new_rate = used_rate = None
+
+    cogs = {}
+    for record in records:
+        cost, total = batch_costs.get(record['batch_id']), batch_totals.get(record['batch_id'])
+        if cost and total:
+            cogs[record['id']] = (record['store_price'] or 0) / total * cost
+        elif new_rate is not None:
+            is_new = record['condition_sleeve_id'] == 1 and record['condition_disc_id'] == 1
+            cogs[record['id']] = sale_prices[record['id']] * (new_rate if is_new else used_rate)
+        else:
+            cogs[record['id']] = None
+    return cogs
+
+
+def mark_discogs_sales(order_ids=(), record_ids=(), dry_run=False):
+    """
+    Mark the records sold in the given Discogs orders (or the given records)
+    as sold on Discogs and post one journal entry per order: revenue, the
+    order's Discogs fee pro rata to the items posted, and COGS. Everything
+    is written in one transaction; records already sold are skipped, so a
+    batch can safely be re-run. Returns a per-item report.
+    """
+    items = discogs_orders.find_items(order_ids, record_ids)
+    found_orders = {item['order_id'] for item in items}
+    found_records = {item['record_id'] for item in items}
+    missing = [o for o in order_ids if o not in found_orders] + [r for r in record_ids if r not in found_records]
+    token = os.environ.get('DISCOGS_USER_TOKEN')
+    if missing and token:
+        # Sales from the last few minutes may not be in the store yet
+        try:
+            discogs_orders.sync(DiscogsHandler(token, http=http_client))
+            items = discogs_orders.find_items(order_ids, record_ids)
+            found_orders = {item['order_id'] for item in items}
+            found_records = {item['record_id'] for item in items}
+        except Exception as e:
+            discogs_orders.record_failure(str(e))
+            app.logger.warning(f"Discogs orders sync before batch mark-sold failed: {str(e)}")
+
+    results = [{'order_id': o, 'status': 'skipped', 'reason': 'Order not found in Discogs orders (sync orders first)'}
+               for o in order_ids if o not in found_orders]
+    results += [{'record_id': r, 'status': 'skipped', 'reason': 'No Discogs order contains this record'}
+                for r in record_ids if r not in found_records]
+
+    candidates = {}
+    for item in items:
+        entry = {'order_id': item['order_id'], 'listing_id': item['listing_id'], 'record_id': item['record_id'],
+                 'artist': item['artist'], 'title': item['title'], 'sale_price': item['price']}
+        if item['record_id'] is None:
+            results.append(dict(entry, status='skipped', reason='Listing has no PIGSTYLE ID'))
+        elif (item['order_status'] or '').startswith(('Cancelled', 'Merged')):
+            results.append(dict(entry, status='skipped', reason=f"Order is {item['order_status']}"))
+        elif item['record_id'] in candidates:
+            continue
+        else:
+            candidates[item['record_id']] = (item, entry)
+
+    account_ids = {key: get_account_id(code) for key, code in DISCOGS_SALE_ACCOUNTS.items()}
+    missing_accounts = [DISCOGS_SALE_ACCOUNTS[key] for key, account_id in account_ids.items() if not account_id]
+    if missing_accounts:
+        raise KeyError(f"Missing account code(s): {', '.join(missing_accounts)}")
+
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        records = {}
+        ids = list(candidates)
+        for chunk_start in range(0, len(ids), 500):
+            chunk = ids[chunk_start:chunk_start + 500]
+            cursor.execute(f'''
+                SELECT id, artist, title, status_id, store_price, batch_id, condition_sleeve_id, condition_disc_id
+                FROM records WHERE id IN ({','.join('?' * len(chunk))})
+            ''', chunk)
+            records.update((row['id'], row) for row in cursor.fetchall())
+
+        to_mark = []
+        for record_id, (item, entry) in candidates.items():
+            record = records.get(record_id)
+            if record is None:
+                results.append(dict(entry, status='skipped', reason=f'Record #{record_id} not found'))
+            elif record['status_id'] in SOLD_STATUS_IDS:
+                results.append(dict(entry, status='skipped',
+                                    reason=f"Already marked as sold (status_id: {record['status_id']})"))
+            else:
+                to_mark.append((record, item, entry))
+
+        cogs = discogs_sale_cogs(cursor, [record for record, _, _ in to_mark],
+                                 {record['id']: item['price'] or 0 for record, item, _ in to_mark})
+        orders = {}
+        record_updates = []
+        for record, item, entry in to_mark:
+            sale_price = item['price'] or 0
+            subtotal = item['order_subtotal'] or 0
+            fee = (item['fee_amount'] or 0) * sale_price / subtotal if subtotal else 0
+            date_sold = (item['paid_at'] or item['created_at'] or datetime.now().strftime('%Y-%m-%d'))[:10]
+            entry.update(status='marked', fee=round(fee, 2), date_sold=date_sold,
+                         cogs=round(cogs[record['id']], 2) if cogs[record['id']] is not None else None)
+            if entry['cogs'] is None:
+                entry['warning'] = 'No batch cost or COGS rates configured; COGS not posted'
+            results.append(entry)
+            record_updates.append((sale_price, date_sold, record['id']))
+            order = orders.setdefault(item['order_id'], {'date': date_sold, 'records': [], 'sales': 0, 'fees': 0, 'cogs': 0})
+            order['records'].append(record['id'])
+            order['sales'] += int(round(sale_price * 100))
+            order['fees'] += int(round(fee * 100))
+            order['cogs'] += int(round((cogs[record['id']] or 0) * 100))
+
+        entry_ids = {}
+        if orders:
+            cursor.executemany('''
+                UPDATE records SET status_id = 4, store_price = ?, date_sold = ?
+                WHERE id = ?
+            ''', record_updates)
+            cursor.execute('SELECT COALESCE(MAX(id), 0) FROM journal_entries')
+            last_id = cursor.fetchone()[0]
+            cursor.executemany('''
+                INSERT INTO journal_entries (transaction_date, description, source_type, source_id)
+                VALUES (?, ?, ?, ?)
+            ''', [(order['date'],
+                   f"Discogs sale - Order {order_id} - records {', '.join(f'#{r}' for r in order['records'])}",
+                   'discogs_order', order_id) for order_id, order in orders.items()])
+            # The writer lock is held, so every entry above last_id is one of ours
+            cursor.execute('''
+                SELECT id, source_id FROM journal_entries
+                WHERE id > ? AND source_type = 'discogs_order'
+            ''', (last_id,))
+            entry_ids = {row['source_id']: row['id'] for row in cursor.fetchall()}
+
+            lines = []
+            for order_id, order in orders.items():
+                entry_id = entry_ids[order_id]
+                for debit, credit, amount in (('cash', 'revenue', order['sales']),
+                                              ('fees', 'cash', order['fees']),
+                                              ('cogs', 'inventory', order['cogs'])):
+                    if amount > 0:
+                        lines.append((entry_id, account_ids[debit], amount, 0))
+                        lines.append((entry_id, account_ids[credit], 0, amount))
+            cursor.executemany('''
+                INSERT INTO journal_lines (journal_entry_id, account_id, debit_amount, credit_amount)
+                VALUES (?, ?, ?, ?)
+            ''', lines)
+
+        if dry_run:
+            # The entries are rolled back and their ids will be reused, so none are reported
+            conn.rollback()
+        else:
+            conn.commit()
+            for entry in results:
+                if entry['status'] == 'marked':
+                    entry['journal_entry_id'] = entry_ids.get(entry['order_id'])
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    marked = [r for r in results if r['status'] == 'marked']
+    app.logger.info(f"Discogs batch mark-sold: {len(marked)} records marked, "
+                    f"{len(results) - len(marked)} skipped{' (dry run)' if dry_run else ''}")
+    return {
+        'status': 'success',
+        'dry_run': dry_run,
+        'marked': len(marked),
+        'skipped': len(results) - len(marked),
+        'orders': len(orders),
+        'journal_entry_ids': [] if dry_run else sorted(entry_ids.values()),
+        'total_sales': round(sum(r['sale_price'] or 0 for r in marked), 2),
+        'total_fees': round(sum(r['fee'] for r in marked), 2),
+        'total_cogs': round(sum(r['cogs'] or 0 for r in marked), 2),
+        'results': results
+    }
+
+
+@app.route('/api/records/mark-sold-on-discogs/batch', methods=['POST'])
+@login_required
+@role_required(['admin'])
+@job_queue.offloadable('discogs.mark_sold_batch')
+def mark_sold_on_discogs_batch():
+    """
+    Mark many records as sold on Discogs in one transaction.
+    
+    Request body (either or both lists):
+    {
+        "order_ids": ["123456-1", "123456-2"],
+        "record_ids": [9976, 9977],
+        "dry_run": false
+    }
+    
+    Sale price, date and fee come from the local Discogs orders store.
+    Returns a per-item report (marked / skipped with a reason).
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        order_ids = data.get('order_ids') or []
+        record_ids = data.get('record_ids') or []
+        if not isinstance(order_ids, list) or not all(isinstance(o, (str, int)) for o in order_ids):
+            return jsonify({'status': 'error', 'error': 'order_ids must be a list of Discogs order ids'}), 400
+        if not isinstance(record_ids, list) or not all(isinstance(r, int) for r in record_ids):
+            return jsonify({'status': 'error', 'error': 'record_ids must be a list of integers'}), 400
+        if not order_ids and not record_ids:
+            return jsonify({'status': 'error', 'error': 'order_ids or record_ids is required'}), 400
+        
+        report = mark_discogs_sales([str(o) for o in dict.fromkeys(order_ids)], list(dict.fromkeys(record_ids)),
+                                    dry_run=bool(data.get('dry_run')))
+        return jsonify(report)
+        
+    except KeyError as e:
+        app.logger.error(f"Error in batch mark sold on Discogs: {str(e)}")
+        return jsonify({'status': 'error', 'error': str(e).strip("'")}), 500
+    except Exception as e:
+        app.logger.error(f"Error in batch mark sold on Discogs: {str(e)}")
+        app.logger.error(traceback.format_exc())
+        return jsonify({'status': 'error', 'error': str(e)}), 500
+
+
 # ==================== ACCOUNTING: CREATE/UPDATE ACCOUNT ====================
 
 @app.route('/api/accounting/accounts', methods=['POST'])
@@ -7312,6 +8229,7 @@ def accounting_create_account():
         account_id = cursor.lastrowid
         conn.commit()
         conn.close()
+        dimensions.invalidate('accounts')
         
         return jsonify({
             'status': 'success',
@@ -7360,6 +8278,7 @@ def accounting_update_account(account_id):
         
         conn.commit()
         conn.close()
+        dimensions.invalidate('accounts')
         
         return jsonify({
             'status': 'success',
@@ -7418,6 +8337,7 @@ def accounting_delete_account(account_id):
         
         conn.commit()
         conn.close()
+        dimensions.invalidate('accounts')
         
         return jsonify({
             'status': 'success',
@@ -7812,11 +8732,12 @@ def create_square_payment_link():
             }
         }
         
-        response = requests.post(
+        response = http_client.post(
             'https://connect.squareup.com/v2/online-checkout/payment-links',
             headers=headers,
             json=payload,
-            timeout=30
+            timeout=30,
+            idempotent=True
         )
         
         if response.status_code != 200:
@@ -8595,7 +9516,7 @@ def get_payment_metadata(payment_id):
             'Square-Version': '2026-01-22'
         }
         
-        response = requests.get(
+        response = http_client.get(
             f'https://connect.squareup.com/v2/payments/{payment_id}',
             headers=headers,
             timeout=30
@@ -8608,7 +9529,7 @@ def get_payment_metadata(payment_id):
         order_id = payment.get('order_id')
         
         if order_id:
-            order_response = requests.get(
+            order_response = http_client.get(
                 f'https://connect.squareup.com/v2/orders/{order_id}',
                 headers=headers,
                 timeout=30
@@ -8641,7 +9562,7 @@ def get_order_payment(order_id):
             'Square-Version': '2026-01-22'
         }
         
-        response = requests.get(
+        response = http_client.get(
             f'https://connect.squareup.com/v2/orders/{order_id}',
             headers=headers,
             timeout=30
@@ -8691,16 +9612,19 @@ def confirm_payment():
             'Square-Version': '2026-01-22'
         }
         
-        response = requests.get(
-            f'https://connect.squareup.com/v2/payments/{payment_id}',
-            headers=headers,
-            timeout=30
-        )
-        
-        if response.status_code != 200:
-            return jsonify({'status': 'error', 'error': 'Payment not found'}), 400
-        
-        payment = response.json().get('payment', {})
+        # A completed payment already delivered by the webhook needs no round trip to Square
+        payment = square_webhooks.latest_object(payment_id, 'payment.')
+        if not payment or payment.get('status') != 'COMPLETED':
+            response = http_client.get(
+                f'https://connect.squareup.com/v2/payments/{payment_id}',
+                headers=headers,
+                timeout=30
+            )
+            
+            if response.status_code != 200:
+                return jsonify({'status': 'error', 'error': 'Payment not found'}), 400
+            
+            payment = response.json().get('payment', {})
         
         if payment.get('status') != 'COMPLETED':
             return jsonify({'status': 'error', 'error': 'Payment not completed'}), 400
@@ -8713,7 +9637,7 @@ def confirm_payment():
             # Try to get from order metadata
             order_id = payment.get('order_id')
             if order_id:
-                order_response = requests.get(
+                order_response = http_client.get(
                     f'https://connect.squareup.com/v2/orders/{order_id}',
                     headers=headers,
                     timeout=30
@@ -9629,7 +10553,6 @@ def bank_square():
     unprocessed_only = request.args.get('unprocessed_only')
 
     from datetime import datetime, timedelta
-    import requests
 
     access_token = os.environ.get('SQUARE_ACCESS_TOKEN')
     if not access_token:
@@ -9651,7 +10574,7 @@ def bank_square():
     }
 
     try:
-        response = requests.get(url, headers=headers, params=params, timeout=30)
+        response = http_client.get(url, headers=headers, params=params, timeout=30)
         if response.status_code != 200:
             return jsonify({'status': 'error', 'error': f'Square API error: {response.status_code}'}), response.status_code
         data = response.json()
@@ -9984,6 +10907,7 @@ def accounting_reconciliation_report():
 @app.route('/api/accounting/reconcile/init', methods=['GET'])
 @login_required
 @role_required(['admin'])
+@job_queue.offloadable('accounting.reconcile_init', priority=10)
 def accounting_reconcile_init():
     """
     Initialize reconciliation: fetch Square transactions, fetch bank transactions
@@ -9998,6 +10922,7 @@ def accounting_reconcile_init():
     # ============================================================
     # 1. FETCH SQUARE TRANSACTIONS
     # ============================================================
+    report_progress(0.0, 'Fetching Square payments')
     access_token = os.environ.get('SQUARE_ACCESS_TOKEN')
     if not access_token:
         app.logger.error("[RECONCILE] SQUARE_ACCESS_TOKEN not configured")
@@ -10022,7 +10947,7 @@ def accounting_reconcile_init():
     app.logger.info(f"[SQUARE] Fetching payments from {params['begin_time']} to {params['end_time']}")
     
     try:
-        response = requests.get(url, headers=headers, params=params, timeout=30)
+        response = http_client.get(url, headers=headers, params=params, timeout=30)
     except requests.exceptions.RequestException as e:
         app.logger.error(f"[SQUARE] Request failed: {e}")
         return jsonify({'status': 'error', 'error': str(e)}), 500
@@ -10103,6 +11028,7 @@ def accounting_reconcile_init():
     # ============================================================
     # 2. FETCH BANK TRANSACTIONS (DIRECT - Plaid + Historic)
     # ============================================================
+    report_progress(0.3, 'Fetching bank transactions')
     
     # 2a. Get Plaid transactions (live from Plaid)
     plaid_transactions = []
@@ -10215,6 +11141,7 @@ def accounting_reconcile_init():
     # ============================================================
     # 5. AUTO-MATCH SQUARE BATCHES TO BANK DEPOSITS
     # ============================================================
+    report_progress(0.7, 'Matching Square batches to bank deposits')
     matched_count = 0
     
     # Get all unreconciled square batches
@@ -10564,6 +11491,7 @@ def upload_purchase_bill(purchase_id):
         file.save(filepath)
 
         bill_path = f"/static/uploads/bills/{filename}"
+        image_derivatives.enqueue(bill_path)
 
         # Update purchase record
         cursor.execute('''
@@ -10729,16 +11657,16 @@ def plaid_paypal_create_link_token():
     try:
         client_id = os.environ.get('PLAID_CLIENT_ID')
         secret = os.environ.get('PLAID_SECRET')
-        env = os.environ.get('PLAID_ENV', 'sandbox')
         
         if not client_id or not secret:
             return jsonify({'status': 'error', 'error': 'Plaid not configured'}), 500
         
-        host = plaid.Environment.Production if env == 'production' else plaid.Environment.Sandbox
-        configuration = plaid.Configuration(host=host, api_key={'clientId': client_id, 'secret': secret})
-        api_client = plaid.ApiClient(configuration)
-        client = plaid_api.PlaidApi(api_client)
+        client = get_plaid_client()
         
+        from plaid.model.country_code import CountryCode
+        from plaid.model.link_token_create_request import LinkTokenCreateRequest
+        from plaid.model.link_token_create_request_user import LinkTokenCreateRequestUser
+        from plaid.model.products import Products
         request = LinkTokenCreateRequest(
             user=LinkTokenCreateRequestUser(client_user_id=str(session['user_id'])),
             client_name="PigStyle Music",
@@ -10767,16 +11695,13 @@ def plaid_paypal_exchange():
         
         client_id = os.environ.get('PLAID_CLIENT_ID')
         secret = os.environ.get('PLAID_SECRET')
-        env = os.environ.get('PLAID_ENV', 'sandbox')
         
         if not client_id or not secret:
             return jsonify({'status': 'error', 'error': 'Plaid not configured'}), 500
         
-        host = plaid.Environment.Production if env == 'production' else plaid.Environment.Sandbox
-        configuration = plaid.Configuration(host=host, api_key={'clientId': client_id, 'secret': secret})
-        api_client = plaid.ApiClient(configuration)
-        client = plaid_api.PlaidApi(api_client)
+        client = get_plaid_client()
         
+        from plaid.model.item_public_token_exchange_request import ItemPublicTokenExchangeRequest
         exchange_request = ItemPublicTokenExchangeRequest(public_token=public_token)
         response = client.item_public_token_exchange(exchange_request)
         
@@ -10793,6 +11718,7 @@ def plaid_paypal_exchange():
         
         conn.commit()
         conn.close()
+        dimensions.invalidate('app_config')
         
         return jsonify({'status': 'success', 'item_id': item_id})
         
@@ -10832,6 +11758,9 @@ def bank_paypal():
     
     # Use Plaid to fetch transactions
     client = get_plaid_client()
+    from plaid.exceptions import ApiException
+    from plaid.model.transactions_get_request import TransactionsGetRequest
+    from plaid.model.transactions_get_request_options import TransactionsGetRequestOptions
     
     end_date = datetime.now().date()
     start_date = end_date - timedelta(days=90)
@@ -10847,7 +11776,7 @@ def bank_paypal():
         response = client.transactions_get(plaid_request)
         transactions = response['transactions']
         app.logger.info(f"[PAYPAL] Fetched {len(transactions)} transactions from Plaid")
-    except plaid.ApiException as e:
+    except ApiException as e:
         app.logger.error(f"[PAYPAL] Plaid error: {str(e)}")
         return jsonify({
             'status': 'error',
@@ -10933,9 +11862,74 @@ def bank_paypal():
     })
 
 
+def fetch_square_balance():
+    """Net available Square balance in dollars (gross - fees - refunds - payouts), fetched live"""
+    access_token = os.environ.get('SQUARE_ACCESS_TOKEN')
+    environment = os.environ.get('SQUARE_ENVIRONMENT', 'production')
+    base_url = 'https://connect.squareupsandbox.com' if environment == 'sandbox' else 'https://connect.squareup.com'
+
+    headers = {
+        'Authorization': f'Bearer {access_token}',
+        'Content-Type': 'application/json',
+        'Square-Version': '2026-01-22'
+    }
+
+    total_net_credits = 0
+
+    # ---- 1. Fetch all COMPLETED payments ----
+    payments_url = f'{base_url}/v2/payments'
+    params = {'limit': 200, 'status': 'COMPLETED'}
+
+    while payments_url:
+        resp = http_client.get(payments_url, headers=headers, params=params, timeout=30)
+        resp.raise_for_status()
+        data = resp.json()
+
+        for payment in data.get('payments', []):
+            amount = payment.get('amount_money', {}).get('amount', 0)
+            fees = sum(fee.get('amount_money', {}).get('amount', 0) for fee in payment.get('processing_fee', []))
+            refunds = payment.get('refunded_money', {}).get('amount', 0)
+            total_net_credits += amount - fees - refunds
+
+        cursor = data.get('cursor')
+        if cursor:
+            params['cursor'] = cursor
+        else:
+            break
+
+    total_payouts = 0
+
+    # ---- 2. Fetch all payouts (no status filter) ----
+    payouts_url = f'{base_url}/v2/payouts'
+    params = {'limit': 200}
+
+    while payouts_url:
+        resp = http_client.get(payouts_url, headers=headers, params=params, timeout=30)
+        resp.raise_for_status()
+        data = resp.json()
+
+        for payout in data.get('payouts', []):
+            # Include both SENT and PAID statuses (completed transfers)
+            if payout.get('status') in ('SENT', 'PAID'):
+                total_payouts += payout.get('amount_money', {}).get('amount', 0)
+
+        cursor = data.get('cursor')
+        if cursor:
+            params['cursor'] = cursor
+        else:
+            break
+
+    # Net available balance in dollars
+    return (total_net_credits - total_payouts) / 100.0
+
+
 @app.route('/api/accounting/external/square/balance', methods=['GET', 'OPTIONS'])
 def get_square_balance():
-    """Fetch the net available balance from Square (gross - fees - refunds - payouts)."""
+    """
+    Net available Square balance. Served from the balance cache: a stale
+    value comes back immediately while it refreshes in the background;
+    ?refresh=true waits for a live fetch.
+    """
     # Handle preflight CORS
     if request.method == 'OPTIONS':
         response = jsonify({'status': 'ok'})
@@ -10966,64 +11960,10 @@ def get_square_balance():
             response.headers.add('Access-Control-Allow-Credentials', 'true')
             return response, 500
 
-        environment = os.environ.get('SQUARE_ENVIRONMENT', 'production')
-        base_url = 'https://connect.squareupsandbox.com' if environment == 'sandbox' else 'https://connect.squareup.com'
-
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json',
-            'Square-Version': '2026-01-22'
-        }
-
-        total_net_credits = 0
-
-        # ---- 1. Fetch all COMPLETED payments ----
-        payments_url = f'{base_url}/v2/payments'
-        params = {'limit': 200, 'status': 'COMPLETED'}
-
-        while payments_url:
-            resp = requests.get(payments_url, headers=headers, params=params, timeout=30)
-            resp.raise_for_status()
-            data = resp.json()
+        refresh = request.args.get('refresh', 'false').lower() == 'true'
+        cached = external_balances.get('square', 'square', fetch_square_balance, refresh=refresh)
 
-            for payment in data.get('payments', []):
-                amount = payment.get('amount_money', {}).get('amount', 0)
-                fees = sum(fee.get('amount_money', {}).get('amount', 0) for fee in payment.get('processing_fee', []))
-                refunds = payment.get('refunded_money', {}).get('amount', 0)
-                total_net_credits += amount - fees - refunds
-
-            cursor = data.get('cursor')
-            if cursor:
-                params['cursor'] = cursor
-            else:
-                break
-
-        total_payouts = 0
-
-        # ---- 2. Fetch all payouts (no status filter) ----
-        payouts_url = f'{base_url}/v2/payouts'
-        params = {'limit': 200}
-
-        while payouts_url:
-            resp = requests.get(payouts_url, headers=headers, params=params, timeout=30)
-            resp.raise_for_status()
-            data = resp.json()
-
-            for payout in data.get('payouts', []):
-                # Include both SENT and PAID statuses (completed transfers)
-                if payout.get('status') in ('SENT', 'PAID'):
-                    total_payouts += payout.get('amount_money', {}).get('amount', 0)
-
-            cursor = data.get('cursor')
-            if cursor:
-                params['cursor'] = cursor
-            else:
-                break
-
-        # Net available balance in dollars
-        available_balance = (total_net_credits - total_payouts) / 100.0
-
-        response = jsonify({'status': 'success', 'balance': available_balance})
+        response = jsonify({'status': 'success', **cached})
         response.headers.add('Access-Control-Allow-Origin', 'http://localhost:8000')
         response.headers.add('Access-Control-Allow-Credentials', 'true')
         return response
@@ -11042,14 +11982,11 @@ def get_square_balance():
         return response, 500
 
         
-import json
-import plaid
-from plaid.exceptions import ApiException
-
 @app.route('/api/accounting/external/plaid/balance', methods=['GET'])
 @login_required
 @role_required(['admin'])
 def get_plaid_balance():
+    """Plaid balance for ?source=fnbo|paypal, cached like the Square balance (?refresh=true to wait for live)"""
     source = request.args.get('source', 'fnbo')
     conn = get_db()
     cursor = conn.cursor()
@@ -11068,14 +12005,22 @@ def get_plaid_balance():
         }), 400
 
     access_token = row['config_value']
+    from plaid.exceptions import ApiException
     
-    try:
+    def fetch_balance():
+        from plaid.model.accounts_balance_get_request import AccountsBalanceGetRequest
         client = get_plaid_client()
-        plaid_request = plaid.model.accounts_balance_get_request.AccountsBalanceGetRequest(access_token=access_token)
+        plaid_request = AccountsBalanceGetRequest(access_token=access_token)
         response = client.accounts_balance_get(plaid_request)
         accounts = response['accounts']
-        total_balance = sum(acc.get('balances', {}).get('current', 0) for acc in accounts)
-        return jsonify({'status': 'success', 'balance': total_balance})
+        return sum(acc.get('balances', {}).get('current', 0) for acc in accounts)
+    
+    try:
+        # Keyed by token, so reconnecting the bank never serves the old connection's balance
+        key = f"plaid:{source}:{hashlib.sha1(access_token.encode('utf-8')).hexdigest()[:12]}"
+        refresh = request.args.get('refresh', 'false').lower() == 'true'
+        cached = external_balances.get('plaid', key, fetch_balance, refresh=refresh)
+        return jsonify({'status': 'success', **cached})
     
     except ApiException as e:
         # Parse the response body (which is a JSON string)
@@ -11114,12 +12059,8 @@ def get_plaid_balance():
 @app.route('/api/formats', methods=['GET'])
 def get_formats():
     """Get all formats"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, name, created_at FROM formats ORDER BY name')
-    formats = cursor.fetchall()
-    conn.close()
-    return jsonify({'status': 'success', 'formats': [dict(f) for f in formats]})
+    formats = [{k: f.get(k) for k in ('id', 'name', 'created_at')} for f in dimensions.rows('formats')]
+    return jsonify({'status': 'success', 'formats': formats})
 
 @app.route('/api/formats', methods=['POST'])
 @login_required
@@ -11138,6 +12079,7 @@ def create_format():
         format_id = cursor.lastrowid
         conn.commit()
         conn.close()
+        dimensions.invalidate('formats')
         return jsonify({'status': 'success', 'id': format_id, 'name': name})
     except sqlite3.IntegrityError:
         conn.close()
@@ -11166,6 +12108,7 @@ def update_format(format_id):
         cursor.execute('UPDATE formats SET name = ? WHERE id = ?', (name, format_id))
         conn.commit()
         conn.close()
+        dimensions.invalidate('formats')
         return jsonify({'status': 'success', 'message': 'Format updated'})
     except sqlite3.IntegrityError:
         conn.close()
@@ -11188,6 +12131,7 @@ def delete_format(format_id):
     cursor.execute('DELETE FROM formats WHERE id = ?', (format_id,))
     conn.commit()
     conn.close()
+    dimensions.invalidate('formats')
     return jsonify({'status': 'success', 'message': 'Format deleted'})
 
 # ==================== AREAS ====================
@@ -11197,12 +12141,8 @@ def delete_format(format_id):
 @role_required(['admin'])
 def get_areas():
     """Get all areas"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, name, created_at FROM areas ORDER BY name')
-    areas = cursor.fetchall()
-    conn.close()
-    return jsonify({'status': 'success', 'areas': [dict(a) for a in areas]})
+    areas = [{k: a.get(k) for k in ('id', 'name', 'created_at')} for a in dimensions.rows('areas')]
+    return jsonify({'status': 'success', 'areas': areas})
 
 
 @app.route('/api/scan/apply-location', methods=['POST'])
@@ -11238,18 +12178,8 @@ def apply_scan_location():
         return jsonify({'status': 'error', 'error': 'Invalid location_id'}), 400
     
     today = datetime.now().strftime('%Y-%m-%d')
-    updated_count = 0
-    
-    for i, record_id in enumerate(record_ids):
-        location_index = location_index_start + i
-        cursor.execute('''
-            UPDATE records 
-            SET location_id = ?,
-                location_index = ?,
-                last_seen = ?
-            WHERE id = ?
-        ''', (location_id, location_index, today, record_id))
-        updated_count += cursor.rowcount
+    updates = [(location_id, location_index_start + i, record_id) for i, record_id in enumerate(record_ids)]
+    updated_count = apply_location_updates(cursor, updates, today)
     
     conn.commit()
     conn.close()
@@ -11261,6 +12191,98 @@ def apply_scan_location():
     })
 
 
+# ==================== SCAN SESSIONS ====================
+# Shelf audits: the scanner streams barcodes into a server-side session,
+# then one commit applies locations for the whole shelf in a single transaction.
+
+@app.route('/api/scan/sessions', methods=['POST'])
+@login_required
+@role_required(['admin'])
+def create_scan_session():
+    """
+    Start a scan session.
+    Expects: {"location_id": 5, "location_index_start": 1}
+    """
+    data = request.get_json(silent=True) or {}
+    location_id = data.get('location_id')
+    if not location_id:
+        return jsonify({'status': 'error', 'error': 'location_id required'}), 400
+    try:
+        session_info = scan_sessions.create(int(location_id), int(data.get('location_index_start', 1)),
+                                            session.get('user_id'))
+        return jsonify({'status': 'success', **session_info})
+    except ScanSessionError as e:
+        return jsonify({'status': 'error', 'error': str(e)}), e.status_code
+    except Exception as e:
+        app.logger.error(f"Error creating scan session: {str(e)}")
+        return jsonify({'status': 'error', 'error': str(e)}), 500
+
+
+@app.route('/api/scan/sessions/<session_id>/scans', methods=['POST'])
+@login_required
+@role_required(['admin'])
+def add_scan_session_scans(session_id):
+    """
+    Append scanned barcodes (or record ids) in scan order.
+    Expects: {"barcodes": ["123", "456"]} or {"barcode": "123"}
+    """
+    data = request.get_json(silent=True) or {}
+    barcodes = data.get('barcodes')
+    if barcodes is None and data.get('barcode') is not None:
+        barcodes = [data['barcode']]
+    if not isinstance(barcodes, list) or not barcodes:
+        return jsonify({'status': 'error', 'error': 'barcodes required'}), 400
+    try:
+        total = scan_sessions.add_scans(session_id, barcodes)
+        return jsonify({'status': 'success', 'scan_count': total})
+    except ScanSessionError as e:
+        return jsonify({'status': 'error', 'error': str(e)}), e.status_code
+    except Exception as e:
+        app.logger.error(f"Error adding scans to session {session_id}: {str(e)}")
+        return jsonify({'status': 'error', 'error': str(e)}), 500
+
+
+@app.route('/api/scan/sessions/<session_id>', methods=['GET'])
+@login_required
+@role_required(['admin'])
+def get_scan_session(session_id):
+    try:
+        return jsonify({'status': 'success', 'session': scan_sessions.status(session_id)})
+    except ScanSessionError as e:
+        return jsonify({'status': 'error', 'error': str(e)}), e.status_code
+
+
+@app.route('/api/scan/sessions/<session_id>/commit', methods=['POST'])
+@login_required
+@role_required(['admin'])
+def commit_scan_session(session_id):
+    """
+    Apply the session in one transaction and report unknown barcodes and
+    records that moved from another location. ?dry_run=true only reports.
+    """
+    dry_run = request.args.get('dry_run', 'false').lower() == 'true'
+    try:
+        report = scan_sessions.commit(session_id, dry_run=dry_run)
+        return jsonify({'status': 'success', **report})
+    except ScanSessionError as e:
+        return jsonify({'status': 'error', 'error': str(e)}), e.status_code
+    except Exception as e:
+        app.logger.error(f"Error committing scan session {session_id}: {str(e)}")
+        app.logger.error(traceback.format_exc())
+        return jsonify({'status': 'error', 'error': str(e)}), 500
+
+
+@app.route('/api/scan/sessions/<session_id>', methods=['DELETE'])
+@login_required
+@role_required(['admin'])
+def cancel_scan_session(session_id):
+    try:
+        scan_sessions.cancel(session_id)
+        return jsonify({'status': 'success', 'message': 'Scan session cancelled'})
+    except ScanSessionError as e:
+        return jsonify({'status': 'error', 'error': str(e)}), e.status_code
+
+
 @app.route('/api/records/filter', methods=['GET'])
 @login_required
 @role_required(['admin'])
@@ -11279,24 +12301,17 @@ def filter_records():
     format_id = request.args.get('format_id', type=int)
     status_id = request.args.get('status_id', type=int)
     search = request.args.get('search', '').strip()
+    try:
+        projection = record_fields.parse(request.args.get('fields'), FILTER_FIELDS)
+    except FieldSelectionError as e:
+        return jsonify(e.to_dict()), e.status_code
     
     conn = get_db()
     cursor = conn.cursor()
     
-    query = '''
-        SELECT 
-            r.*,
-            s.status_name,
-            cs.condition_name as sleeve_condition_name,
-            cd.condition_name as disc_condition_name,
-            f.name as format_name,
-            l.name as location_name
+    query = f'''
+        SELECT {projection.select_sql}
         FROM records r
-        LEFT JOIN d_status s ON r.status_id = s.id
-        LEFT JOIN d_condition cs ON r.condition_sleeve_id = cs.id
-        LEFT JOIN d_condition cd ON r.condition_disc_id = cd.id
-        LEFT JOIN formats f ON r.format_id = f.id
-        LEFT JOIN locations l ON r.location_id = l.id
         WHERE 1=1
     '''
     params = []
@@ -11325,14 +12340,10 @@ def filter_records():
     query += ' ORDER BY r.last_seen DESC, r.created_at DESC'
     
     cursor.execute(query, params)
-    records = cursor.fetchall()
-    conn.close()
-    
-    return jsonify({
-        'status': 'success',
-        'records': [dict(r) for r in records],
-        'count': len(records)
-    })
+    return json_list_response(cursor, 'records', head={'status': 'success'},
+                              columnar=wants_columnar(request.args),
+                              prepare=lambda chunk: record_fields.apply(conn, chunk, projection),
+                              on_close=conn.close, default=app.json.default)
 
 
 @app.route('/api/gift-card/create', methods=['POST'])
@@ -11768,11 +12779,8 @@ def list_gift_cards():
         
         conn.close()
         
-        return jsonify({
-            'status': 'success',
-            'gift_cards': result,
-            'count': len(result)
-        })
+        return json_list_response(result, 'gift_cards', head={'status': 'success'},
+                                  columnar=wants_columnar(request.args), default=app.json.default)
         
     except Exception as e:
         app.logger.error(f"Error listing gift cards: {str(e)}")
@@ -12640,75 +13648,86 @@ def mark_order_read(order_id):
         app.logger.error(f"Error marking order read: {str(e)}")
         return jsonify({'status': 'error', 'error': str(e)}), 500
 
-@app.route('/api/order/complete', methods=['POST'])
-def order_complete():
-    """Update order status and mark records as sold after successful payment."""
+def complete_order_payment(order_id, transaction_id, payment=None):
+    """
+    Mark a pending website order paid, its records Sold Online and post its
+    journal entry, then email the customer. payment is the Square payment
+    object when known; totals and tax are taken from it. Returns the number
+    of records marked sold, or None if the order was no longer pending
+    (already completed by the Square webhook or the checkout redirect).
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN TRANSACTION")
+
+        if payment:
+            square_total = float(payment.get('amount_money', {}).get('amount', 0)) / 100
+            square_tax = float(payment.get('tax_money', {}).get('amount', 0)) / 100 if payment.get('tax_money') else 0
+
+            cursor.execute('''
+                UPDATE orders SET square_payment_id = ?, payment_status = 'paid', order_status = 'confirmed',
+                total = ?, tax = ?, updated_at = CURRENT_TIMESTAMP, notified = 0
+                WHERE id = ? AND payment_status = 'pending'
+            ''', (transaction_id, square_total, square_tax, order_id))
+        else:
+            cursor.execute('''
+                UPDATE orders SET square_payment_id = ?, payment_status = 'paid', order_status = 'confirmed',
+                updated_at = CURRENT_TIMESTAMP, notified = 0
+                WHERE id = ? AND payment_status = 'pending'
+            ''', (transaction_id, order_id))
+
+        if cursor.rowcount == 0:
+            conn.rollback()
+            return None
+
+        # Get record IDs from order items
+        cursor.execute('SELECT record_id FROM order_items WHERE order_id = ?', (order_id,))
+        record_ids = [row['record_id'] for row in cursor.fetchall()]
+
+        if record_ids:
+            placeholders = ','.join('?' for _ in record_ids)
+            # CHANGED: status_id = 5 (Sold Online) instead of 3
+            cursor.execute(f'UPDATE records SET status_id = 5, date_sold = CURRENT_DATE WHERE id IN ({placeholders})', record_ids)
+
+        # --- AUTO-ACCOUNTING ---
+        try:
+            cursor.execute('SELECT * FROM orders WHERE id = ?', (order_id,))
+            order_row = cursor.fetchone()
+            if order_row:
+                process_order_for_accounting(order_row, conn, cursor)
+                app.logger.info(f"✅ Auto-accounting created for order {order_id}")
+        except Exception as e:
+            app.logger.error(f"Auto-accounting failed for order {order_id}: {str(e)}")
+            # Don't rollback - order still completes
+
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    send_order_confirmation_email(order_id)
+    return len(record_ids)
+
+
+def send_order_confirmation_email(order_id):
+    """Email the customer their order confirmation; failures are logged, never raised"""
     try:
-        data = request.json
-        transaction_id = data.get('transaction_id')
-        order_id = data.get('order_id')
-        
-        if not transaction_id or not order_id:
-            return jsonify({'status': 'error', 'error': 'Missing transaction_id or order_id'}), 400
-        
         conn = get_db()
         cursor = conn.cursor()
-        
         try:
-            cursor.execute("BEGIN TRANSACTION")
-            
-            access_token = os.environ.get('SQUARE_ACCESS_TOKEN')
-            headers = {'Authorization': f'Bearer {access_token}', 'Square-Version': '2026-01-22'}
-            
-            payment_response = requests.get(f'https://connect.squareup.com/v2/payments/{transaction_id}', headers=headers)
-            
-            if payment_response.status_code == 200:
-                payment_data = payment_response.json()
-                payment = payment_data.get('payment', {})
-                square_total = float(payment.get('amount_money', {}).get('amount', 0)) / 100
-                square_tax = float(payment.get('tax_money', {}).get('amount', 0)) / 100 if payment.get('tax_money') else 0
-                
-                cursor.execute('''
-                    UPDATE orders SET square_payment_id = ?, payment_status = 'paid', order_status = 'confirmed',
-                    total = ?, tax = ?, updated_at = CURRENT_TIMESTAMP, notified = 0
-                    WHERE id = ? AND payment_status = 'pending'
-                ''', (transaction_id, square_total, square_tax, order_id))
-            else:
-                cursor.execute('''
-                    UPDATE orders SET square_payment_id = ?, payment_status = 'paid', order_status = 'confirmed',
-                    updated_at = CURRENT_TIMESTAMP, notified = 0
-                    WHERE id = ? AND payment_status = 'pending'
-                ''', (transaction_id, order_id))
-            
-            # Get record IDs from order items
-            cursor.execute('SELECT record_id FROM order_items WHERE order_id = ?', (order_id,))
-            record_ids = [row['record_id'] for row in cursor.fetchall()]
-            
-            if record_ids:
-                placeholders = ','.join('?' for _ in record_ids)
-                # CHANGED: status_id = 5 (Sold Online) instead of 3
-                cursor.execute(f'UPDATE records SET status_id = 5, date_sold = CURRENT_DATE WHERE id IN ({placeholders})', record_ids)
-            
-            # --- AUTO-ACCOUNTING ---
-            try:
-                cursor.execute('SELECT * FROM orders WHERE id = ?', (order_id,))
-                order_row = cursor.fetchone()
-                if order_row:
-                    process_order_for_accounting(order_row, conn, cursor)
-                    app.logger.info(f"✅ Auto-accounting created for order {order_id}")
-            except Exception as e:
-                app.logger.error(f"Auto-accounting failed for order {order_id}: {str(e)}")
-                # Don't rollback - order still completes
-            
-            conn.commit()
-            
-            # Send order confirmation email
-            try:
-                cursor.execute('SELECT customer_name, customer_email, order_number, total FROM orders WHERE id = ?', (order_id,))
-                order_details = cursor.fetchone()
-                
-                if order_details and order_details['customer_email']:
-                    email_body = f"""Thank you for your order from PigStyle Music!
+            cursor.execute('SELECT customer_name, customer_email, order_number, total FROM orders WHERE id = ?', (order_id,))
+            order_details = cursor.fetchone()
+            if not order_details or not order_details['customer_email']:
+                return
+            cursor.execute('SELECT record_title, record_artist, price_at_time FROM order_items WHERE order_id = ?', (order_id,))
+            items = cursor.fetchall()
+        finally:
+            conn.close()
+
+        email_body = f"""Thank you for your order from PigStyle Music!
 
 Order Number: {order_details['order_number']}
 Customer: {order_details['customer_name']}
@@ -12718,12 +13737,10 @@ Your order has been confirmed and will be processed soon.
 
 Records purchased:
 """
-                    cursor.execute('SELECT record_title, record_artist, price_at_time FROM order_items WHERE order_id = ?', (order_id,))
-                    items = cursor.fetchall()
-                    for item in items:
-                        email_body += f"  - {item['record_artist']} - {item['record_title']} (${float(item['price_at_time']):.2f})\n"
-                    
-                    email_body += """
+        for item in items:
+            email_body += f"  - {item['record_artist']} - {item['record_title']} (${float(item['price_at_time']):.2f})\n"
+
+        email_body += """
 
 Thank you for shopping at PigStyle Music!
 
@@ -12731,17 +13748,36 @@ Questions? Reply to this email or contact us at the store.
 
 - PigStyle Music Team
 """
-                    send_email(order_details['customer_email'], f"Order Confirmation - {order_details['order_number']}", email_body)
-            except Exception as email_error:
-                app.logger.error(f"Failed to send order confirmation email: {str(email_error)}")
-            
-            return jsonify({'status': 'success', 'message': f'Order completed, {len(record_ids)} records marked as sold'})
+        send_email(order_details['customer_email'], f"Order Confirmation - {order_details['order_number']}", email_body)
+    except Exception as email_error:
+        app.logger.error(f"Failed to send order confirmation email: {str(email_error)}")
+
+
+@app.route('/api/order/complete', methods=['POST'])
+def order_complete():
+    """Update order status and mark records as sold after successful payment."""
+    try:
+        data = request.json
+        transaction_id = data.get('transaction_id')
+        order_id = data.get('order_id')
+        
+        if not transaction_id or not order_id:
+            return jsonify({'status': 'error', 'error': 'Missing transaction_id or order_id'}), 400
+        
+        # The payment.updated webhook usually lands before the customer is redirected back
+        payment = square_webhooks.latest_object(transaction_id, 'payment.')
+        if not payment:
+            access_token = os.environ.get('SQUARE_ACCESS_TOKEN')
+            headers = {'Authorization': f'Bearer {access_token}', 'Square-Version': '2026-01-22'}
             
-        except Exception as e:
-            conn.rollback()
-            raise
-        finally:
-            conn.close()
+            payment_response = http_client.get(f'https://connect.squareup.com/v2/payments/{transaction_id}', headers=headers)
+            if payment_response.status_code == 200:
+                payment = payment_response.json().get('payment', {})
+        
+        record_count = complete_order_payment(order_id, transaction_id, payment)
+        if record_count is None:
+            return jsonify({'status': 'success', 'message': 'Order already completed'})
+        return jsonify({'status': 'success', 'message': f'Order completed, {record_count} records marked as sold'})
         
     except Exception as e:
         app.logger.error(f"Order complete error: {str(e)}")
@@ -12907,6 +13943,7 @@ def get_records_location_counts():
 
 
 @app.route('/api/events', methods=['GET'])
+@response_cache.cached(['events'], vary=lambda: datetime.utcnow().strftime('%Y-%m-%d'))
 def get_events():
     conn = get_db()
     cursor = conn.cursor()
@@ -13105,10 +14142,7 @@ def plaid_create_link_token():
             app.logger.error("[PLAID] client_id or secret missing")
             return jsonify({'status': 'error', 'error': 'Plaid not configured'}), 500
         
-        host = plaid.Environment.Production if env == 'production' else plaid.Environment.Sandbox
-        configuration = plaid.Configuration(host=host, api_key={'clientId': client_id, 'secret': secret})
-        api_client = plaid.ApiClient(configuration)
-        client = plaid_api.PlaidApi(api_client)
+        client = get_plaid_client()
         
         existing_token = get_plaid_access_token()
         app.logger.info(f"[PLAID] existing_token present: {bool(existing_token)}")
@@ -13116,6 +14150,10 @@ def plaid_create_link_token():
         user_id = str(session.get('user_id', 'admin'))
         app.logger.info(f"[PLAID] user_id={user_id}")
         
+        from plaid.model.country_code import CountryCode
+        from plaid.model.link_token_create_request import LinkTokenCreateRequest
+        from plaid.model.link_token_create_request_user import LinkTokenCreateRequestUser
+        from plaid.model.products import Products
         link_request = LinkTokenCreateRequest(
             user=LinkTokenCreateRequestUser(client_user_id=user_id),
             client_name="PigStyle Music",
@@ -13157,6 +14195,7 @@ def plaid_exchange():
         client = get_plaid_client()
         app.logger.info("[PLAID] Plaid client initialized")
         
+        from plaid.model.item_public_token_exchange_request import ItemPublicTokenExchangeRequest
         exchange_request = ItemPublicTokenExchangeRequest(public_token=public_token)
         response = client.item_public_token_exchange(exchange_request)
         access_token = response['access_token']
@@ -13172,6 +14211,7 @@ def plaid_exchange():
         cursor.execute("UPDATE app_config SET config_value = ? WHERE config_key = 'plaid_item_id'", (item_id,))
         conn.commit()
         conn.close()
+        dimensions.invalidate('app_config')
         app.logger.info("[PLAID] token stored in app_config")
         
         return jsonify({'status': 'success', 'item_id': item_id})
@@ -13736,5 +14776,132 @@ def apply_all_unprocessed():
         app.logger.error(traceback.format_exc())
         return jsonify({'status': 'error', 'error': str(e)}), 500
 
-if __name__ == '__main__': 
-    app.run(debug=True, port=5000)
\ No newline at end of file
+
+# ==================== JOB QUEUE ENDPOINTS ====================
+
+@app.route('/api/jobs', methods=['POST'])
+@login_required
+@role_required(['admin'])
+def enqueue_job():
+    """Queue a job: {"type": ..., "payload": {...}, "priority": 0}"""
+    try:
+        data = request.get_json(silent=True) or {}
+        job_type = data.get('type')
+        if job_type not in job_queue.public_types():
+            return jsonify({
+                'status': 'error',
+                'error': f'Unknown job type: {job_type}',
+                'job_types': job_queue.public_types()
+            }), 400
+        payload = data.get('payload') or {}
+        if not isinstance(payload, dict):
+            return jsonify({'status': 'error', 'error': 'payload must be an object'}), 400
+        job = job_queue.enqueue(job_type, payload, priority=data.get('priority'),
+                                max_attempts=data.get('max_attempts'), created_by=session.get('user_id'))
+        response = jsonify({'status': 'success', 'job_id': job['id'], 'job': job_queue.public(job)})
+        response.headers['Location'] = f"/api/jobs/{job['id']}"
+        return response, 202
+    except JobError as e:
+        return jsonify(e.to_dict()), e.status_code
+    except Exception as e:
+        app.logger.error(f"Error queueing job: {str(e)}")
+        app.logger.error(traceback.format_exc())
+        return jsonify({'status': 'error', 'error': str(e)}), 500
+
+
+@app.route('/api/jobs', methods=['GET'])
+@login_required
+@role_required(['admin'])
+def list_jobs():
+    """Recent jobs, newest first; filter with ?status= and ?type="""
+    status = request.args.get('status')
+    if status and status not in JOB_STATUSES:
+        return jsonify({'status': 'error', 'error': f'Invalid status: {status}'}), 400
+    jobs = job_queue.list(status=status, job_type=request.args.get('type'),
+                          limit=request.args.get('limit', 50, type=int))
+    return jsonify({'status': 'success', 'jobs': [job_queue.public(job) for job in jobs], 'count': len(jobs)})
+
+
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+@login_required
+@role_required(['admin'])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'status': 'error', 'error': f'Job {job_id} not found'}), 404
+    return jsonify({'status': 'success', 'job': job_queue.public(job)})
+
+
+@app.route('/api/jobs/<int:job_id>/stream', methods=['GET'])
+@login_required
+@role_required(['admin'])
+def stream_job(job_id):
+    """
+    NDJSON status updates for one job: a line whenever status or progress
+    changes, a keepalive line every 15s, and the finished job (with its
+    result) as the last line.
+
+    Each response lasts at most STREAM_WINDOW_S (?timeout= can only shorten
+    it) so a watcher never pins a worker thread for long. A window that ends
+    before the job does closes with a "reconnect" line; the client then
+    opens the stream again.
+    """
+    if not job_queue.get(job_id):
+        return jsonify({'status': 'error', 'error': f'Job {job_id} not found'}), 404
+    window = max(1, min(request.args.get('timeout', STREAM_WINDOW_S, type=int), STREAM_WINDOW_S))
+
+    def generate():
+        last = None
+        last_sent = time.time()
+        deadline = time.time() + window
+        while True:
+            job = job_queue.get(job_id)
+            if job is None:
+                yield json.dumps({'type': 'error', 'error': 'Job deleted'}) + '\n'
+                return
+            state = (job['status'], job['progress'], job['progress_message'], job['attempts'])
+            if job['status'] in TERMINAL_STATUSES:
+                yield json.dumps({'type': 'done', 'job': job_queue.public(job)}, default=str) + '\n'
+                return
+            if state != last:
+                last = state
+                last_sent = time.time()
+                yield json.dumps({'type': 'status', 'job': job_queue.public(job)}, default=str) + '\n'
+            elif time.time() - last_sent >= 15:
+                last_sent = time.time()
+                yield json.dumps({'type': 'keepalive'}) + '\n'
+            if time.time() >= deadline:
+                yield json.dumps({'type': 'reconnect', 'job_id': job_id}) + '\n'
+                return
+            time.sleep(0.5)
+
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@app.route('/api/jobs/<int:job_id>/cancel', methods=['POST'])
+@login_required
+@role_required(['admin'])
+def cancel_job(job_id):
+    try:
+        job = job_queue.cancel(job_id)
+        return jsonify({'status': 'success', 'job': job_queue.public(job)})
+    except JobError as e:
+        return jsonify(e.to_dict()), e.status_code
+
+
+# ==================== INTEGRATIONS ====================
+
+@app.route('/api/integrations/http-stats', methods=['GET'])
+@login_required
+@role_required(['admin'])
+def integration_http_stats():
+    """Per-upstream request counts, retries, latency percentiles and circuit breaker state"""
+    return jsonify({'status': 'success', 'upstreams': http_client.snapshot()})
+
+
+if __name__ == '__main__':
+    # Under the reloader only the serving child (WERKZEUG_RUN_MAIN) runs job workers
+    create_app(start_workers=os.environ.get('WERKZEUG_RUN_MAIN') == 'true').run(debug=True, port=5000)
\ No newline at end of file
@@ -1,50 +1,478 @@
 #!/usr/bin/env python3.9
+"""
+Online backups for records.db.
+
+Daily mode (default) copies the live database with the SQLite backup API in
+page-stepped chunks, so the API keeps writing while the copy runs. Each copy
+is checked with PRAGMA integrity_check, stream-compressed (zstd when the
+`zstandard` package is installed, gzip otherwise) and pruned by a
+daily/weekly retention policy.
+
+WAL-archive mode (--wal-archive) keeps running and ships only the committed
+WAL frames written since the last poll. Together with the latest daily base
+this allows a point-in-time restore (--restore) without copying the whole
+file again.
+
+The API keeps SQLite's default wal_autocheckpoint, and any of its writers
+may restart the WAL once a checkpoint has copied every frame back. Between
+polls the archiver therefore holds a read transaction (the WAL pin) on the
+frames it has already shipped: checkpoints still run, but the WAL cannot
+restart under it, so no frame is overwritten before it is archived. The
+archiver releases the pin only around its own checkpoint, once per
+WAL_CHECKPOINT_FRAMES. The chain can still break if the API fills a whole
+autocheckpoint (1000 pages) within one poll interval right after that; the
+break is detected and a new base backup is taken, so in that case restore
+points exist only from the new base onward.
+
+Usage:
+    python3 backup_db_daily.py
+    python3 backup_db_daily.py --wal-archive --interval 60
+    python3 backup_db_daily.py --restore "2026-10-18 14:30:00" --output restored.db
+"""
 import os
-import shutil
 import glob
+import gzip
+import json
+import shutil
+import sqlite3
+import struct
+import argparse
+import time
 from datetime import datetime
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 # Configuration
-DB_PATH = '/home/arjanshaw/PigStyleMusic/backend/data/records.db'
-BACKUP_DIR = '/home/arjanshaw/PigStyleMusic/backend/backups/'
+DB_PATH = os.environ.get('PIGSTYLE_DB_PATH', '/home/arjanshaw/PigStyleMusic/backend/data/records.db')
+BACKUP_DIR = os.environ.get('PIGSTYLE_BACKUP_DIR', '/home/arjanshaw/PigStyleMusic/backend/backups/')
+WAL_ARCHIVE_DIR = os.path.join(BACKUP_DIR, 'wal')
 DAYS_TO_KEEP = 30  # Keep a month of daily backups
+WEEKS_TO_KEEP = 12  # ...and the newest backup of each week for a quarter
+PAGES_PER_STEP = 256  # Pages copied per backup step before yielding to writers
+STEP_SLEEP = 0.01  # Seconds to sleep between backup steps
+CHUNK_SIZE = 1024 * 1024
+TIMESTAMP_FORMAT = '%Y-%m-%d_%H%M%S'
+BACKUP_PREFIX = 'records_backup_'
+
+WAL_HEADER_SIZE = 32
+WAL_FRAME_HEADER_SIZE = 24
+WAL_CHECKPOINT_FRAMES = 1000  # Checkpoint once this many frames have been archived
+
+
+def compression_suffix():
+    return '.zst' if zstandard else '.gz'
+
+
+def open_compressed_writer(path):
+    """Open a streaming compressed writer for path based on its suffix"""
+    if path.endswith('.zst'):
+        return zstandard.ZstdCompressor(level=10).stream_writer(open(path, 'wb'), closefd=True)
+    return gzip.open(path, 'wb', compresslevel=6)
+
+
+def open_compressed_reader(path):
+    """Open a streaming compressed reader for path based on its suffix"""
+    if path.endswith('.zst'):
+        if not zstandard:
+            raise RuntimeError(f"{path} is zstd-compressed but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    return gzip.open(path, 'rb')
+
+
+def compress_file(src_path, dest_path):
+    """Stream src_path into a compressed dest_path without loading it into memory"""
+    tmp_path = dest_path + '.partial'
+    with open(src_path, 'rb') as src, open_compressed_writer(tmp_path) as dest:
+        shutil.copyfileobj(src, dest, CHUNK_SIZE)
+    os.replace(tmp_path, dest_path)
+
+
+def decompress_file(src_path, dest_path):
+    with open_compressed_reader(src_path) as src, open(dest_path, 'wb') as dest:
+        shutil.copyfileobj(src, dest, CHUNK_SIZE)
+
+
+def integrity_check(db_path):
+    """Return None if db_path passes PRAGMA integrity_check, otherwise the problems found"""
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute('PRAGMA integrity_check').fetchall()
+    finally:
+        conn.close()
+    problems = [row[0] for row in rows if row[0] != 'ok']
+    return '; '.join(problems[:10]) if problems else None
+
+
+def backup_to_file(dest_path):
+    """Copy the live database into dest_path in page-stepped chunks"""
+    def progress(status, remaining, total):
+        if total and remaining % (PAGES_PER_STEP * 40) == 0:
+            print(f"[ ] Backup progress: {total - remaining}/{total} pages")
+
+    src = sqlite3.connect(f'file:{DB_PATH}?mode=ro', uri=True)
+    dest = sqlite3.connect(dest_path)
+    try:
+        src.backup(dest, pages=PAGES_PER_STEP, progress=progress, sleep=STEP_SLEEP)
+    finally:
+        dest.close()
+        src.close()
 
-# Create backup directory if it doesn't exist
-os.makedirs(BACKUP_DIR, exist_ok=True)
 
 def create_daily_backup():
-    """Create a daily timestamped backup"""
-    timestamp = datetime.now().strftime('%Y-%m-%d')
-    backup_filename = f'records_backup_{timestamp}.db'
-    backup_path = os.path.join(BACKUP_DIR, backup_filename)
-    
-    if os.path.exists(DB_PATH):
-        shutil.copyfile(DB_PATH, backup_path)
-        print(f"[✓] Daily backup created: {backup_filename}")
-    else:
+    """Create a verified, compressed, timestamped backup. Returns its path or None."""
+    if not os.path.exists(DB_PATH):
         print(f"[✗] Database not found at {DB_PATH}")
+        return None
 
-def cleanup_old_backups():
-    """Remove backups older than DAYS_TO_KEEP"""
-    all_backups = glob.glob(os.path.join(BACKUP_DIR, 'records_backup_*.db'))
-    
-    for backup_path in all_backups:
-        # Extract date from filename (format: records_backup_YYYY-MM-DD.db)
-        filename = os.path.basename(backup_path)
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    timestamp = datetime.now().strftime(TIMESTAMP_FORMAT)
+    backup_filename = f'{BACKUP_PREFIX}{timestamp}.db{compression_suffix()}'
+    backup_path = os.path.join(BACKUP_DIR, backup_filename)
+    staging_path = os.path.join(BACKUP_DIR, f'.staging_{timestamp}.db')
+
+    # Record where the WAL is before copying so the archiver can replay from here,
+    # pinned so the WAL cannot restart before the archiver's first poll
+    pin_wal()
+    wal_position = read_wal_position()
+    start = time.time()
+    try:
+        backup_to_file(staging_path)
+        copy_seconds = time.time() - start
+
+        problems = integrity_check(staging_path)
+        if problems:
+            print(f"[✗] Integrity check failed, backup discarded: {problems}")
+            return None
+
+        compress_file(staging_path, backup_path)
+    finally:
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+
+    write_wal_state(backup_filename, wal_position)
+
+    size_mb = os.path.getsize(backup_path) / (1024 * 1024)
+    print(f"[✓] Daily backup created: {backup_filename} "
+          f"({size_mb:.1f} MB, copied in {copy_seconds:.1f}s, total {time.time() - start:.1f}s)")
+    return backup_path
+
+
+def parse_backup_timestamp(filename):
+    """Extract the timestamp from records_backup_<timestamp>.db[.gz|.zst]"""
+    stem = filename[len(BACKUP_PREFIX):].split('.db')[0]
+    for fmt in (TIMESTAMP_FORMAT, '%Y-%m-%d'):
         try:
-            date_str = filename.replace('records_backup_', '').replace('.db', '')
-            backup_date = datetime.strptime(date_str, '%Y-%m-%d')
-            days_old = (datetime.now() - backup_date).days
-            
-            if days_old > DAYS_TO_KEEP:
-                os.remove(backup_path)
-                print(f"[ ] Removed old backup: {filename} ({days_old} days old)")
+            return datetime.strptime(stem, fmt)
         except ValueError:
-            # If filename doesn't match expected format, skip
             continue
+    return None
+
+
+def list_backups():
+    """Return [(timestamp, path)] for all backups, oldest first"""
+    backups = []
+    for backup_path in glob.glob(os.path.join(BACKUP_DIR, f'{BACKUP_PREFIX}*.db*')):
+        if backup_path.endswith('.partial'):
+            continue
+        backup_date = parse_backup_timestamp(os.path.basename(backup_path))
+        if backup_date:
+            backups.append((backup_date, backup_path))
+    return sorted(backups)
+
+
+def cleanup_old_backups():
+    """Keep every backup for DAYS_TO_KEEP days and the newest per week for WEEKS_TO_KEEP weeks"""
+    now = datetime.now()
+    newest_per_week = {}
+    for backup_date, backup_path in list_backups():
+        newest_per_week[backup_date.isocalendar()[:2]] = backup_path
+
+    for backup_date, backup_path in list_backups():
+        days_old = (now - backup_date).days
+        if days_old <= DAYS_TO_KEEP:
+            continue
+        if days_old <= WEEKS_TO_KEEP * 7 and newest_per_week.get(backup_date.isocalendar()[:2]) == backup_path:
+            continue
+        filename = os.path.basename(backup_path)
+        os.remove(backup_path)
+        shutil.rmtree(os.path.join(WAL_ARCHIVE_DIR, filename), ignore_errors=True)
+        print(f"[ ] Removed old backup: {filename} ({days_old} days old)")
+
+
+# ==================== WAL ARCHIVING ====================
+
+def read_wal_header(wal_file):
+    """Return (page_size, salt1, salt2) from an open WAL file, or None if it is empty"""
+    wal_file.seek(0)
+    header = wal_file.read(WAL_HEADER_SIZE)
+    if len(header) < WAL_HEADER_SIZE:
+        return None
+    _, _, page_size, _, salt1, salt2, _, _ = struct.unpack('>8I', header)
+    return page_size, salt1, salt2
+
+
+def read_committed_frames(wal_path, salt1, salt2, page_size, offset):
+    """
+    Read complete committed frames of the current WAL generation starting at offset.
+
+    Returns (frame_bytes, new_offset). Frames after the last commit frame and
+    stale frames left over from an earlier generation are ignored.
+    """
+    frame_size = WAL_FRAME_HEADER_SIZE + page_size
+    chunks = []
+    pending = []
+    with open(wal_path, 'rb') as wal_file:
+        wal_file.seek(offset)
+        position = offset
+        while True:
+            frame = wal_file.read(frame_size)
+            if len(frame) < frame_size:
+                break
+            _, commit_size, frame_salt1, frame_salt2 = struct.unpack('>4I', frame[:16])
+            if (frame_salt1, frame_salt2) != (salt1, salt2):
+                break
+            pending.append(frame)
+            position += frame_size
+            if commit_size:
+                chunks.extend(pending)
+                pending = []
+                offset = position
+    return b''.join(chunks), offset
+
+
+def read_wal_position():
+    """Return the WAL generation and end offset of the last committed frame"""
+    wal_path = DB_PATH + '-wal'
+    header = None
+    if os.path.exists(wal_path):
+        with open(wal_path, 'rb') as wal_file:
+            header = read_wal_header(wal_file)
+    if not header:
+        # No WAL yet: the first generation to appear starts right after this base
+        return {'page_size': None, 'salt1': None, 'salt2': None, 'offset': WAL_HEADER_SIZE}
+    page_size, salt1, salt2 = header
+    _, offset = read_committed_frames(wal_path, salt1, salt2, page_size, WAL_HEADER_SIZE)
+    return {'page_size': page_size, 'salt1': salt1, 'salt2': salt2, 'offset': offset}
+
+
+def wal_state_path(base_filename):
+    return os.path.join(WAL_ARCHIVE_DIR, base_filename, 'state.json')
+
+
+def write_wal_state(base_filename, state):
+    path = wal_state_path(base_filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    state.setdefault('sequence', 0)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def read_wal_state(base_filename):
+    path = wal_state_path(base_filename)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+_wal_pin = None
+
+
+def release_wal_pin():
+    global _wal_pin
+    if _wal_pin is not None:
+        try:
+            _wal_pin.execute('COMMIT')
+        finally:
+            _wal_pin.close()
+        _wal_pin = None
+
+
+def pin_wal():
+    """
+    Start a read transaction on the current WAL snapshot and keep it until the
+    next poll. While it is open no writer can restart the WAL, so frames
+    appended after it stay in the file for the next archive run.
+    """
+    global _wal_pin
+    release_wal_pin()
+    conn = sqlite3.connect(DB_PATH, isolation_level=None)
+    # Outside WAL mode a long read would block writers instead
+    if conn.execute('PRAGMA journal_mode').fetchone()[0].lower() != 'wal':
+        conn.close()
+        return
+    conn.execute('BEGIN')
+    conn.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+    _wal_pin = conn
+
+
+def archive_wal_once(base_filename, state):
+    """
+    Ship new committed frames for the chain rooted at base_filename.
+
+    Writers are held off with BEGIN IMMEDIATE only while the new frames are read
+    and the WAL pin is moved forward. Once enough frames are archived the pin is
+    dropped for a passive checkpoint, which lets the next writer restart the WAL.
+    Returns the updated state, or None if the chain is broken and a new base is
+    needed.
+    """
+    wal_path = DB_PATH + '-wal'
+    conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            header = None
+            if os.path.exists(wal_path):
+                with open(wal_path, 'rb') as wal_file:
+                    header = read_wal_header(wal_file)
+            if not header:
+                return state
+
+            page_size, salt1, salt2 = header
+            if (salt1, salt2) != (state['salt1'], state['salt2']):
+                # A restart we did not observe means frames may have been overwritten
+                expected_restart = state['salt1'] is None or (
+                    state.get('checkpointed') and salt1 == (state['salt1'] + 1) & 0xFFFFFFFF)
+                if not expected_restart:
+                    print("[✗] WAL restarted between polls - chain broken, a new base backup is required")
+                    release_wal_pin()
+                    return None
+                state.update({'salt1': salt1, 'salt2': salt2, 'offset': WAL_HEADER_SIZE,
+                              'checkpointed': False, 'page_size': page_size})
+
+            frames, new_offset = read_committed_frames(
+                wal_path, salt1, salt2, page_size, state['offset'])
+            if frames:
+                state['sequence'] += 1
+                segment_name = (f"{state['sequence']:08d}_{datetime.now().strftime(TIMESTAMP_FORMAT)}"
+                                f".frames{compression_suffix()}")
+                segment_path = os.path.join(WAL_ARCHIVE_DIR, base_filename, segment_name)
+                with open_compressed_writer(segment_path) as out:
+                    out.write(frames)
+                state['offset'] = new_offset
+                frame_count = len(frames) // (WAL_FRAME_HEADER_SIZE + page_size)
+                print(f"[✓] Archived {frame_count} WAL frames to {segment_name}")
+
+            # Let the WAL restart once enough frames have been archived
+            archived_frames = (state['offset'] - WAL_HEADER_SIZE) // (WAL_FRAME_HEADER_SIZE + page_size)
+            if archived_frames >= WAL_CHECKPOINT_FRAMES:
+                release_wal_pin()
+                checkpointer = sqlite3.connect(DB_PATH)
+                try:
+                    busy, log_frames, checkpointed = checkpointer.execute(
+                        'PRAGMA wal_checkpoint(PASSIVE)').fetchone()
+                finally:
+                    checkpointer.close()
+                state['checkpointed'] = not busy and log_frames == checkpointed
+            # Still inside BEGIN IMMEDIATE, so the pin sees exactly the frames archived above
+            pin_wal()
+        finally:
+            conn.execute('COMMIT')
+    finally:
+        conn.close()
+
+    write_wal_state(base_filename, state)
+    return state
+
+
+def run_wal_archiver(interval):
+    """Poll the WAL forever, starting a new base backup whenever the chain breaks"""
+    print(f"[*] WAL archiver started, polling every {interval}s")
+    conn = sqlite3.connect(DB_PATH)
+    journal_mode = conn.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+    conn.close()
+    if journal_mode.lower() != 'wal':
+        print(f"[✗] Could not switch {DB_PATH} to WAL mode (journal_mode={journal_mode})")
+        return
+
+    base_filename = None
+    state = None
+    while True:
+        # Follow the newest base (e.g. one taken by the daily cron run)
+        backups = list_backups()
+        latest = os.path.basename(backups[-1][1]) if backups else None
+        if latest and latest != base_filename and read_wal_state(latest):
+            base_filename = latest
+            state = read_wal_state(base_filename)
+        elif state is None:
+            base_path = create_daily_backup()
+            if base_path:
+                base_filename = os.path.basename(base_path)
+                state = read_wal_state(base_filename)
+        if state is not None:
+            state = archive_wal_once(base_filename, state)
+        time.sleep(interval)
+
+
+def apply_frames(db_file, frames, page_size):
+    """Write WAL frame page images into db_file, truncating at each commit"""
+    frame_size = WAL_FRAME_HEADER_SIZE + page_size
+    for start in range(0, len(frames), frame_size):
+        page_number, commit_size = struct.unpack('>2I', frames[start:start + 8])
+        db_file.seek((page_number - 1) * page_size)
+        db_file.write(frames[start + WAL_FRAME_HEADER_SIZE:start + frame_size])
+        if commit_size:
+            db_file.truncate(commit_size * page_size)
+
+
+def restore(target_time, output_path):
+    """Restore the newest base at or before target_time plus archived WAL frames up to it"""
+    candidates = [(ts, path) for ts, path in list_backups() if ts <= target_time]
+    if not candidates:
+        print(f"[✗] No backup exists at or before {target_time}")
+        return False
+    base_time, base_path = candidates[-1]
+    base_filename = os.path.basename(base_path)
+    print(f"[*] Restoring base {base_filename}")
+    decompress_file(base_path, output_path)
+
+    state = read_wal_state(base_filename)
+    applied = 0
+    if state:
+        segments = sorted(glob.glob(os.path.join(WAL_ARCHIVE_DIR, base_filename, '*.frames*')))
+        with open(output_path, 'r+b') as db_file:
+            for segment_path in segments:
+                stamp = os.path.basename(segment_path).split('_', 1)[1].split('.frames')[0]
+                if datetime.strptime(stamp, TIMESTAMP_FORMAT) > target_time:
+                    break
+                with open_compressed_reader(segment_path) as segment:
+                    apply_frames(db_file, segment.read(), state['page_size'])
+                applied += 1
+
+    problems = integrity_check(output_path)
+    if problems:
+        print(f"[✗] Restored database failed integrity check: {problems}")
+        return False
+    print(f"[✓] Restored {output_path} from {base_filename} + {applied} WAL segments")
+    return True
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Online backup of records.db')
+    parser.add_argument('--wal-archive', action='store_true',
+                        help='Run continuously, archiving committed WAL frames')
+    parser.add_argument('--interval', type=int, default=60,
+                        help='Seconds between WAL archive polls (default: 60)')
+    parser.add_argument('--restore', metavar='TIME',
+                        help='Restore to this point in time ("YYYY-MM-DD HH:MM:SS")')
+    parser.add_argument('--output', default='records_restored.db',
+                        help='Output path for --restore')
+    return parser.parse_args()
+
 
 if __name__ == "__main__":
-    print(f"[*] Starting daily backup at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    create_daily_backup()
-    cleanup_old_backups()
-    print("[*] Backup complete")
\ No newline at end of file
+    args = parse_args()
+    if args.restore:
+        restore(datetime.strptime(args.restore, '%Y-%m-%d %H:%M:%S'), args.output)
+    elif args.wal_archive:
+        run_wal_archiver(args.interval)
+    else:
+        print(f"[*] Starting daily backup at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        create_daily_backup()
+        cleanup_old_backups()
+        print("[*] Backup complete")
@@ -12,8 +12,10 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class DiscogsHandler:
-    def __init__(self, user_token: str, db_path: str = None):
+    def __init__(self, user_token: str, db_path: str = None, http=None):
         self.user_token = user_token
+        # Shared HttpClient (handlers/http_client_handler.py) for pooled, retried calls; plain requests without one
+        self.http = http or requests
         self.base_url = "https://api.discogs.com"
         self.headers = {
             "User-Agent": "PigStyleInventory/1.0",
@@ -171,7 +173,7 @@ class DiscogsHandler:
         start_time = time.time()
         logger.info(f"Discogs API CALL [START]: GET /marketplace/price_suggestions/{release_id}")
         
-        response = requests.get(
+        response = self.http.get(
             endpoint_url,
             headers=self.headers,
             timeout=15
@@ -242,7 +244,7 @@ class DiscogsHandler:
         start_time = time.time()
         logger.info(f"Discogs API CALL [START]: GET /database/search?q={query[:50]}...")
         
-        response = requests.get(
+        response = self.http.get(
             endpoint_url,
             params=params,
             headers=self.headers,
@@ -445,7 +447,7 @@ class DiscogsHandler:
         start_time = time.time()
         logger.info(f"Discogs API CALL [START]: GET /releases/{release_id}")
         
-        response = requests.get(
+        response = self.http.get(
             endpoint_url,
             headers=self.headers,
             timeout=15
@@ -472,7 +474,8 @@ class DiscogsHandler:
         
         return result
 
-    def get_orders(self, status: str = None, page: int = 1, per_page: int = 50):
+    def get_orders(self, status: str = None, page: int = 1, per_page: int = 50,
+                   sort: str = None, sort_order: str = None):
         """
         Fetch orders from Discogs API.
         
@@ -480,6 +483,8 @@ class DiscogsHandler:
             status: Filter by status (New, Paid, Shipped, etc.)
             page: Page number for pagination
             per_page: Items per page (max 100)
+            sort: Sort field (id, buyer, created, status, last_activity)
+            sort_order: asc or desc
         
         Returns:
             Dict with orders list and pagination info
@@ -493,11 +498,14 @@ class DiscogsHandler:
         
         if status:
             params['status'] = status
+        if sort:
+            params['sort'] = sort
+            params['sort_order'] = sort_order or 'desc'
         
         start_time = time.time()
         logger.info(f"Discogs API CALL [START]: GET /marketplace/orders - page={page}, status={status}")
         
-        response = requests.get(
+        response = self.http.get(
             endpoint_url,
             params=params,
             headers=self.headers,
@@ -572,7 +580,7 @@ class DiscogsHandler:
         start_time = time.time()
         logger.info(f"Discogs API CALL [START]: GET /marketplace/orders/{order_id}")
         
-        response = requests.get(
+        response = self.http.get(
             endpoint_url,
             headers=self.headers,
             timeout=15
@@ -705,6 +713,7 @@ class DiscogsHandler:
             release_description = release.get('description', '') if isinstance(release, dict) else ''
                 
             parsed_items.append({
+                'item_id': item.get('id'),
                 'release_id': item.get('release_id') or release.get('id'),
                 'listing_id': item.get('listing_id'),
                 'artist': artist,
@@ -739,6 +748,14 @@ class DiscogsHandler:
         else:
             shipping_amount = 0
         
+        fee_data = order_data.get('fee', {})
+        if isinstance(fee_data, (int, float)):
+            fee_amount = float(fee_data)
+        elif isinstance(fee_data, dict):
+            fee_amount = float(fee_data.get('value', 0))
+        else:
+            fee_amount = 0
+        
         # Parse dates
         created_at = order_data.get('created')
         if created_at and 'T' in created_at:
@@ -776,10 +793,13 @@ class DiscogsHandler:
             'total_amount': total_amount,
             'shipping_amount': shipping_amount,
             'subtotal': total_amount - shipping_amount,
+            'fee_amount': fee_amount,
             'currency': currency,
             'created_at': created_at,
             'paid_at': paid_at,
             'shipped_at': shipped_at,
+            # Full timestamp, used as the sync watermark by DiscogsOrdersHandler
+            'last_activity': order_data.get('last_activity'),
             'items': parsed_items,
             'buyer_message': order_data.get('additional_instructions', '') or '',
             'feedback': {
@@ -0,0 +1,41 @@
+"""
+Gunicorn profile for the PigStyle API.
+
+The app is imported once in the master (preload_app) so migrations run a
+single time and workers fork with the code already loaded. Shared state
+lives in SQLite (shared_state, table_versions), so any number of workers
+can serve the same sessions, checkouts and jobs.
+
+Override with PIGSTYLE_BIND, PIGSTYLE_WORKERS, PIGSTYLE_THREADS and
+PIGSTYLE_JOB_WORKERS (job queue threads per worker process).
+"""
+import multiprocessing
+import os
+
+wsgi_app = 'wsgi:app'
+bind = os.environ.get('PIGSTYLE_BIND', '0.0.0.0:5000')
+
+# One process per core; threads cover requests that wait on Square, Discogs or Plaid
+workers = int(os.environ.get('PIGSTYLE_WORKERS', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('PIGSTYLE_THREADS', 4))
+preload_app = True
+
+# Streamed exports and Discogs lookups can legitimately take a while
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers now and then so slow leaks in third-party clients cannot accumulate
+max_requests = 2000
+max_requests_jitter = 200
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('PIGSTYLE_LOG_LEVEL', 'info')
+
+
+def post_fork(server, worker):
+    """Job queue threads must start in each worker; threads started in the master do not survive fork"""
+    from api import job_queue
+    job_queue.start()
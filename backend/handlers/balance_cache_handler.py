@@ -0,0 +1,116 @@
+"""Stale-while-revalidate cache for balances fetched from Square and Plaid"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class BalanceCacheHandler:
+    """
+    Last known balance per source, kept in shared_state (namespace
+    'external_balances') so every worker process, and the first request
+    after a restart, can answer without waiting on Square or Plaid.
+
+    get() returns the stored value immediately. Once it is older than the
+    source's TTL a background refresh is started and the stale value is
+    still served; only the very first fetch for a key, or refresh=True,
+    waits on the upstream. A failed background refresh keeps the old value
+    and records last_error.
+
+    A refresh is claimed in shared_state (namespace
+    'external_balance_refresh') before it starts, so one worker refreshes a
+    key while the others keep serving the stale value. The claim expires
+    after CLAIM_TTL in case its worker dies mid-fetch.
+    """
+
+    NAMESPACE = 'external_balances'
+    CLAIMS_NAMESPACE = 'external_balance_refresh'
+    CLAIM_TTL = 120  # seconds; well past HttpClient's read timeout
+    # Seconds a balance counts as fresh; Plaid balance calls are billed, so it refreshes least
+    TTLS = {'square': 300, 'plaid': 900}
+    DEFAULT_TTL = 300
+    REFRESH_WORKERS = 2
+
+    def __init__(self, store, ttls: Dict[str, int] = None):
+        self.store = store
+        self.ttls = {**self.TTLS, **(ttls or {})}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def ttl(self, source: str) -> int:
+        return self.ttls.get(source, self.DEFAULT_TTL)
+
+    def _fetch_and_store(self, key: str, fetch: Callable[[], float]) -> Dict:
+        balance = fetch()
+        now = time.time()
+        entry = {
+            'balance': balance,
+            'fetched_ts': now,
+            'fetched_at': datetime.fromtimestamp(now, timezone.utc).isoformat(),
+            'last_error': None
+        }
+        self.store.set(self.NAMESPACE, key, entry)
+        return entry
+
+    def _claim(self, key: str) -> bool:
+        """Take the refresh claim for key; False when another refresh holds it"""
+        def take(claim):
+            if claim is not None:
+                return claim, False
+            return {'pid': os.getpid(), 'claimed_at': time.time()}, True
+        return self.store.modify(self.CLAIMS_NAMESPACE, key, take, ttl=self.CLAIM_TTL)
+
+    def _refresh_later(self, key: str, fetch: Callable[[], float]) -> bool:
+        """Refresh key on the pool unless some worker is already refreshing it"""
+        if not self._claim(key):
+            return False
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.REFRESH_WORKERS,
+                                                    thread_name_prefix='balance-refresh')
+
+        def run():
+            try:
+                self._fetch_and_store(key, fetch)
+            except Exception as e:
+                logger.warning(f"Background balance refresh {key} failed: {e}")
+                self.store.update(self.NAMESPACE, key, last_error=str(e),
+                                  last_error_at=datetime.now(timezone.utc).isoformat())
+            finally:
+                self.store.delete(self.CLAIMS_NAMESPACE, key)
+
+        self._executor.submit(run)
+        return True
+
+    def get(self, source: str, key: str, fetch: Callable[[], float], refresh: bool = False) -> Dict:
+        """
+        Balance for key (e.g. 'square', 'plaid:fnbo:<token hash>') with
+        fetched_at, age_seconds, stale and refreshing. fetch() returns the
+        live balance and may raise; its errors only propagate when there is
+        nothing cached or refresh=True.
+        """
+        entry = None if refresh else self.store.get(self.NAMESPACE, key)
+        refreshing = False
+        if entry is None:
+            entry = self._fetch_and_store(key, fetch)
+        elif time.time() - entry['fetched_ts'] > self.ttl(source):
+            refreshing = (self._refresh_later(key, fetch)
+                          or self.store.get(self.CLAIMS_NAMESPACE, key) is not None)
+
+        age = max(time.time() - entry['fetched_ts'], 0)
+        result = {
+            'balance': entry['balance'],
+            'fetched_at': entry['fetched_at'],
+            'age_seconds': round(age, 1),
+            'stale': age > self.ttl(source),
+            'refreshing': refreshing
+        }
+        if entry.get('last_error'):
+            result['last_error'] = entry['last_error']
+            result['last_error_at'] = entry.get('last_error_at')
+        return result
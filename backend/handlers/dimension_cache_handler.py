@@ -0,0 +1,197 @@
+"""In-process cache of the small dimension tables (conditions, statuses, formats, locations, ...)"""
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from handlers.table_version_handler import TableVersionHandler, read_versions
+
+logger = logging.getLogger(__name__)
+
+# Table -> ORDER BY used when loading it; the cached lists keep that order
+DIMENSION_TABLES = {
+    'd_condition': 'quality_index',
+    'd_status': 'id',
+    'formats': 'name',
+    'locations': 'id',
+    'genres': 'name',
+    'accounts': 'code',
+    'app_config': 'config_key',
+    'areas': 'name'
+}
+
+
+# Derived record field -> (dimension table, record id column, dimension column)
+RECORD_LOOKUPS = {
+    'format_name': ('formats', 'format_id', 'name'),
+    'status_name': ('d_status', 'status_id', 'status_name'),
+    'location_name': ('locations', 'location_id', 'name'),
+    'genre_id': ('locations', 'location_id', 'genre_id'),
+    'disc_condition_name': ('d_condition', 'condition_disc_id', 'condition_name'),
+    'disc_abbr': ('d_condition', 'condition_disc_id', 'abbreviation'),
+    'disc_quality': ('d_condition', 'condition_disc_id', 'quality_index'),
+    'disc_display': ('d_condition', 'condition_disc_id', 'display_name'),
+    'sleeve_condition_name': ('d_condition', 'condition_sleeve_id', 'condition_name'),
+    'sleeve_abbr': ('d_condition', 'condition_sleeve_id', 'abbreviation'),
+    'sleeve_quality': ('d_condition', 'condition_sleeve_id', 'quality_index'),
+    'sleeve_display': ('d_condition', 'condition_sleeve_id', 'display_name')
+}
+
+# Everything GET /records adds to r.*
+LISTING_FIELDS = tuple(RECORD_LOOKUPS) + ('combined_quality',)
+
+
+class DimensionCacheHandler:
+    """
+    Loads each dimension table once per worker and serves it from memory.
+
+    Freshness comes from table_versions (migration 0005): triggers bump
+    a table's counter on every write, and each worker compares its counters
+    at most every CHECK_INTERVAL seconds with one small query, dropping the
+    tables that changed. Write endpoints also call invalidate() so the worker
+    that made the change sees it immediately. Without the versions table the
+    cache falls back to expiring every table after FALLBACK_TTL seconds.
+
+    Returned rows are shared between requests and must not be mutated.
+    """
+
+    FALLBACK_TTL = 30.0
+
+    def __init__(self, db_path: str, versions: TableVersionHandler = None):
+        self.db_path = db_path
+        self.versions = versions or TableVersionHandler(db_path)
+        self._tables = {}    # table -> (version, rows)
+        self._indexes = {}   # (table, key) -> {value: row}
+        self._loaded_at = {}
+        self._lock = threading.RLock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    # ==================== VERSIONS ====================
+
+    def _check_versions(self, force: bool = False):
+        """Drop every cached table whose stored version moved since it was loaded"""
+        now = time.monotonic()
+        versions = self.versions.current(force)
+        for table in list(self._tables):
+            if versions is None:
+                stale = now - self._loaded_at.get(table, 0) > self.FALLBACK_TTL
+            else:
+                stale = versions.get(table) != self._tables[table][0]
+            if stale:
+                self._drop(table)
+
+    def _drop(self, table: str):
+        self._tables.pop(table, None)
+        for key in [k for k in self._indexes if k[0] == table]:
+            del self._indexes[key]
+
+    def invalidate(self, *tables: str):
+        """Forget the given tables (all when none are given) in this worker"""
+        with self._lock:
+            for table in tables or list(self._tables):
+                self._drop(table)
+            # Pick up the bumped counters on the next read instead of reloading twice
+            self.versions.expire()
+
+    # ==================== LOOKUPS ====================
+
+    def rows(self, table: str) -> List[Dict]:
+        """All rows of a dimension table, in its natural display order"""
+        if table not in DIMENSION_TABLES:
+            raise ValueError(f'Not a dimension table: {table}')
+        with self._lock:
+            self._check_versions()
+            cached = self._tables.get(table)
+            if cached is not None:
+                return cached[1]
+
+            conn = self._connect()
+            try:
+                version = (read_versions(conn) or {}).get(table)
+                rows = [dict(row) for row in conn.execute(
+                    f'SELECT * FROM {table} ORDER BY {DIMENSION_TABLES[table]}'
+                ).fetchall()]
+            finally:
+                conn.close()
+            self._tables[table] = (version, rows)
+            self._loaded_at[table] = time.monotonic()
+            logger.debug(f"Loaded {len(rows)} rows of {table} (version {version})")
+            return rows
+
+    def index(self, table: str, key: str = 'id') -> Dict:
+        """Rows of a table keyed by one of its columns"""
+        with self._lock:
+            rows = self.rows(table)
+            found = self._indexes.get((table, key))
+            if found is None:
+                found = {row[key]: row for row in rows}
+                self._indexes[(table, key)] = found
+            return found
+
+    def get(self, table: str, value, key: str = 'id') -> Optional[Dict]:
+        """
+        One row by key. A miss re-checks the versions once, so a row added by
+        another worker a moment ago is found without waiting for CHECK_INTERVAL.
+        """
+        if value is None:
+            return None
+        row = self.index(table, key).get(value)
+        if row is None:
+            with self._lock:
+                self._check_versions(force=True)
+                row = self.index(table, key).get(value)
+        return row
+
+    def config(self, key: str, default=None):
+        row = self.index('app_config', 'config_key').get(key)
+        return row['config_value'] if row else default
+
+    def account_id(self, code: str) -> Optional[int]:
+        row = self.get('accounts', code, key='code')
+        return row['id'] if row else None
+
+    # ==================== RECORD DECORATION ====================
+
+    def decorate_records(self, records: List[Dict], fields: Iterable[str] = None) -> List[Dict]:
+        """
+        Add the format, status, location and condition display columns that
+        record listings used to get from joins, in place. fields limits which
+        ones are computed (default: all of LISTING_FIELDS).
+        """
+        fields = LISTING_FIELDS if fields is None else tuple(fields)
+        lookups = [(field,) + RECORD_LOOKUPS[field] for field in fields if field in RECORD_LOOKUPS]
+        combined = 'combined_quality' in fields
+        tables = {table for _, table, _, _ in lookups} | ({'d_condition'} if combined else set())
+        with self._lock:
+            # Ids missing from the cache mean another worker just added a row: re-check once, not per record
+            if any(record.get(column) is not None and record.get(column) not in self.index(table)
+                   for record in records for _, table, column, _ in lookups):
+                self._check_versions(force=True)
+            indexes = {table: self.index(table) for table in tables}
+
+        for record in records:
+            for field, table, column, source in lookups:
+                row = indexes[table].get(record.get(column))
+                value = row.get(source) if row else None
+                if field == 'genre_id':
+                    # A genre_id column on the record itself wins, as it did with r.* first in the joined query
+                    record.setdefault('genre_id', value)
+                else:
+                    record[field] = value
+            if combined:
+                disc = indexes['d_condition'].get(record.get('condition_disc_id')) or {}
+                sleeve = indexes['d_condition'].get(record.get('condition_sleeve_id')) or {}
+                if disc.get('quality_index') is not None and sleeve.get('quality_index') is not None:
+                    record['combined_quality'] = (disc['quality_index'] + sleeve['quality_index']) / 2.0
+                else:
+                    record['combined_quality'] = None
+        return records
+
+    def location_ids_for_genres(self, genre_ids: Iterable[int]) -> List[int]:
+        genre_ids = set(genre_ids)
+        return [row['id'] for row in self.rows('locations') if row.get('genre_id') in genre_ids]
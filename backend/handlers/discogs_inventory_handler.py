@@ -0,0 +1,386 @@
+"""Local mirror of the shop's Discogs inventory and its diff against records"""
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import requests
+
+from handlers.discogs_orders_handler import PIGSTYLE_ID_PATTERN
+
+logger = logging.getLogger(__name__)
+
+# records.status_id values
+ACTIVE_STATUS_IDS = (2,)
+SOLD_STATUS_IDS = (3, 4, 5)
+
+ACTIONS = ('update', 'delete')
+
+
+class DiscogsInventoryError(Exception):
+    """Raised when the inventory cannot be read from Discogs, or an action is malformed"""
+
+    def __init__(self, message: str, status_code: int = 502):
+        super().__init__(message)
+        self.status_code = status_code
+
+    def to_dict(self) -> Dict:
+        return {'status': 'error', 'error': str(self)}
+
+
+def markup_percent(rules: Sequence[Tuple[int, float]], days_old: int) -> float:
+    """Markup for a record's age, interpolated along markup_rules (days_old, markup_percent) sorted by age"""
+    if days_old <= rules[0][0]:
+        return rules[0][1]
+    if days_old >= rules[-1][0]:
+        return rules[-1][1]
+    for (x1, y1), (x2, y2) in zip(rules, rules[1:]):
+        if x1 <= days_old <= x2:
+            return y1 if x2 == x1 else y1 + (days_old - x1) / (x2 - x1) * (y2 - y1)
+    return 0.0
+
+
+def record_age_days(created_at, today: date = None) -> Optional[int]:
+    """Days since records.created_at ('YYYY-MM-DD', ISO or 'YYYY-MM-DD HH:MM:SS'); None if unparseable"""
+    if not created_at:
+        return None
+    try:
+        created = datetime.strptime(str(created_at)[:10], '%Y-%m-%d').date()
+    except ValueError:
+        return None
+    return ((today or date.today()) - created).days
+
+
+class DiscogsInventoryHandler:
+    """
+    discogs_listings (migration 0010), refreshed by sync() from
+    /users/<username>/inventory.
+
+    A sync reads page 1, then fetches the remaining pages PAGE_WORKERS at a
+    time; every request waits on the shared Discogs RateLimiter, so a
+    concurrent sync never exceeds the account's request budget. The
+    inventory is swapped in one transaction once every page has loaded.
+
+    diff() compares the mirror with records: listings whose record has been
+    sold locally (delete), active records with no For Sale listing (report
+    only; listing needs a release match), and listings whose price has
+    drifted from the markup curve (update). apply() runs a batch of
+    update/delete actions and reports each one.
+    """
+
+    NAMESPACE = 'discogs_inventory'
+    PER_PAGE = 100
+    PAGE_WORKERS = 4
+    ACTION_WORKERS = 4
+    DEFAULT_TOLERANCE = 0.50
+
+    def __init__(self, db_path: str, user_token: str, store, rate_limiter, username: str = 'pigstyle',
+                 http=None, user_agent: str = 'PigStyleMusic/1.0'):
+        self.db_path = db_path
+        self.user_token = user_token
+        self.store = store
+        self.rate_limiter = rate_limiter
+        self.username = username
+        self.http = http or requests
+        # Retries belong to the job queue (and rate limiter); HttpClient's own would bypass both
+        self._http_kwargs = {'retries': 0} if http is not None else {}
+        self.base_url = "https://api.discogs.com"
+        self.headers = {
+            "User-Agent": user_agent,
+            "Authorization": f"Discogs token={user_token}"
+        }
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _request(self, method: str, path: str, **kwargs) -> requests.Response:
+        if not self.user_token:
+            raise DiscogsInventoryError('Discogs token not configured', 500)
+        self.rate_limiter.acquire()
+        start_time = time.time()
+        response = self.http.request(method, f"{self.base_url}{path}", headers=self.headers, timeout=30,
+                                     **self._http_kwargs, **kwargs)
+        logger.info(f"Discogs API CALL: {method} {path} - {time.time() - start_time:.3f}s - "
+                    f"Status: {response.status_code}")
+        return response
+
+    # ------------------------------------------------------------------ sync
+
+    def sync_state(self) -> Optional[Dict]:
+        return self.store.get(self.NAMESPACE, 'sync')
+
+    def _fetch_page(self, page: int) -> Dict:
+        response = self._request('GET', f'/users/{self.username}/inventory',
+                                 params={'page': page, 'per_page': self.PER_PAGE, 'sort': 'listed', 'sort_order': 'desc'})
+        if response.status_code != 200:
+            raise DiscogsInventoryError(f"Discogs returned status {response.status_code} for inventory page {page}: "
+                                        f"{response.text[:200]}")
+        return response.json()
+
+    @staticmethod
+    def _listing_row(listing: Dict, sync_id: str) -> Optional[Tuple]:
+        release = listing.get('release') or {}
+        release_id = listing.get('release_id') or release.get('id')
+        if not listing.get('id') or not release_id:
+            return None
+        price = listing.get('price') or {}
+        comments = listing.get('comments') or ''
+        match = PIGSTYLE_ID_PATTERN.search(comments)
+        return (listing['id'], release_id, int(match.group(1)) if match else None, listing.get('status'),
+                price.get('value'), price.get('currency'), listing.get('condition'), listing.get('sleeve_condition'),
+                comments, release.get('artist'), release.get('title'), release.get('catalog_number'),
+                listing.get('posted'), sync_id)
+
+    def sync(self, progress: Callable[[Optional[float], Optional[str]], None] = None) -> Dict:
+        """Replace discogs_listings with the current Discogs inventory; returns counts"""
+        started = time.time()
+        sync_id = uuid.uuid4().hex
+        first = self._fetch_page(1)
+        pages = max((first.get('pagination') or {}).get('pages') or 1, 1)
+        listings = list(first.get('listings') or [])
+        done = 1
+        lock = threading.Lock()
+
+        def fetch(page):
+            nonlocal done
+            data = self._fetch_page(page)
+            with lock:
+                done += 1
+                if progress:
+                    progress(min(done / pages, 0.95), f'Fetched {done} of {pages} pages')
+            return data.get('listings') or []
+
+        if pages > 1:
+            with ThreadPoolExecutor(max_workers=self.PAGE_WORKERS, thread_name_prefix='discogs-inventory') as pool:
+                for page_listings in pool.map(fetch, range(2, pages + 1)):
+                    listings.extend(page_listings)
+
+        rows = [row for row in (self._listing_row(listing, sync_id) for listing in listings) if row]
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany('''
+                INSERT OR REPLACE INTO discogs_listings
+                    (listing_id, release_id, record_id, status, price, currency, media_condition, sleeve_condition,
+                     comments, artist, title, catalog_number, posted_at, sync_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            removed = conn.execute('DELETE FROM discogs_listings WHERE sync_id IS NOT ?', (sync_id,)).rowcount
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+        now = time.time()
+        state = {
+            'synced_ts': now,
+            'synced_at': datetime.fromtimestamp(now, timezone.utc).isoformat(),
+            'pages': pages,
+            'listings': len(rows),
+            'removed': removed,
+            'duration_ms': round((now - started) * 1000),
+            'last_error': None
+        }
+        self.store.set(self.NAMESPACE, 'sync', state)
+        logger.info(f"Discogs inventory sync: {len(rows)} listings from {pages} pages, "
+                    f"{removed} gone, in {state['duration_ms']}ms")
+        return state
+
+    def record_failure(self, error: str):
+        if self.store.update(self.NAMESPACE, 'sync', last_error=error) is None:
+            self.store.set(self.NAMESPACE, 'sync', {'synced_ts': None, 'last_error': error})
+
+    # ----------------------------------------------------------------- reads
+
+    def list(self, status: Optional[str] = None, record_id: Optional[int] = None, release_id: Optional[int] = None,
+             page: int = 1, per_page: int = 100) -> Tuple[List[Dict], int]:
+        where = ['1=1']
+        params = []
+        for column, value in (('status', status), ('record_id', record_id), ('release_id', release_id)):
+            if value is not None:
+                where.append(f'{column} = ?')
+                params.append(value)
+        query = f'FROM discogs_listings WHERE {" AND ".join(where)}'
+        conn = self._connect()
+        try:
+            total = conn.execute(f'SELECT COUNT(*) {query}', params).fetchone()[0]
+            rows = conn.execute(f'SELECT * {query} ORDER BY posted_at DESC, listing_id DESC LIMIT ? OFFSET ?',
+                                params + [per_page, (max(page, 1) - 1) * per_page]).fetchall()
+        finally:
+            conn.close()
+        return [dict(row) for row in rows], total
+
+    def diff(self, tolerance: float = None) -> Dict:
+        """
+        Listings vs records. Each For Sale listing linked to a sold (or
+        missing) record yields a delete action; each linked to an active
+        record priced more than `tolerance` dollars off the markup curve
+        yields an update action.
+        """
+        tolerance = self.DEFAULT_TOLERANCE if tolerance is None else tolerance
+        conn = self._connect()
+        try:
+            rules = [(row['days_old'], row['markup_percent']) for row in
+                     conn.execute('SELECT days_old, markup_percent FROM markup_rules ORDER BY days_old ASC')]
+            listed = conn.execute('''
+                SELECT l.listing_id, l.release_id, l.record_id, l.price, l.artist, l.title,
+                       r.id AS found_id, r.status_id, r.store_price, r.created_at, r.date_sold
+                FROM discogs_listings l
+                LEFT JOIN records r ON r.id = l.record_id
+                WHERE l.status = 'For Sale'
+            ''').fetchall()
+            not_listed = conn.execute(f'''
+                SELECT r.id AS record_id, r.artist, r.title, r.catalog_number, r.store_price, r.created_at
+                FROM records r
+                WHERE r.status_id IN ({','.join('?' * len(ACTIVE_STATUS_IDS))})
+                  AND (r.consignor_id IS NULL OR r.consignor_id = 1)
+                  AND r.store_price > 0
+                  AND NOT EXISTS (SELECT 1 FROM discogs_listings l
+                                  WHERE l.record_id = r.id AND l.status = 'For Sale')
+                ORDER BY r.id
+            ''', ACTIVE_STATUS_IDS).fetchall()
+        finally:
+            conn.close()
+
+        today = date.today()
+        sold_locally, price_drift, unlinked, actions = [], [], [], []
+        for row in listed:
+            listing = {'listing_id': row['listing_id'], 'release_id': row['release_id'], 'record_id': row['record_id'],
+                       'listed_price': row['price'], 'artist': row['artist'], 'title': row['title']}
+            if row['record_id'] is None:
+                unlinked.append(listing)
+            elif row['found_id'] is None or row['status_id'] in SOLD_STATUS_IDS:
+                listing.update(record_status_id=row['status_id'], date_sold=row['date_sold'])
+                sold_locally.append(listing)
+                actions.append({'action': 'delete', 'listing_id': row['listing_id'], 'reason': 'sold_locally'})
+            elif row['status_id'] in ACTIVE_STATUS_IDS and rules and row['store_price']:
+                days_old = record_age_days(row['created_at'], today)
+                if days_old is None:
+                    continue
+                markup = markup_percent(rules, days_old)
+                expected = round(row['store_price'] * (1 + markup / 100), 2)
+                if abs((row['price'] or 0) - expected) > tolerance:
+                    listing.update(store_price=row['store_price'], days_old=days_old,
+                                   markup_percent=round(markup, 1), expected_price=expected,
+                                   drift=round((row['price'] or 0) - expected, 2))
+                    price_drift.append(listing)
+                    actions.append({'action': 'update', 'listing_id': row['listing_id'], 'price': expected,
+                                    'reason': 'price_drift'})
+
+        return {
+            'summary': {
+                'listed': len(listed),
+                'sold_locally': len(sold_locally),
+                'not_listed': len(not_listed),
+                'price_drift': len(price_drift),
+                'unlinked': len(unlinked)
+            },
+            'tolerance': tolerance,
+            'markup_rules': len(rules),
+            'sold_locally': sold_locally,
+            'not_listed': [dict(row) for row in not_listed],
+            'price_drift': price_drift,
+            'unlinked': unlinked,
+            'actions': actions,
+            'sync': self.sync_state()
+        }
+
+    # --------------------------------------------------------------- actions
+
+    @staticmethod
+    def validate_actions(actions) -> List[Dict]:
+        if not isinstance(actions, list) or not actions:
+            raise DiscogsInventoryError('actions must be a non-empty list', 400)
+        cleaned = []
+        for action in actions:
+            if not isinstance(action, dict) or action.get('action') not in ACTIONS:
+                raise DiscogsInventoryError(f"Each action needs action in {ACTIONS}", 400)
+            if not isinstance(action.get('listing_id'), int):
+                raise DiscogsInventoryError('Each action needs an integer listing_id', 400)
+            cleaned_action = {'action': action['action'], 'listing_id': action['listing_id']}
+            if action['action'] == 'update':
+                try:
+                    cleaned_action['price'] = round(float(action['price']), 2)
+                except (KeyError, TypeError, ValueError):
+                    raise DiscogsInventoryError(f"Update of listing {action['listing_id']} needs a price", 400)
+                if cleaned_action['price'] <= 0:
+                    raise DiscogsInventoryError(f"Price for listing {action['listing_id']} must be > 0", 400)
+            cleaned.append(cleaned_action)
+        return cleaned
+
+    def _apply_one(self, action: Dict) -> Dict:
+        listing_id = action['listing_id']
+        result = dict(action, ok=False)
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT * FROM discogs_listings WHERE listing_id = ?', (listing_id,)).fetchone()
+            if row is None:
+                result['error'] = 'Listing not in the local inventory; sync first'
+                return result
+            try:
+                if action['action'] == 'delete':
+                    response = self._request('DELETE', f'/marketplace/listings/{listing_id}')
+                else:
+                    # Discogs requires the full listing on edit, so resend what the mirror holds
+                    response = self._request('POST', f'/marketplace/listings/{listing_id}', json={
+                        'release_id': row['release_id'],
+                        'condition': row['media_condition'],
+                        'sleeve_condition': row['sleeve_condition'],
+                        'price': action['price'],
+                        'status': row['status'] or 'For Sale',
+                        'comments': row['comments'] or ''
+                    })
+            except requests.exceptions.RequestException as e:
+                result['error'] = f'Discogs request failed: {e}'
+                return result
+            # A listing Discogs no longer has is as good as deleted
+            if response.status_code not in (200, 201, 204) and not (action['action'] == 'delete'
+                                                                   and response.status_code == 404):
+                result['error'] = f'Discogs returned status {response.status_code}: {response.text[:200]}'
+                return result
+            if action['action'] == 'delete':
+                conn.execute('DELETE FROM discogs_listings WHERE listing_id = ?', (listing_id,))
+            else:
+                result['previous_price'] = row['price']
+                conn.execute('UPDATE discogs_listings SET price = ?, synced_at = CURRENT_TIMESTAMP '
+                             'WHERE listing_id = ?', (action['price'], listing_id))
+            result['ok'] = True
+            return result
+        finally:
+            conn.close()
+
+    def apply(self, actions: List[Dict], progress: Callable[[Optional[float], Optional[str]], None] = None,
+              cancelled: Callable[[], bool] = None) -> Dict:
+        """Run update/delete actions (rate limited, ACTION_WORKERS at a time); one report entry per action"""
+        actions = self.validate_actions(actions)
+        results = []
+        lock = threading.Lock()
+
+        def run(action):
+            if cancelled and cancelled():
+                outcome = dict(action, ok=False, error='Cancelled')
+            else:
+                outcome = self._apply_one(action)
+            with lock:
+                results.append(outcome)
+                if progress:
+                    progress(len(results) / len(actions), f'{len(results)} of {len(actions)} actions')
+            return outcome
+
+        with ThreadPoolExecutor(max_workers=self.ACTION_WORKERS, thread_name_prefix='discogs-listing-actions') as pool:
+            report = list(pool.map(run, actions))
+        succeeded = sum(1 for r in report if r['ok'])
+        return {
+            'status': 'success' if succeeded == len(report) else 'partial',
+            'succeeded': succeeded,
+            'failed': len(report) - succeeded,
+            'results': report
+        }
@@ -0,0 +1,425 @@
+"""Local mirror of Discogs releases so lookups do not wait on the Discogs API"""
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIRROR_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'discogs_mirror.db')
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS releases (
+        release_id INTEGER PRIMARY KEY,
+        catno TEXT,
+        barcode TEXT,
+        artist TEXT,
+        title TEXT,
+        year TEXT,
+        country TEXT,
+        formats TEXT,
+        genres TEXT,
+        styles TEXT,
+        thumb TEXT,
+        cover_image TEXT,
+        search_result TEXT,
+        fetched_at REAL,
+        price_suggestions TEXT,
+        prices_fetched_at REAL,
+        community_want INTEGER,
+        community_have INTEGER,
+        stats_fetched_at REAL
+    );
+    CREATE TABLE IF NOT EXISTS release_identifiers (
+        kind TEXT NOT NULL,
+        value TEXT NOT NULL,
+        release_id INTEGER NOT NULL,
+        PRIMARY KEY (kind, value, release_id)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS search_queries (
+        query TEXT PRIMARY KEY,
+        release_ids TEXT NOT NULL,
+        fetched_at REAL NOT NULL
+    );
+'''
+
+
+class DiscogsLookupError(Exception):
+    """Raised when a lookup misses the mirror and the live Discogs request fails"""
+
+    def __init__(self, message: str, status_code: int = 502):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class RateLimiter:
+    """
+    Token bucket shared by every thread making live Discogs calls.
+
+    With a store (SharedStateHandler) the bucket lives in the shared_state
+    table under ('rate_limits', name), so every API worker and the listing
+    CLI draw from one per-token budget instead of each getting its own.
+    """
+
+    NAMESPACE = 'rate_limits'
+
+    def __init__(self, per_minute: int, burst: int, store=None, name: str = 'discogs'):
+        self.rate = per_minute / 60.0
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.store = store
+        self.name = name
+        self._lock = threading.Lock()
+
+    def _take(self, bucket, now):
+        """(new bucket, seconds to wait) for a bucket dict that may be None"""
+        if bucket is None:
+            bucket = {'tokens': float(self.capacity), 'updated': now}
+        tokens = min(self.capacity, bucket['tokens'] + max(now - bucket['updated'], 0) * self.rate)
+        if tokens >= 1:
+            return {'tokens': tokens - 1, 'updated': now}, 0
+        return {'tokens': tokens, 'updated': now}, (1 - tokens) / self.rate
+
+    def _take_shared(self):
+        # An idle bucket refills completely, so it may expire once full
+        ttl = self.capacity / self.rate + 60
+        return self.store.modify(self.NAMESPACE, self.name, lambda bucket: self._take(bucket, time.time()), ttl)
+
+    def _take_local(self):
+        with self._lock:
+            bucket, wait = self._take({'tokens': self.tokens, 'updated': self.updated}, time.monotonic())
+            self.tokens, self.updated = bucket['tokens'], bucket['updated']
+            return wait
+
+    def acquire(self):
+        while True:
+            wait = self._take_shared() if self.store is not None else self._take_local()
+            if not wait:
+                return
+            time.sleep(wait)
+
+
+class DiscogsMirrorHandler:
+    """
+    SQLite store of every Discogs release we have searched for or priced.
+
+    Releases are indexed by normalized catalog number and barcode, free-text
+    searches are remembered by normalized query, and price suggestions and
+    community stats are kept per release. Lookups answer from the mirror when
+    it has the data; entries older than their TTL are still returned and a
+    background refresh is scheduled. Only a complete miss waits on Discogs.
+    """
+
+    RELEASE_TTL = 30 * 86400
+    SEARCH_TTL = 7 * 86400
+    PRICE_TTL = 86400
+    STATS_TTL = 86400
+    SEARCH_PER_PAGE = 25
+    REFRESH_WORKERS = 2
+    POOL_SIZE = 16
+    # Discogs allows 60 authenticated requests per minute
+    RATE_PER_MINUTE = 55
+    RATE_BURST = 5
+
+    def __init__(self, user_token: str, db_path: str = None, user_agent: str = 'PigStyleMusic/1.0', http=None,
+                 store=None):
+        self.user_token = user_token
+        self.db_path = db_path or DEFAULT_MIRROR_PATH
+        self.base_url = "https://api.discogs.com"
+        self.headers = {
+            "User-Agent": user_agent,
+            "Authorization": f"Discogs token={user_token}"
+        }
+        # One keep-alive pool for every caller thread instead of a TLS handshake per request
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=self.POOL_SIZE))
+        # A shared HttpClient, when given, replaces the private session (adds retries, breaker, metrics)
+        self.http = http
+        # A SharedStateHandler, when given, holds the rate-limit bucket so workers share one budget
+        self.rate_limiter = RateLimiter(self.RATE_PER_MINUTE, self.RATE_BURST, store=store)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._executor = None
+        # The mirror file is created on first use, so constructing (importing api) touches no disk
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    def _init_db(self):
+        with self._init_lock:
+            if self._initialized:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            try:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.executescript(SCHEMA)
+            finally:
+                conn.close()
+            self._initialized = True
+
+    def _connect(self):
+        if not self._initialized:
+            self._init_db()
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    # ==================== NORMALIZATION ====================
+
+    @staticmethod
+    def normalize_catno(value: str) -> str:
+        """'MG V-8367' and 'mgv 8367' both become 'MGV8367'"""
+        return re.sub(r'[^A-Z0-9]', '', (value or '').upper())
+
+    @staticmethod
+    def normalize_barcode(value: str) -> str:
+        return re.sub(r'\D', '', value or '')
+
+    @staticmethod
+    def normalize_query(value: str) -> str:
+        return ' '.join((value or '').lower().split())
+
+    # ==================== LIVE REQUESTS ====================
+
+    def _get(self, path: str, params: Dict = None) -> Dict:
+        self.rate_limiter.acquire()
+        start_time = time.time()
+        logger.info(f"Discogs API CALL [START]: GET {path}")
+        try:
+            if self.http is not None:
+                # No HttpClient retries: they would skip the rate limiter, and a failed lookup is
+                # already retried by the next request or the stale-entry refresh
+                response = self.http.get(f"{self.base_url}{path}", headers=self.headers, params=params, timeout=15,
+                                         retries=0)
+            else:
+                response = self.session.get(f"{self.base_url}{path}", params=params, timeout=15)
+        except requests.exceptions.RequestException as e:
+            raise DiscogsLookupError(f"Discogs request failed: {e}")
+        duration = time.time() - start_time
+        logger.info(f"Discogs API CALL [END]: GET {path} - {duration:.3f}s - Status: {response.status_code}")
+        if response.status_code != 200:
+            raise DiscogsLookupError(f"Discogs returned status {response.status_code}", response.status_code)
+        return response.json()
+
+    def _refresh_later(self, key: tuple, func, *args):
+        """Run func(*args) on the refresh pool unless the same key is already refreshing"""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.REFRESH_WORKERS,
+                                                    thread_name_prefix='discogs-mirror')
+
+        def run():
+            try:
+                func(*args)
+            except Exception as e:
+                logger.warning(f"Background Discogs refresh {key} failed: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._executor.submit(run)
+
+    # ==================== STORAGE ====================
+
+    def _store_search_results(self, conn, results: List[Dict]):
+        now = time.time()
+        for result in results:
+            release_id = result.get('id')
+            if not release_id:
+                continue
+            catnos = [c.strip() for c in (result.get('catno') or '').split(',') if c.strip()]
+            barcodes = result.get('barcode') or []
+            if isinstance(barcodes, str):
+                barcodes = [barcodes]
+            title = result.get('title', '')
+            artist, _, release_title = title.partition(' - ')
+            conn.execute('''
+                INSERT INTO releases (release_id, catno, barcode, artist, title, year, country,
+                                      formats, genres, styles, thumb, cover_image, search_result, fetched_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(release_id) DO UPDATE SET
+                    catno = excluded.catno, barcode = excluded.barcode, artist = excluded.artist,
+                    title = excluded.title, year = excluded.year, country = excluded.country,
+                    formats = excluded.formats, genres = excluded.genres, styles = excluded.styles,
+                    thumb = excluded.thumb, cover_image = excluded.cover_image,
+                    search_result = excluded.search_result, fetched_at = excluded.fetched_at
+            ''', (
+                release_id, result.get('catno', ''), barcodes[0] if barcodes else '',
+                artist.strip() if release_title else '', (release_title or title).strip(),
+                str(result.get('year') or ''), result.get('country', ''),
+                json.dumps(result.get('format', [])), json.dumps(result.get('genre', [])),
+                json.dumps(result.get('style', [])), result.get('thumb', ''), result.get('cover_image', ''),
+                json.dumps(result), now
+            ))
+            identifiers = [('catno', self.normalize_catno(c)) for c in catnos]
+            identifiers += [('barcode', self.normalize_barcode(b)) for b in barcodes]
+            conn.executemany(
+                'INSERT OR IGNORE INTO release_identifiers (kind, value, release_id) VALUES (?, ?, ?)',
+                [(kind, value, release_id) for kind, value in identifiers if value]
+            )
+
+    def _load_search_results(self, conn, release_ids: List[int]) -> List[Dict]:
+        if not release_ids:
+            return []
+        placeholders = ','.join(['?'] * len(release_ids))
+        rows = conn.execute(
+            f'SELECT release_id, search_result FROM releases WHERE release_id IN ({placeholders})', release_ids
+        ).fetchall()
+        by_id = {row['release_id']: json.loads(row['search_result']) for row in rows if row['search_result']}
+        return [by_id[release_id] for release_id in release_ids if release_id in by_id]
+
+    # ==================== SEARCH ====================
+
+    def _query_key(self, query: str, format_filter: str = None) -> str:
+        key = self.normalize_query(query)
+        return f"{key}|format={format_filter}" if format_filter else key
+
+    def _fetch_search(self, query: str, format_filter: str = None) -> List[Dict]:
+        params = {'q': query, 'type': 'release', 'per_page': self.SEARCH_PER_PAGE}
+        if format_filter:
+            params['format'] = format_filter
+        results = self._get('/database/search', params).get('results', [])
+        conn = self._connect()
+        try:
+            self._store_search_results(conn, results)
+            conn.execute('''
+                INSERT OR REPLACE INTO search_queries (query, release_ids, fetched_at) VALUES (?, ?, ?)
+            ''', (self._query_key(query, format_filter), json.dumps([r['id'] for r in results if r.get('id')]),
+                  time.time()))
+            conn.commit()
+        finally:
+            conn.close()
+        return results
+
+    def _identifier_matches(self, conn, query: str) -> List[int]:
+        """Release ids whose catalog number or barcode equals the query"""
+        candidates = [('catno', self.normalize_catno(query))]
+        barcode = self.normalize_barcode(query)
+        # Only treat mostly-numeric input as a barcode (UPC/EAN are 8-14 digits)
+        if len(barcode) >= 8 and len(barcode) >= len(query.replace(' ', '')) - 2:
+            candidates.append(('barcode', barcode))
+        ids = []
+        for kind, value in candidates:
+            if not value:
+                continue
+            for row in conn.execute('SELECT release_id FROM release_identifiers WHERE kind = ? AND value = ?',
+                                    (kind, value)):
+                if row[0] not in ids:
+                    ids.append(row[0])
+        return ids
+
+    def search_results(self, query: str, format_filter: str = None, per_page: int = None) -> List[Dict]:
+        """
+        Raw Discogs /database/search results for a query, mirror first.
+
+        Callers keep their own parsing of the Discogs result format. Raises
+        DiscogsLookupError only when the mirror has nothing and Discogs fails.
+        """
+        per_page = per_page or self.SEARCH_PER_PAGE
+        conn = self._connect()
+        try:
+            cached = conn.execute('SELECT release_ids, fetched_at FROM search_queries WHERE query = ?',
+                                  (self._query_key(query, format_filter),)).fetchone()
+            if cached:
+                if time.time() - cached['fetched_at'] > self.SEARCH_TTL:
+                    self._refresh_later(('search', query, format_filter), self._fetch_search, query, format_filter)
+                logger.info(f"Discogs mirror hit: search '{query[:50]}'")
+                return self._load_search_results(conn, json.loads(cached['release_ids']))[:per_page]
+
+            ids = self._identifier_matches(conn, query)
+            results = self._load_search_results(conn, ids)
+            if format_filter:
+                results = [r for r in results if format_filter in (r.get('format') or [])]
+            if results:
+                logger.info(f"Discogs mirror hit: catalog/barcode '{query[:50]}'")
+                # Identifier hits skip the search cache, so keep the releases themselves fresh
+                self._refresh_stale_releases(conn, [r['id'] for r in results], query, format_filter)
+                return results[:per_page]
+        finally:
+            conn.close()
+
+        return self._fetch_search(query, format_filter)[:per_page]
+
+    def _refresh_stale_releases(self, conn, release_ids: List[int], query: str, format_filter: str = None):
+        placeholders = ','.join(['?'] * len(release_ids))
+        oldest = conn.execute(f'SELECT MIN(fetched_at) FROM releases WHERE release_id IN ({placeholders})',
+                              release_ids).fetchone()[0]
+        if oldest is not None and time.time() - oldest > self.RELEASE_TTL:
+            self._refresh_later(('search', query, format_filter), self._fetch_search, query, format_filter)
+
+    # ==================== PRICES & STATS ====================
+
+    def _fetch_price_suggestions(self, release_id: int) -> Dict:
+        data = self._get(f'/marketplace/price_suggestions/{release_id}')
+        conn = self._connect()
+        try:
+            conn.execute('INSERT OR IGNORE INTO releases (release_id) VALUES (?)', (release_id,))
+            conn.execute('UPDATE releases SET price_suggestions = ?, prices_fetched_at = ? WHERE release_id = ?',
+                         (json.dumps(data), time.time(), release_id))
+            conn.commit()
+        finally:
+            conn.close()
+        return data
+
+    def _fetch_stats(self, release_id: int) -> Dict:
+        data = self._get(f'/releases/{release_id}/stats')
+        community = data.get('community', {}) or {}
+        conn = self._connect()
+        try:
+            conn.execute('INSERT OR IGNORE INTO releases (release_id) VALUES (?)', (release_id,))
+            conn.execute('''
+                UPDATE releases SET community_want = ?, community_have = ?, stats_fetched_at = ?
+                WHERE release_id = ?
+            ''', (community.get('want', 0), community.get('have', 0), time.time(), release_id))
+            conn.commit()
+        finally:
+            conn.close()
+        return data
+
+    def _cached_release(self, release_id: int) -> Optional[sqlite3.Row]:
+        conn = self._connect()
+        try:
+            return conn.execute('SELECT * FROM releases WHERE release_id = ?', (release_id,)).fetchone()
+        finally:
+            conn.close()
+
+    def price_suggestions(self, release_id: int) -> Optional[Dict]:
+        """Discogs price suggestions ({condition: {'value', 'currency'}}), mirror first. None on failure."""
+        row = self._cached_release(release_id)
+        if row and row['prices_fetched_at'] is not None:
+            if time.time() - row['prices_fetched_at'] > self.PRICE_TTL:
+                self._refresh_later(('prices', release_id), self._fetch_price_suggestions, release_id)
+            logger.info(f"Discogs mirror hit: price suggestions {release_id}")
+            return json.loads(row['price_suggestions'])
+        try:
+            return self._fetch_price_suggestions(release_id)
+        except DiscogsLookupError as e:
+            logger.error(f"Price suggestions for release {release_id} failed: {e}")
+            return None
+
+    def release_stats(self, release_id: int) -> Dict:
+        """Community stats in the /releases/{id}/stats shape, mirror first. Empty dict on failure."""
+        row = self._cached_release(release_id)
+        if row and row['stats_fetched_at'] is not None:
+            if time.time() - row['stats_fetched_at'] > self.STATS_TTL:
+                self._refresh_later(('stats', release_id), self._fetch_stats, release_id)
+            logger.info(f"Discogs mirror hit: stats {release_id}")
+            return {'community': {'want': row['community_want'] or 0, 'have': row['community_have'] or 0}}
+        try:
+            return self._fetch_stats(release_id)
+        except DiscogsLookupError as e:
+            logger.error(f"Stats for release {release_id} failed: {e}")
+            return {}
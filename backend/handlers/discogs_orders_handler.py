@@ -0,0 +1,272 @@
+"""Local store of Discogs marketplace orders, synced incrementally from the API"""
+import json
+import logging
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+PIGSTYLE_ID_PATTERN = re.compile(r'\[PIGSTYLE ID:\s*(\d+)\]', re.IGNORECASE)
+
+
+class DiscogsOrdersError(Exception):
+    """Raised when a sync cannot read orders from Discogs"""
+
+    def __init__(self, message: str, status_code: int = 502):
+        super().__init__(message)
+        self.status_code = status_code
+
+    def to_dict(self) -> Dict:
+        return {'status': 'error', 'error': str(self)}
+
+
+def pigstyle_id(item: Dict) -> Optional[int]:
+    """Record id from the [PIGSTYLE ID: n] tag in an order item's comments or release description"""
+    for text in (item.get('condition_comments'), item.get('private_comments'), item.get('release_description')):
+        match = PIGSTYLE_ID_PATTERN.search(text or '')
+        if match:
+            return int(match.group(1))
+    return None
+
+
+class DiscogsOrdersHandler:
+    """
+    discogs_orders / discogs_order_items (migration 0009), filled by sync().
+
+    A sync asks Discogs for orders sorted by last_activity, newest first,
+    and stops at the first page that reaches the newest last_activity
+    already stored, so a routine sync is one or two requests. Pages are
+    fetched PAGE_WORKERS at a time; a full sync (first run, or full=True)
+    fetches every page after the first concurrently. Orders are parsed once
+    with DiscogsHandler._parse_order and upserted in one transaction.
+
+    Sync bookkeeping (last run, counts, error) lives in shared_state so
+    every worker process sees it.
+    """
+
+    NAMESPACE = 'discogs_orders'
+    PER_PAGE = 100
+    PAGE_WORKERS = 4
+
+    ORDER_COLUMNS = ('order_id', 'status', 'buyer_username', 'buyer_name', 'buyer_email', 'total_amount',
+                     'shipping_amount', 'fee_amount', 'currency', 'created_at', 'paid_at', 'shipped_at',
+                     'last_activity')
+
+    def __init__(self, db_path: str, store):
+        self.db_path = db_path
+        self.store = store
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    # ------------------------------------------------------------------ sync
+
+    def sync_state(self) -> Optional[Dict]:
+        return self.store.get(self.NAMESPACE, 'sync')
+
+    def is_stale(self, max_age: float) -> bool:
+        state = self.sync_state()
+        return not state or not state.get('synced_ts') or time.time() - state['synced_ts'] > max_age
+
+    def watermark(self) -> Optional[str]:
+        conn = self._connect()
+        try:
+            return conn.execute('SELECT MAX(last_activity) FROM discogs_orders').fetchone()[0]
+        finally:
+            conn.close()
+
+    def _fetch_page(self, discogs, page: int) -> Dict:
+        result = discogs.get_orders(page=page, per_page=self.PER_PAGE, sort='last_activity', sort_order='desc')
+        if not result['success']:
+            raise DiscogsOrdersError(result.get('error') or f'Failed to fetch orders page {page}')
+        return result
+
+    def sync(self, discogs, full: bool = False,
+             progress: Callable[[Optional[float], Optional[str]], None] = None) -> Dict:
+        """
+        Pull new and changed orders from Discogs (a DiscogsHandler) into the
+        store; returns counts and the new watermark.
+        """
+        started = time.time()
+        since = None if full else self.watermark()
+        first = self._fetch_page(discogs, 1)
+        pages = max(first['pagination'].get('pages') or 1, 1)
+        orders = list(first['orders'])
+
+        def reached(page_orders: List[Dict]) -> bool:
+            return since is not None and any((o.get('last_activity') or '') <= since for o in page_orders)
+
+        fetched_pages = 1
+        done = reached(first['orders'])
+        with ThreadPoolExecutor(max_workers=self.PAGE_WORKERS, thread_name_prefix='discogs-orders') as pool:
+            next_page = 2
+            while not done and next_page <= pages:
+                # A full sync takes every remaining page at once; an incremental one goes a round at a time
+                batch = list(range(next_page, pages + 1 if since is None else min(next_page + self.PAGE_WORKERS, pages + 1)))
+                for result in pool.map(lambda p: self._fetch_page(discogs, p), batch):
+                    orders.extend(result['orders'])
+                    done = done or reached(result['orders'])
+                fetched_pages += len(batch)
+                next_page = batch[-1] + 1
+                if progress:
+                    progress(min(fetched_pages / pages, 0.95), f'Fetched {fetched_pages} of {pages} pages')
+
+        if since is not None:
+            orders = [o for o in orders if (o.get('last_activity') or '') >= since]
+        stored = self.store_orders(orders)
+
+        now = time.time()
+        state = {
+            'synced_ts': now,
+            'synced_at': datetime.fromtimestamp(now, timezone.utc).isoformat(),
+            'full': since is None,
+            'pages': fetched_pages,
+            'orders': stored,
+            'watermark': self.watermark(),
+            'duration_ms': round((now - started) * 1000),
+            'last_error': None
+        }
+        self.store.set(self.NAMESPACE, 'sync', state)
+        logger.info(f"Discogs orders sync: {stored} orders from {fetched_pages}/{pages} pages "
+                    f"({'full' if since is None else 'since ' + since}) in {state['duration_ms']}ms")
+        return state
+
+    def record_failure(self, error: str):
+        """Keep the previous sync time (so the store stays usable) and note the error"""
+        if self.store.update(self.NAMESPACE, 'sync', last_error=error) is None:
+            self.store.set(self.NAMESPACE, 'sync', {'synced_ts': None, 'last_error': error})
+
+    def store_orders(self, orders: List[Dict]) -> int:
+        orders = [o for o in orders if o and o.get('order_id')]
+        if not orders:
+            return 0
+        order_rows = []
+        item_rows = []
+        for order in orders:
+            for position, item in enumerate(order.get('items') or []):
+                item['record_id'] = pigstyle_id(item)
+                item_rows.append((order['order_id'], position, item.get('item_id'), item.get('listing_id'),
+                                  item.get('release_id'), item['record_id'], item.get('artist'), item.get('title'),
+                                  item.get('price'), item.get('quantity')))
+            order_rows.append(tuple(order.get(col) for col in self.ORDER_COLUMNS) +
+                              (len(order.get('items') or []), json.dumps(order)))
+
+        updates = ', '.join(f'{col} = excluded.{col}' for col in self.ORDER_COLUMNS[1:])
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany(f'''
+                INSERT INTO discogs_orders ({', '.join(self.ORDER_COLUMNS)}, item_count, payload)
+                VALUES ({', '.join('?' * (len(self.ORDER_COLUMNS) + 2))})
+                ON CONFLICT(order_id) DO UPDATE SET {updates}, item_count = excluded.item_count,
+                    payload = excluded.payload, synced_at = CURRENT_TIMESTAMP
+            ''', order_rows)
+            conn.executemany('DELETE FROM discogs_order_items WHERE order_id = ?',
+                             [(order['order_id'],) for order in orders])
+            conn.executemany('''
+                INSERT INTO discogs_order_items
+                    (order_id, position, item_id, listing_id, release_id, record_id, artist, title, price, quantity)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', item_rows)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        return len(order_rows)
+
+    # ----------------------------------------------------------------- reads
+
+    def list(self, status: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None,
+             search: Optional[str] = None, page: int = 1, per_page: Optional[int] = None) -> Tuple[List[Dict], int]:
+        """Orders newest first and the total matching; per_page=None returns every match"""
+        where = ['1=1']
+        params = []
+        if status:
+            where.append('status = ?')
+            params.append(status)
+        if date_from:
+            where.append('created_at >= ?')
+            params.append(date_from)
+        if date_to:
+            where.append('created_at <= ?')
+            params.append(date_to)
+        if search:
+            like = f'%{search}%'
+            where.append('''(order_id LIKE ? OR buyer_username LIKE ? OR buyer_name LIKE ? OR EXISTS (
+                SELECT 1 FROM discogs_order_items i WHERE i.order_id = discogs_orders.order_id
+                AND (i.artist LIKE ? OR i.title LIKE ?)))''')
+            params.extend([like] * 5)
+        query = f'FROM discogs_orders WHERE {" AND ".join(where)}'
+
+        conn = self._connect()
+        try:
+            total = conn.execute(f'SELECT COUNT(*) {query}', params).fetchone()[0]
+            query = f'SELECT payload {query} ORDER BY created_at DESC, order_id DESC'
+            if per_page:
+                query += ' LIMIT ? OFFSET ?'
+                params.extend([per_page, (max(page, 1) - 1) * per_page])
+            orders = [json.loads(row['payload']) for row in conn.execute(query, params)]
+        finally:
+            conn.close()
+        return orders, total
+
+    def find_items(self, order_ids: Sequence[str] = (), record_ids: Sequence[int] = ()) -> List[Dict]:
+        """
+        Order items with their order's status, dates and fee, for every item
+        of the given orders and the most recent sale of each given record.
+        Uses the order_id primary key and the record_id index.
+        """
+        columns = '''
+            SELECT i.order_id, i.position, i.listing_id, i.release_id, i.record_id, i.artist, i.title,
+                   i.price, i.quantity, o.status AS order_status, o.created_at, o.paid_at, o.fee_amount,
+                   o.currency, (SELECT SUM(price * COALESCE(quantity, 1)) FROM discogs_order_items
+                                WHERE order_id = i.order_id) AS order_subtotal
+            FROM discogs_order_items i
+            JOIN discogs_orders o ON o.order_id = i.order_id
+        '''
+        items = []
+        conn = self._connect()
+        try:
+            for chunk_start in range(0, len(order_ids), 500):
+                chunk = list(order_ids[chunk_start:chunk_start + 500])
+                items.extend(dict(row) for row in conn.execute(
+                    f'{columns} WHERE i.order_id IN ({",".join("?" * len(chunk))}) ORDER BY i.order_id, i.position',
+                    chunk))
+            for record_id in record_ids:
+                row = conn.execute(f'{columns} WHERE i.record_id = ? ORDER BY o.created_at DESC LIMIT 1',
+                                   (record_id,)).fetchone()
+                if row:
+                    items.append(dict(row))
+        finally:
+            conn.close()
+        return items
+
+    def get(self, order_id: str) -> Optional[Dict]:
+        """One order with each item's record_id and record_status_id (None when unlinked)"""
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT payload FROM discogs_orders WHERE order_id = ?', (order_id,)).fetchone()
+            if row is None:
+                return None
+            order = json.loads(row['payload'])
+            links = {link['position']: link for link in conn.execute('''
+                SELECT i.position, i.record_id, r.status_id
+                FROM discogs_order_items i
+                LEFT JOIN records r ON r.id = i.record_id
+                WHERE i.order_id = ?
+            ''', (order_id,))}
+        finally:
+            conn.close()
+        for position, item in enumerate(order.get('items') or []):
+            link = links.get(position)
+            item['record_id'] = link['record_id'] if link else None
+            item['record_status_id'] = link['status_id'] if link else None
+        return order
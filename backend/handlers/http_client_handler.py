@@ -0,0 +1,243 @@
+"""Pooled, retrying HTTP client for outbound integrations (Square, Discogs, YouTube)"""
+import logging
+import random
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised without a network call while an upstream's breaker is open"""
+
+    def __init__(self, host: str, retry_in: float):
+        super().__init__(f'{host} is unavailable (circuit open, retry in {retry_in:.0f}s)')
+        self.host = host
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure breaker for one upstream. After `threshold` failures
+    in a row calls fail fast for `reset_after` seconds; then one trial call
+    is let through (half-open) and its outcome closes or re-opens it.
+    """
+
+    def __init__(self, threshold: int = 5, reset_after: float = 30.0):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        return 'half_open' if time.time() - self.opened_at >= self.reset_after else 'open'
+
+    def before_call(self, host: str):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            waited = time.time() - self.opened_at
+            if waited < self.reset_after or self._trial:
+                raise CircuitOpenError(host, max(self.reset_after - waited, 0))
+            self._trial = True
+
+    def release(self):
+        """Free the half-open trial slot without counting an outcome"""
+        with self._lock:
+            self._trial = False
+
+    def record(self, ok: bool, host: str):
+        with self._lock:
+            self._trial = False
+            if ok:
+                if self.opened_at is not None:
+                    logger.info(f'Circuit for {host} closed')
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.failures >= self.threshold and (self.opened_at is None or self.state == 'half_open'):
+                logger.warning(f'Circuit for {host} opened after {self.failures} consecutive failures')
+                self.opened_at = time.time()
+
+
+class LatencyStats:
+    """Default metrics hook: per-host counts and recent latency percentiles"""
+
+    def __init__(self, window: int = 500):
+        self.window = window
+        self._hosts: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event: Dict):
+        with self._lock:
+            host = self._hosts.setdefault(event['host'], {
+                'requests': 0, 'errors': 0, 'retries': 0, 'latencies': deque(maxlen=self.window)
+            })
+            host['requests'] += 1
+            if event['attempt'] > 1:
+                host['retries'] += 1
+            if event['error'] or (event['status'] or 0) >= 500:
+                host['errors'] += 1
+            host['latencies'].append(event['elapsed_ms'])
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            result = {}
+            for name, host in self._hosts.items():
+                latencies = sorted(host['latencies'])
+
+                def pct(p):
+                    return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 1) if latencies else None
+                result[name] = {
+                    'requests': host['requests'], 'errors': host['errors'], 'retries': host['retries'],
+                    'p50_ms': pct(0.50), 'p95_ms': pct(0.95), 'max_ms': round(latencies[-1], 1) if latencies else None
+                }
+            return result
+
+
+class HttpClient:
+    """
+    One requests.Session per upstream host, so keep-alive connections (and
+    their TLS sessions) are reused instead of set up per call.
+
+    request() adds a default timeout when the caller gives none, retries
+    idempotent calls (GET/PUT/DELETE, or idempotent=True for POSTs that
+    carry an idempotency key) on connection errors and 429/5xx with
+    exponential backoff and Retry-After, and guards each host with a
+    CircuitBreaker. Every attempt is reported to the metrics hooks as a dict
+    (host, method, path, status, elapsed_ms, attempt, error).
+
+    Errors surface exactly as with module-level requests calls (responses
+    are returned whatever their status; CircuitOpenError is a
+    ConnectionError), so existing error handling keeps working.
+    """
+
+    def __init__(self, timeout=(5, 30), retries: int = 2, backoff: float = 0.5, max_backoff: float = 10.0,
+                 breaker_threshold: int = 5, breaker_reset: float = 30.0, pool_size: int = 10):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+        self.pool_size = pool_size
+        self.stats = LatencyStats()
+        self._hooks: List[Callable[[Dict], None]] = [self.stats]
+        self._sessions: Dict[str, requests.Session] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def add_hook(self, hook: Callable[[Dict], None]):
+        self._hooks.append(hook)
+
+    def _upstream(self, host: str):
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._sessions[host] = session
+                self._breakers[host] = CircuitBreaker(self.breaker_threshold, self.breaker_reset)
+            return session, self._breakers[host]
+
+    def _emit(self, event: Dict):
+        for hook in self._hooks:
+            try:
+                hook(event)
+            except Exception as e:
+                logger.error(f'HTTP metrics hook failed: {e}')
+
+    def _delay(self, attempt: int, response: Optional[requests.Response]) -> float:
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        delay = min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+        return delay * (0.5 + random.random() / 2)
+
+    def request(self, method: str, url: str, timeout=None, retries: Optional[int] = None,
+                idempotent: Optional[bool] = None, **kwargs) -> requests.Response:
+        method = method.upper()
+        parts = urlsplit(url)
+        host = parts.netloc
+        session, breaker = self._upstream(host)
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        attempts = 1 + ((self.retries if retries is None else retries) if idempotent else 0)
+        timeout = self.timeout if timeout is None else timeout
+
+        for attempt in range(1, attempts + 1):
+            breaker.before_call(host)
+            started = time.perf_counter()
+            response = None
+            try:
+                response = session.request(method, url, timeout=timeout, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                breaker.record(False, host)
+                self._emit({'host': host, 'method': method, 'path': parts.path, 'status': None,
+                            'elapsed_ms': (time.perf_counter() - started) * 1000, 'attempt': attempt,
+                            'error': type(e).__name__})
+                if attempt >= attempts:
+                    raise
+                delay = self._delay(attempt, None)
+                logger.warning(f'{method} {host}{parts.path} failed ({type(e).__name__}), retry {attempt} in {delay:.1f}s')
+                time.sleep(delay)
+                continue
+            except BaseException:
+                # Not an upstream failure (bad URL or arguments, interrupt): say nothing about the
+                # host, but free the trial slot or a half-open breaker would stay open for good
+                breaker.release()
+                raise
+
+            breaker.record(response.status_code < 500, host)
+            self._emit({'host': host, 'method': method, 'path': parts.path, 'status': response.status_code,
+                        'elapsed_ms': (time.perf_counter() - started) * 1000, 'attempt': attempt, 'error': None})
+            if response.status_code in RETRY_STATUSES and attempt < attempts:
+                delay = self._delay(attempt, response)
+                logger.warning(f'{method} {host}{parts.path} returned {response.status_code}, '
+                               f'retry {attempt} in {delay:.1f}s')
+                response.close()
+                time.sleep(delay)
+                continue
+            return response
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> requests.Response:
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> requests.Response:
+        return self.request('DELETE', url, **kwargs)
+
+    def circuits(self) -> Dict[str, Dict]:
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {host: {'state': b.state, 'consecutive_failures': b.failures} for host, b in breakers.items()}
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Stats and breaker state per host, for the admin endpoint"""
+        stats = self.stats.snapshot()
+        return {host: {**stats.get(host, {}), 'circuit': circuit} for host, circuit in self.circuits().items()}
@@ -0,0 +1,263 @@
+"""Responsive image derivatives (WebP/AVIF at several widths) for PigStyle Records"""
+import hashlib
+import io
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional
+
+import requests
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+
+class ImageDerivativeHandler:
+    """
+    Generates resized, metadata-free WebP (and AVIF when Pillow supports it)
+    copies of uploaded and hotlinked images in a background thread, records
+    them in image_variants and decorates listing rows with srcset strings.
+
+    Without Pillow installed everything degrades to the originals: enqueue()
+    is a no-op and listings carry no srcset.
+    """
+
+    WIDTHS = (160, 320, 640, 1024)
+    QUALITY = {'webp': 80, 'avif': 55}
+    SKIP_EXTENSIONS = ('.svg', '.pdf')
+    MAX_SOURCE_BYTES = 15 * 1024 * 1024
+    QUEUE_SIZE = 1000
+    MAX_ENQUEUE_PER_REQUEST = 50
+
+    def __init__(self, db_path: str, static_dir: str, user_agent: str = None, http=None):
+        self.db_path = db_path
+        self.static_dir = static_dir
+        # Optional shared HttpClient (pooled connections, retries, per-host breaker)
+        self.http = http
+        self.output_dir = os.path.join(static_dir, 'images', 'derived')
+        self.user_agent = user_agent or 'PigStyleMusic/1.0'
+        self.formats = self._supported_formats()
+        self._queue = queue.Queue(maxsize=self.QUEUE_SIZE)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    @staticmethod
+    def _supported_formats() -> List[str]:
+        if Image is None:
+            return []
+        formats = []
+        if features.check('webp'):
+            formats.append('webp')
+        if features.check('avif'):
+            formats.append('avif')
+        return formats
+
+    @property
+    def available(self) -> bool:
+        return bool(self.formats)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    # ==================== QUEUE ====================
+
+    def enqueue(self, source_url: str) -> bool:
+        """Queue an original for derivative generation. Returns False if it was not queued."""
+        if not self.available or not source_url or source_url.lower().endswith(self.SKIP_EXTENSIONS):
+            return False
+        with self._lock:
+            if source_url in self._pending:
+                return False
+            try:
+                self._queue.put_nowait(source_url)
+            except queue.Full:
+                return False
+            self._pending.add(source_url)
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='image-derivatives', daemon=True)
+                self._worker.start()
+        return True
+
+    def _run(self):
+        while True:
+            source_url = self._queue.get()
+            try:
+                self.process(source_url)
+            except Exception as e:
+                logger.error(f"Image derivatives failed for {source_url}: {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard(source_url)
+                self._queue.task_done()
+
+    # ==================== GENERATION ====================
+
+    def _read_source(self, source_url: str) -> bytes:
+        if source_url.startswith(('http://', 'https://')):
+            get = self.http.get if self.http is not None else requests.get
+            response = get(source_url, headers={'User-Agent': self.user_agent}, timeout=15, stream=True)
+            try:
+                response.raise_for_status()
+                data = response.raw.read(self.MAX_SOURCE_BYTES + 1, decode_content=True)
+            finally:
+                # Hand the connection back to the pool
+                response.close()
+        else:
+            # Local uploads are stored as /static/<path>
+            rel_path = source_url.split('?', 1)[0].lstrip('/')
+            if rel_path.startswith('static/'):
+                rel_path = rel_path[len('static/'):]
+            full_path = os.path.abspath(os.path.join(self.static_dir, rel_path))
+            if not full_path.startswith(os.path.abspath(self.static_dir) + os.sep):
+                raise ValueError('Image path outside static directory')
+            with open(full_path, 'rb') as f:
+                data = f.read(self.MAX_SOURCE_BYTES + 1)
+        if len(data) > self.MAX_SOURCE_BYTES:
+            raise ValueError('Image too large')
+        return data
+
+    def _target_widths(self, original_width: int) -> List[int]:
+        widths = [w for w in self.WIDTHS if w < original_width]
+        # Never upscale; the largest derivative is the original width itself
+        if original_width <= self.WIDTHS[-1]:
+            widths.append(original_width)
+        return widths
+
+    def _mark_source(self, conn, source_url: str, status: str, width=None, height=None, error=None):
+        conn.execute('''
+            INSERT INTO image_sources (source_url, status, width, height, error, updated_at)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(source_url) DO UPDATE SET
+                status = excluded.status, width = excluded.width, height = excluded.height,
+                error = excluded.error, updated_at = CURRENT_TIMESTAMP
+        ''', (source_url, status, width, height, error))
+
+    def process(self, source_url: str) -> List[Dict]:
+        """Generate and record all derivatives of one original. Returns the variant rows."""
+        conn = self._connect()
+        try:
+            try:
+                image = Image.open(io.BytesIO(self._read_source(source_url)))
+                if getattr(image, 'is_animated', False):
+                    self._mark_source(conn, source_url, 'skipped', error='animated image')
+                    conn.commit()
+                    return []
+                # Apply EXIF orientation before the metadata is dropped
+                image = ImageOps.exif_transpose(image)
+                image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+            except Exception as e:
+                self._mark_source(conn, source_url, 'failed', error=str(e)[:500])
+                conn.commit()
+                raise
+
+            digest = hashlib.sha1(source_url.encode('utf-8')).hexdigest()
+            out_dir = os.path.join(self.output_dir, digest[:2], digest)
+            os.makedirs(out_dir, exist_ok=True)
+
+            variants = []
+            for width in self._target_widths(image.width):
+                height = max(1, round(image.height * width / image.width))
+                resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+                for fmt in self.formats:
+                    filename = f'w{width}.{fmt}'
+                    buffer = io.BytesIO()
+                    # A fresh encode with no exif/icc arguments writes no metadata
+                    resized.save(buffer, format=fmt.upper(), quality=self.QUALITY[fmt])
+                    with open(os.path.join(out_dir, filename + '.tmp'), 'wb') as f:
+                        f.write(buffer.getvalue())
+                    os.replace(os.path.join(out_dir, filename + '.tmp'), os.path.join(out_dir, filename))
+                    variants.append({
+                        'source_url': source_url,
+                        'width': width,
+                        'format': fmt,
+                        'url': f'/static/images/derived/{digest[:2]}/{digest}/{filename}',
+                        'bytes': buffer.tell()
+                    })
+
+            conn.executemany('''
+                INSERT OR REPLACE INTO image_variants (source_url, width, format, url, bytes)
+                VALUES (:source_url, :width, :format, :url, :bytes)
+            ''', variants)
+            self._mark_source(conn, source_url, 'done', image.width, image.height)
+            conn.commit()
+            logger.info(f"Generated {len(variants)} derivatives for {source_url}")
+            return variants
+        finally:
+            conn.close()
+
+    # ==================== LISTINGS ====================
+
+    def variants_for(self, conn, source_urls: Iterable[str]) -> Dict[str, List[Dict]]:
+        """Load recorded variants for many originals with one query per 500 URLs"""
+        urls = list({url for url in source_urls if url})
+        found = {}
+        for i in range(0, len(urls), 500):
+            chunk = urls[i:i + 500]
+            placeholders = ','.join(['?'] * len(chunk))
+            rows = conn.execute(f'''
+                SELECT source_url, width, format, url FROM image_variants
+                WHERE source_url IN ({placeholders})
+                ORDER BY width
+            ''', chunk).fetchall()
+            for row in rows:
+                found.setdefault(row['source_url'], []).append(dict(row))
+        return found
+
+    def _known_sources(self, conn, source_urls: List[str]) -> set:
+        known = set()
+        for i in range(0, len(source_urls), 500):
+            chunk = source_urls[i:i + 500]
+            placeholders = ','.join(['?'] * len(chunk))
+            rows = conn.execute(
+                f'SELECT source_url FROM image_sources WHERE source_url IN ({placeholders})', chunk
+            ).fetchall()
+            known.update(row[0] for row in rows)
+        return known
+
+    @staticmethod
+    def srcset(variants: List[Dict], fmt: str) -> Optional[str]:
+        entries = [f"{v['url']} {v['width']}w" for v in variants if v['format'] == fmt]
+        return ', '.join(entries) if entries else None
+
+    def attach_srcsets(self, conn, items: List[Dict], url_key: str = 'image_url', enqueue_missing: bool = True):
+        """
+        Add image_srcset / image_srcset_avif to each item in place. Originals
+        without derivatives keep their plain image_url and are queued, a bounded
+        number per call, so the next listing request gets responsive images.
+        """
+        try:
+            variants = self.variants_for(conn, (item.get(url_key) for item in items))
+            missing = [url for url in {item.get(url_key) for item in items} if url and url not in variants]
+            if enqueue_missing and missing and self.available:
+                known = self._known_sources(conn, missing)
+                for url in [u for u in missing if u not in known][:self.MAX_ENQUEUE_PER_REQUEST]:
+                    self.enqueue(url)
+        except sqlite3.OperationalError as e:
+            # Tables are created by migration 0003; listings must work without them
+            logger.warning(f"Image variants unavailable: {e}")
+            return items
+
+        for item in items:
+            item_variants = variants.get(item.get(url_key), [])
+            item['image_srcset'] = self.srcset(item_variants, 'webp')
+            item['image_srcset_avif'] = self.srcset(item_variants, 'avif')
+        return items
+
+    def backfill(self, source_urls: Iterable[str]) -> int:
+        """Queue every original that has not been processed yet. Returns the number queued."""
+        urls = list({url for url in source_urls if url})
+        conn = self._connect()
+        try:
+            known = self._known_sources(conn, urls)
+        finally:
+            conn.close()
+        return sum(1 for url in urls if url not in known and self.enqueue(url))
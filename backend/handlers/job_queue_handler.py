@@ -0,0 +1,452 @@
+"""Durable SQLite job queue and the worker threads that drain it"""
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional
+
+from flask import g, jsonify, request, session
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ('succeeded', 'failed', 'cancelled')
+JOB_STATUSES = ('queued', 'running') + TERMINAL_STATUSES
+
+# Session keys a replayed view needs (see JobQueueHandler.offloadable)
+SESSION_KEYS = ('user_id', 'username', 'role', 'logged_in')
+
+
+class JobError(Exception):
+    """Job failure; retry=False fails the job without using up its remaining attempts"""
+
+    def __init__(self, message: str, status_code: int = 400, retry: bool = True):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry = retry
+
+    def to_dict(self) -> Dict:
+        return {'status': 'error', 'error': str(self)}
+
+
+class JobContext:
+    """Handed to job functions: the payload plus progress and cancellation hooks"""
+
+    def __init__(self, queue: 'JobQueueHandler', job: Dict):
+        self.queue = queue
+        self.id = job['id']
+        self.type = job['type']
+        self.payload = job['payload']
+        self.attempt = job['attempts']
+
+    def progress(self, fraction: Optional[float] = None, message: Optional[str] = None):
+        self.queue.report_progress(self.id, fraction, message)
+
+    @property
+    def cancelled(self) -> bool:
+        """True once someone asked to cancel; long jobs should check it between steps"""
+        job = self.queue.get(self.id)
+        return bool(job and job['cancel_requested'])
+
+
+def current_job() -> Optional[JobContext]:
+    """The job a replayed view is running under, or None for a normal request"""
+    return g.get('job') if g else None
+
+
+def report_progress(fraction: Optional[float] = None, message: Optional[str] = None):
+    """Progress from inside a view; a no-op unless the view is running as a job"""
+    job = current_job()
+    if job is not None:
+        job.progress(fraction, message)
+
+
+def wants_async(req) -> bool:
+    """?async=true or Prefer: respond-async asks for a job id instead of the result"""
+    if (req.args.get('async') or '').lower() in ('1', 'true', 'yes'):
+        return True
+    return 'respond-async' in (req.headers.get('Prefer') or '').lower()
+
+
+class JobQueueHandler:
+    """
+    Jobs live in the jobs table (migration 0007), so they survive restarts
+    and any API process can run any job. Each process runs a few worker
+    threads (start()); a claim is a single UPDATE ... RETURNING, so two
+    workers never get the same job. Failed jobs are retried with
+    exponential backoff up to max_attempts, and jobs whose worker stopped
+    heartbeating (process killed mid-job) are put back on the queue.
+
+    Job functions take a JobContext and return something JSON-serializable.
+    """
+
+    POLL_INTERVAL = 1.0      # idle workers look for new jobs this often
+    HEARTBEAT_INTERVAL = 15  # running jobs are touched this often
+    STALE_AFTER = 120        # a running job without a heartbeat for this long is recovered
+    RETRY_BASE = 30          # seconds before the first retry, doubling each attempt
+    RETRY_MAX = 3600
+
+    def __init__(self, db_path: str, app=None):
+        self.db_path = db_path
+        self.app = app
+        self._registry: Dict[str, Dict] = {}
+        self._retired: Dict[str, str] = {}  # job type -> why it no longer runs
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._running: Dict[int, str] = {}  # job id -> worker name
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def _row_to_job(row) -> Optional[Dict]:
+        if row is None:
+            return None
+        job = dict(row)
+        job['payload'] = json.loads(job['payload']) if job['payload'] else {}
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        job['cancel_requested'] = bool(job['cancel_requested'])
+        return job
+
+    # ==================== REGISTRATION ====================
+
+    def register(self, job_type: str, fn: Callable = None, max_attempts: int = 1, priority: int = 0,
+                 public: bool = True):
+        """
+        Register a job function; usable as register('type', fn) or as a
+        decorator. public=False types can only be enqueued from code, not
+        through POST /api/jobs.
+        """
+        def decorator(func):
+            self._registry[job_type] = {'fn': func, 'max_attempts': max_attempts, 'priority': priority,
+                                        'public': public}
+            return func
+        return decorator(fn) if fn is not None else decorator
+
+    def retire(self, job_type: str, reason: str):
+        """
+        Declare a job type that no longer exists. Jobs of the type still in
+        the table (queued by an older release) are claimed like any other and
+        failed with reason, instead of sitting queued forever because no
+        process registers them.
+        """
+        self._retired[job_type] = reason
+
+    def job_types(self) -> List[str]:
+        return sorted(self._registry)
+
+    def public_types(self) -> List[str]:
+        return sorted(t for t, spec in self._registry.items() if spec['public'])
+
+    def offloadable(self, job_type: str, max_attempts: int = 1, priority: int = 0):
+        """
+        Let an existing view run as a job. With ?async=true or
+        Prefer: respond-async the request is recorded (args, JSON body, view
+        args and the caller's session) and answered with 202 and a job id;
+        a worker later replays it in a request context and stores the view's
+        JSON response as the job result. Without either, the view runs as
+        before. Place it below the auth decorators so they run first.
+        """
+        def decorator(view):
+            def run(job: JobContext):
+                return self._replay(view, job)
+            # Replay payloads carry a session, so they must never come from a client
+            self.register(job_type, run, max_attempts=max_attempts, priority=priority, public=False)
+
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if not wants_async(request):
+                    return view(*args, **kwargs)
+                args_dict = request.args.to_dict(flat=False)
+                args_dict.pop('async', None)
+                job = self.enqueue(job_type, {
+                    'method': request.method,
+                    'path': request.path,
+                    'args': args_dict,
+                    'json': request.get_json(silent=True),
+                    'view_args': kwargs,
+                    'session': {key: session.get(key) for key in SESSION_KEYS if key in session}
+                }, created_by=session.get('user_id'))
+                response = jsonify({'status': 'success', 'job_id': job['id'], 'job': self.public(job)})
+                response.status_code = 202
+                response.headers['Location'] = f"/api/jobs/{job['id']}"
+                return response
+            return wrapper
+        return decorator
+
+    def _replay(self, view: Callable, job: JobContext):
+        if self.app is None:
+            raise JobError('Job queue has no app to replay requests in', retry=False)
+        data = job.payload
+        with self.app.test_request_context(data['path'], method=data['method'],
+                                           query_string=data.get('args') or {}, json=data.get('json')):
+            session.update(data.get('session') or {})
+            g.job = job
+            response = self.app.make_response(view(**(data.get('view_args') or {})))
+            body = response.get_json(silent=True)
+            if body is None:
+                body = {'body': response.get_data(as_text=True)}
+        if response.status_code >= 500:
+            raise JobError(body.get('error') or f'HTTP {response.status_code}', response.status_code)
+        if response.status_code >= 400:
+            raise JobError(body.get('error') or f'HTTP {response.status_code}', response.status_code, retry=False)
+        return body
+
+    # ==================== QUEUE OPERATIONS ====================
+
+    def enqueue(self, job_type: str, payload: Dict = None, priority: Optional[int] = None,
+                max_attempts: Optional[int] = None, created_by: Optional[int] = None, delay: float = 0) -> Dict:
+        if job_type not in self._registry:
+            raise JobError(f'Unknown job type: {job_type}')
+        spec = self._registry[job_type]
+        conn = self._connect()
+        try:
+            row = conn.execute('''
+                INSERT INTO jobs (type, payload, priority, max_attempts, run_after, created_by)
+                VALUES (?, ?, ?, ?, ?, ?)
+                RETURNING *
+            ''', (
+                job_type, json.dumps(payload or {}),
+                spec['priority'] if priority is None else int(priority),
+                spec['max_attempts'] if max_attempts is None else max(1, int(max_attempts)),
+                time.time() + delay, created_by
+            )).fetchone()
+        finally:
+            conn.close()
+        self._wake.set()
+        return self._row_to_job(row)
+
+    def get(self, job_id: int) -> Optional[Dict]:
+        conn = self._connect()
+        try:
+            return self._row_to_job(conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone())
+        finally:
+            conn.close()
+
+    def list(self, status: Optional[str] = None, job_type: Optional[str] = None, limit: int = 50) -> List[Dict]:
+        query = 'SELECT * FROM jobs WHERE 1=1'
+        params = []
+        if status:
+            query += ' AND status = ?'
+            params.append(status)
+        if job_type:
+            query += ' AND type = ?'
+            params.append(job_type)
+        query += ' ORDER BY id DESC LIMIT ?'
+        params.append(max(1, min(int(limit), 500)))
+        conn = self._connect()
+        try:
+            return [self._row_to_job(row) for row in conn.execute(query, params).fetchall()]
+        finally:
+            conn.close()
+
+    @staticmethod
+    def public(job: Dict) -> Dict:
+        """Job as returned by the API; the replay payload carries session data and stays private"""
+        return {key: value for key, value in job.items() if key not in ('payload', 'locked_by')}
+
+    def cancel(self, job_id: int) -> Dict:
+        """Queued jobs are cancelled outright; running jobs are asked to stop (see JobContext.cancelled)"""
+        conn = self._connect()
+        try:
+            row = conn.execute('''
+                UPDATE jobs SET
+                    status = CASE WHEN status = 'queued' THEN 'cancelled' ELSE status END,
+                    finished_at = CASE WHEN status = 'queued' THEN CURRENT_TIMESTAMP ELSE finished_at END,
+                    cancel_requested = 1, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status IN ('queued', 'running')
+                RETURNING *
+            ''', (job_id,)).fetchone()
+            if row is None:
+                job = self.get(job_id)
+                if job is None:
+                    raise JobError(f'Job {job_id} not found', 404)
+                raise JobError(f"Job {job_id} is already {job['status']}", 409)
+            return self._row_to_job(row)
+        finally:
+            conn.close()
+
+    def report_progress(self, job_id: int, fraction: Optional[float] = None, message: Optional[str] = None):
+        conn = self._connect()
+        try:
+            conn.execute('''
+                UPDATE jobs SET progress = COALESCE(?, progress), progress_message = COALESCE(?, progress_message),
+                    heartbeat_at = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'running'
+            ''', (None if fraction is None else max(0.0, min(1.0, float(fraction))), message, time.time(), job_id))
+        finally:
+            conn.close()
+
+    def claim(self, worker: str) -> Optional[Dict]:
+        """Atomically take the next runnable job of a type this process knows"""
+        types = self.job_types() + sorted(self._retired)
+        if not types:
+            return None
+        now = time.time()
+        conn = self._connect()
+        try:
+            rows = conn.execute(f'''
+                UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_by = ?,
+                    heartbeat_at = ?, started_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP,
+                    error = NULL
+                WHERE id = (
+                    SELECT id FROM jobs
+                    WHERE status = 'queued' AND run_after <= ? AND type IN ({','.join('?' * len(types))})
+                    ORDER BY priority DESC, id
+                    LIMIT 1
+                )
+                RETURNING *
+            ''', (worker, now, now, *types)).fetchall()
+        finally:
+            conn.close()
+        return self._row_to_job(rows[0]) if rows else None
+
+    def _finish(self, job_id: int, result: Any):
+        conn = self._connect()
+        try:
+            conn.execute('''
+                UPDATE jobs SET status = 'succeeded', result = ?, progress = 1.0, locked_by = NULL,
+                    finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'running'
+            ''', (json.dumps(result, default=str), job_id))
+        finally:
+            conn.close()
+
+    def _fail(self, job: Dict, error: str, retry: bool = True):
+        """Requeue with backoff while attempts remain, otherwise mark failed (or cancelled, if asked)"""
+        conn = self._connect()
+        try:
+            if retry and job['attempts'] < job['max_attempts']:
+                delay = min(self.RETRY_BASE * 2 ** (job['attempts'] - 1), self.RETRY_MAX)
+                requeued = conn.execute('''
+                    UPDATE jobs SET status = 'queued', error = ?, run_after = ?, locked_by = NULL,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ? AND status = 'running' AND cancel_requested = 0
+                ''', (error, time.time() + delay, job['id'])).rowcount
+                if requeued:
+                    logger.warning(f"Job {job['id']} ({job['type']}) attempt {job['attempts']} failed, "
+                                   f"retrying in {delay}s: {error}")
+                    return
+            row = conn.execute('''
+                UPDATE jobs SET status = CASE WHEN cancel_requested THEN 'cancelled' ELSE 'failed' END,
+                    error = ?, locked_by = NULL, finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'running'
+                RETURNING status
+            ''', (error, job['id'])).fetchone()
+            if row:
+                logger.error(f"Job {job['id']} ({job['type']}) {row['status']}: {error}")
+        finally:
+            conn.close()
+
+    def recover_stale(self) -> int:
+        """Requeue (or fail) running jobs whose worker has stopped heartbeating"""
+        conn = self._connect()
+        try:
+            stale = conn.execute('''
+                SELECT * FROM jobs WHERE status = 'running' AND heartbeat_at < ?
+            ''', (time.time() - self.STALE_AFTER,)).fetchall()
+        finally:
+            conn.close()
+        for row in stale:
+            job = self._row_to_job(row)
+            self._fail(job, f"Worker {job['locked_by']} stopped responding")
+        return len(stale)
+
+    def run_job(self, job: Dict, worker: str = 'inline'):
+        spec = self._registry.get(job['type'])
+        if spec is None:
+            self._fail(job, self._retired.get(job['type'], f"Unknown job type: {job['type']}"), retry=False)
+            return
+        with self._lock:
+            self._running[job['id']] = worker
+        started = time.time()
+        try:
+            result = spec['fn'](JobContext(self, job))
+            self._finish(job['id'], result)
+            logger.info(f"Job {job['id']} ({job['type']}) succeeded in {time.time() - started:.1f}s")
+        except JobError as e:
+            self._fail(job, str(e), retry=e.retry)
+        except Exception as e:
+            logger.error(traceback.format_exc())
+            self._fail(job, str(e))
+        finally:
+            with self._lock:
+                self._running.pop(job['id'], None)
+
+    def run_next(self, worker: str = 'inline') -> bool:
+        """Claim and run one job in the calling thread; False if nothing was runnable"""
+        job = self.claim(worker)
+        if job is None:
+            return False
+        self.run_job(job, worker)
+        return True
+
+    # ==================== WORKER POOL ====================
+
+    def start(self, workers: Optional[int] = None):
+        """
+        Start this process's worker threads (once per process: under gunicorn
+        call it after the fork, from post_fork, not in the preloading master).
+        """
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._stop.clear()
+        self._threads = []
+        count = workers if workers is not None else int(os.environ.get('PIGSTYLE_JOB_WORKERS', 2))
+        prefix = f'{socket.gethostname()}:{self._pid}'
+        for i in range(max(0, count)):
+            thread = threading.Thread(target=self._work, args=(f'{prefix}:{i}',), name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if count > 0:
+            supervisor = threading.Thread(target=self._supervise, name='job-supervisor', daemon=True)
+            supervisor.start()
+            self._threads.append(supervisor)
+            logger.info(f'Job queue: {count} worker thread(s) started in process {self._pid}')
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        self._pid = None
+
+    def _work(self, worker: str):
+        while not self._stop.is_set():
+            try:
+                if self.run_next(worker):
+                    continue
+            except Exception as e:
+                logger.error(f'Job worker {worker} error: {e}')
+            self._wake.wait(self.POLL_INTERVAL)
+            self._wake.clear()
+
+    def _supervise(self):
+        """Heartbeat this process's running jobs and recover ones abandoned by dead processes"""
+        while not self._stop.wait(self.HEARTBEAT_INTERVAL):
+            try:
+                with self._lock:
+                    running = list(self._running)
+                if running:
+                    conn = self._connect()
+                    try:
+                        conn.execute(f'''
+                            UPDATE jobs SET heartbeat_at = ?
+                            WHERE status = 'running' AND id IN ({','.join('?' * len(running))})
+                        ''', (time.time(), *running))
+                    finally:
+                        conn.close()
+                self.recover_stale()
+            except Exception as e:
+                logger.error(f'Job supervisor error: {e}')
@@ -0,0 +1,185 @@
+"""Compact gzip snapshot of the in-store catalog for the kiosk, kept current from the records change log"""
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from handlers.serialization_handler import dumps
+
+logger = logging.getLogger(__name__)
+
+
+class KioskCatalogHandler:
+    """
+    The kiosk downloads every active record once and searches locally, so
+    the catalog is one gzip'd columnar JSON document:
+
+        {"version": 1234, "generated_at": ..., "count": n,
+         "columns": ["id", "artist", ...], "rows": [[...], ...]}
+
+    Rows carry only what the kiosk displays (FIELDS). The snapshot is kept in
+    memory per worker and on disk at `path`, so a new worker starts from the
+    file instead of re-reading records.
+
+    version is the records_changes version the snapshot reflects. When the
+    log has moved on, only the changed records are re-read: a change that
+    leaves a record active replaces its row, anything else (sold, deleted)
+    drops it. The lookup tables behind the display names (formats,
+    locations, d_condition) have no change log, so a bump in their
+    table_versions counters, or a compacted log (reset), rebuilds from
+    records instead.
+
+    The ETag is version plus those counters, known after one indexed query,
+    so an unchanged kiosk revalidates with a 304.
+    """
+
+    FIELDS = ('id', 'artist', 'title', 'catalog_number', 'barcode', 'store_price', 'image_url',
+              'format_name', 'location_name', 'genre_id', 'sleeve_abbr', 'disc_abbr')
+    ACTIVE_STATUS_IDS = (2,)
+    DIMENSION_TABLES = ('formats', 'locations', 'd_condition')
+    COMPRESS_LEVEL = 6
+
+    def __init__(self, db_path: str, path: str, record_changes, record_fields, table_versions):
+        self.db_path = db_path
+        self.path = path
+        self.record_changes = record_changes
+        self.record_fields = record_fields
+        self.table_versions = table_versions
+        self._lock = threading.Lock()
+        self._rows = None       # record id -> row values in FIELDS order
+        self._version = None
+        self._dims = None
+        self._body = None       # gzip'd document
+        self._file_mtime = None
+        self.stats = {'full': 0, 'delta': 0, 'loaded': 0, 'last_ms': None}
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def etag(version: int, dims) -> str:
+        return f"kiosk-{version}-{'.'.join(str(v) for v in dims or ())}"
+
+    def snapshot(self) -> Tuple[str, bytes]:
+        """(etag, gzip'd body), brought up to date with the change log first"""
+        with self._lock:
+            dims = self.table_versions.get(self.DIMENSION_TABLES)
+            conn = self._connect()
+            try:
+                # One read transaction so the version and the rows read for it agree
+                conn.execute('BEGIN')
+                latest = conn.execute('SELECT COALESCE(MAX(version), 0) FROM records_changes').fetchone()[0]
+                if self._version != latest or self._dims != dims:
+                    self._load_file()
+                if self._version != latest or self._dims != dims:
+                    self._refresh(conn, latest, dims)
+                conn.execute('COMMIT')
+            finally:
+                conn.close()
+            return self.etag(self._version, self._dims), self._body
+
+    # --------------------------------------------------------------- building
+
+    def _refresh(self, conn, latest: int, dims):
+        started = time.monotonic()
+        projection = self.record_fields.parse(','.join(self.FIELDS), ())
+        # status_id decides membership; it is read alongside but never shipped
+        select_sql = f'{projection.select_sql}, r.status_id AS kiosk_status_id'
+
+        full = (self._rows is None or self._dims != dims or self._version > latest
+                or self.record_changes.needs_reset(self._version))
+        if full:
+            placeholders = ','.join('?' * len(self.ACTIVE_STATUS_IDS))
+            cursor = conn.execute(f'SELECT {select_sql} FROM records r WHERE r.status_id IN ({placeholders})',
+                                  self.ACTIVE_STATUS_IDS)
+            rows = {}
+            self._put(conn, rows, [dict(row) for row in cursor], projection)
+            self.stats['full'] += 1
+        else:
+            rows = self._rows
+            since = self._version
+            while since < latest:
+                limit = self.record_changes.MAX_LIMIT
+                deletes, version, _, has_more = self.record_changes.page(conn, since, limit)
+                for record_id in deletes:
+                    rows.pop(record_id, None)
+                changed = [dict(row) for row in
+                           conn.execute(self.record_changes.upsert_sql(select_sql), (since, limit))]
+                for record in changed:
+                    rows.pop(record['id'], None)
+                self._put(conn, rows, changed, projection)
+                if not has_more or version == since:
+                    break
+                since = version
+            self.stats['delta'] += 1
+
+        self._rows = rows
+        self._version = latest
+        self._dims = dims
+        self._body = self._encode()
+        self._save()
+        self.stats['last_ms'] = round((time.monotonic() - started) * 1000, 1)
+        logger.info(f"Kiosk catalog {'rebuilt' if full else 'updated'} to version {latest}: "
+                    f"{len(rows)} records, {len(self._body)} bytes in {self.stats['last_ms']}ms")
+
+    def _put(self, conn, rows: Dict[int, List], records: List[Dict], projection):
+        active = [r for r in records if r.pop('kiosk_status_id') in self.ACTIVE_STATUS_IDS]
+        for record in self.record_fields.apply(conn, active, projection):
+            rows[record['id']] = [record.get(field) for field in self.FIELDS]
+
+    def _encode(self) -> bytes:
+        document = {
+            'version': self._version,
+            'dims': list(self._dims or ()),
+            'generated_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'count': len(self._rows),
+            'columns': list(self.FIELDS),
+            'rows': [self._rows[record_id] for record_id in sorted(self._rows)]
+        }
+        # mtime=0 keeps the bytes identical for identical content across workers
+        return gzip.compress(dumps(document, default=str), compresslevel=self.COMPRESS_LEVEL, mtime=0)
+
+    # ------------------------------------------------------------------- file
+
+    def _save(self):
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp, 'wb') as f:
+                f.write(self._body)
+            os.replace(tmp, self.path)
+            self._file_mtime = os.stat(self.path).st_mtime_ns
+        except OSError as e:
+            logger.warning(f"Could not write kiosk catalog {self.path}: {e}")
+
+    def _load_file(self):
+        """Adopt the file when another worker (or a previous run) wrote a newer one"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._file_mtime:
+            return
+        self._file_mtime = mtime
+        try:
+            with open(self.path, 'rb') as f:
+                body = f.read()
+            document = json.loads(gzip.decompress(body))
+            if document.get('columns') != list(self.FIELDS):
+                return
+            if self._version is not None and document['version'] <= self._version:
+                return
+        except (OSError, ValueError, KeyError, EOFError) as e:
+            logger.warning(f"Ignoring unreadable kiosk catalog {self.path}: {e}")
+            return
+        self._rows = {row[0]: row for row in document['rows']}
+        self._version = document['version']
+        self._dims = tuple(document.get('dims') or ()) or None
+        self._body = body
+        self.stats['loaded'] += 1
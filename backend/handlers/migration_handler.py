@@ -0,0 +1,192 @@
+"""Versioned schema migrations for PigStyle Records"""
+import glob
+import importlib.util
+import logging
+import os
+import sqlite3
+import time
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+
+
+# ==================== HELPERS FOR MIGRATION FILES ====================
+
+def column_exists(conn, table: str, column: str) -> bool:
+    """Check if a column exists in a given table."""
+    return any(row[1] == column for row in conn.execute(f'PRAGMA table_info("{table}")'))
+
+
+def table_exists(conn, table: str) -> bool:
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()
+    return row is not None
+
+
+def add_column(conn, table: str, column: str, col_type: str, default=None):
+    """Add a column if it does not exist (safe for databases migrated before versioning)."""
+    if column_exists(conn, table, column):
+        return
+    sql = f'ALTER TABLE "{table}" ADD COLUMN {column} {col_type}'
+    if default is not None:
+        sql += f' DEFAULT {default}'
+    conn.execute(sql)
+
+
+def create_index(conn, name: str, table: str, columns: str, unique: bool = False, where: str = None):
+    """
+    Create an index in its own short transaction.
+
+    SQLite cannot build one index incrementally, so the best we can do for the
+    live API is keep every index build in a separate transaction instead of
+    holding the write lock across a whole migration. Only use this from
+    migrations with BATCHED = True.
+    """
+    sql = f'CREATE {"UNIQUE " if unique else ""}INDEX IF NOT EXISTS {name} ON {table}({columns})'
+    if where:
+        sql += f' WHERE {where}'
+    start = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute(sql)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    logger.info(f"Index {name} built in {time.time() - start:.2f}s")
+
+
+# ==================== RUNNER ====================
+
+class MigrationHandler:
+    """Applies ordered migration files from backend/migrations and tracks them in schema_version"""
+
+    def __init__(self, db_path: str, migrations_dir: str = None, log: Callable[[str], None] = None):
+        self.db_path = db_path
+        self.migrations_dir = migrations_dir or MIGRATIONS_DIR
+        self.log = log or logger.info
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def discover(self) -> List[Dict]:
+        """Return migration files ordered by version."""
+        migrations = []
+        for path in glob.glob(os.path.join(self.migrations_dir, '[0-9][0-9][0-9][0-9]_*.py')):
+            filename = os.path.basename(path)
+            migrations.append({
+                'version': int(filename[:4]),
+                'name': filename[:-3],
+                'path': path
+            })
+        return sorted(migrations, key=lambda m: m['version'])
+
+    def latest_version(self) -> int:
+        migrations = self.discover()
+        return migrations[-1]['version'] if migrations else 0
+
+    def current_version(self, conn=None) -> int:
+        """Return the applied schema version with a single query (0 if never migrated)."""
+        own_conn = conn is None
+        conn = conn or self._connect()
+        try:
+            return conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0] or 0
+        except sqlite3.OperationalError:
+            return 0
+        finally:
+            if own_conn:
+                conn.close()
+
+    def pending(self) -> List[Dict]:
+        current = self.current_version()
+        return [m for m in self.discover() if m['version'] > current]
+
+    def _load(self, migration: Dict):
+        spec = importlib.util.spec_from_file_location(f"migration_{migration['name']}", migration['path'])
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+    def _record(self, conn, migration: Dict, duration_ms: int):
+        conn.execute('''
+            INSERT INTO schema_version (version, name, duration_ms)
+            VALUES (?, ?, ?)
+        ''', (migration['version'], migration['name'], duration_ms))
+
+    def apply(self, migration: Dict, conn) -> Optional[float]:
+        """
+        Apply one migration. Returns its duration in seconds, or None if another
+        process applied it first.
+        """
+        module = self._load(migration)
+        start = time.time()
+
+        if getattr(module, 'BATCHED', False):
+            # Batched migrations manage their own short transactions and must be resumable
+            if self.current_version(conn) >= migration['version']:
+                return None
+            module.upgrade(conn)
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if self.current_version(conn) >= migration['version']:
+                    conn.execute('ROLLBACK')
+                    return None
+                self._record(conn, migration, int((time.time() - start) * 1000))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            return time.time() - start
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Re-check inside the write lock so concurrent workers never double-apply
+            if self.current_version(conn) >= migration['version']:
+                conn.execute('ROLLBACK')
+                return None
+            module.upgrade(conn)
+            self._record(conn, migration, int((time.time() - start) * 1000))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return time.time() - start
+
+    def migrate(self) -> int:
+        """Apply all pending migrations in order. Returns the resulting schema version."""
+        conn = self._connect()
+        try:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    applied_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                    duration_ms INTEGER
+                )
+            ''')
+            current = self.current_version(conn)
+            for migration in self.discover():
+                if migration['version'] <= current:
+                    continue
+                self.log(f"Applying migration {migration['name']}...")
+                duration = self.apply(migration, conn)
+                if duration is None:
+                    self.log(f"Migration {migration['name']} already applied by another process")
+                else:
+                    self.log(f"Applied migration {migration['name']} in {duration:.2f}s")
+                current = migration['version']
+            return self.current_version(conn)
+        finally:
+            conn.close()
+
+    def ensure_current(self) -> int:
+        """Startup check: one query when up to date, migrate only when behind."""
+        current = self.current_version()
+        latest = self.latest_version()
+        if current >= latest:
+            return current
+        self.log(f"Schema version {current} is behind {latest}, migrating")
+        return self.migrate()
@@ -0,0 +1,272 @@
+"""Discogs-backed price estimation for the counter and intake screens"""
+import csv
+import io
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, as_completed
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from handlers.discogs_mirror_handler import DiscogsLookupError
+from handlers.rounding_handler import RoundingHandler
+
+logger = logging.getLogger(__name__)
+
+# User-friendly condition names to Discogs price suggestion keys
+CONDITION_MAP = {
+    'mint': 'Mint (M)',
+    'near mint': 'Near Mint (NM or M-)',
+    'very good plus': 'Very Good Plus (VG+)',
+    'very good': 'Very Good (VG)',
+    'good plus': 'Good Plus (G+)',
+    'good': 'Good (G)',
+    'fair': 'Fair (F)',
+    'poor': 'Poor (P)'
+}
+
+# Grading shorthand used on lot sheets
+CONDITION_ABBREVIATIONS = {
+    'm': 'Mint (M)',
+    'nm': 'Near Mint (NM or M-)',
+    'm-': 'Near Mint (NM or M-)',
+    'vg+': 'Very Good Plus (VG+)',
+    'vg': 'Very Good (VG)',
+    'g+': 'Good Plus (G+)',
+    'g': 'Good (G)',
+    'f': 'Fair (F)',
+    'p': 'Poor (P)'
+}
+
+
+class PriceEstimateError(Exception):
+    """An estimate that cannot be produced; carries the HTTP status and extra response fields"""
+
+    def __init__(self, message: str, status_code: int = 400, **details):
+        super().__init__(message)
+        self.status_code = status_code
+        self.details = details
+
+    def to_dict(self) -> Dict:
+        return {'status': 'error', 'error': str(self), **self.details}
+
+
+class PriceEstimateHandler:
+    """
+    Estimates a store price from Discogs price suggestions.
+
+    Once the release is known, price suggestions and community stats are
+    fetched concurrently through the release mirror (each cached with its own
+    TTL there). Stats only feed the confidence score, so if they are slower
+    than STATS_WAIT_SECONDS the estimate is returned without them and the
+    fetch finishes in the background, landing in the mirror for next time.
+    """
+
+    STATS_WAIT_SECONDS = 1.5
+    MAX_WORKERS = 8
+
+    def __init__(self, mirror):
+        self.mirror = mirror
+        self._executor = ThreadPoolExecutor(max_workers=self.MAX_WORKERS, thread_name_prefix='price-estimate')
+
+    @staticmethod
+    def normalize_catalog(value: str) -> str:
+        return (value or '').lower().replace(' ', '').replace('-', '')
+
+    @staticmethod
+    def condition_key(media_condition: str) -> Optional[str]:
+        """Map input like 'Very Good Plus (VG+)', 'near mint' or 'VG+' to a Discogs condition name"""
+        media_clean = (media_condition or '').lower().strip()
+        if media_clean in CONDITION_ABBREVIATIONS:
+            return CONDITION_ABBREVIATIONS[media_clean]
+        media_clean = re.sub(r'\s*\([^)]*\)', '', media_clean).strip()
+        for key in CONDITION_MAP:
+            if key in media_clean:
+                return CONDITION_MAP[key]
+        return None
+
+    def find_release(self, catalog_number: str) -> Dict:
+        """Return the first search result whose catno contains the catalog number"""
+        try:
+            results = self.mirror.search_results(catalog_number, per_page=10)
+        except DiscogsLookupError as e:
+            raise PriceEstimateError(f'Discogs search failed: {e.status_code}', 500)
+
+        if not results:
+            raise PriceEstimateError(f'No release found for catalog: {catalog_number}', 404)
+
+        catalog_normalized = self.normalize_catalog(catalog_number)
+        for result in results:
+            if catalog_normalized in self.normalize_catalog(result.get('catno', '')):
+                return result
+
+        raise PriceEstimateError(f'No exact match for: {catalog_number}', 404,
+                                 suggestions=[r.get('catno', '') for r in results[:5]])
+
+    def fetch_release_data(self, release_id: int, stats_wait: float = None) -> Tuple[Optional[Dict], Dict, bool]:
+        """
+        Fetch price suggestions and community stats in parallel.
+
+        Returns (price_data, stats, stats_complete). Price data is always waited
+        for; stats are given up on after stats_wait seconds.
+        """
+        stats_wait = self.STATS_WAIT_SECONDS if stats_wait is None else stats_wait
+        deadline = time.monotonic() + stats_wait
+        stats_future = self._executor.submit(self.mirror.release_stats, release_id)
+        price_future = self._executor.submit(self.mirror.price_suggestions, release_id)
+
+        price_data = price_future.result()
+        try:
+            # Stats get whatever is left of their budget after prices arrive, never extra time
+            remaining = max(0.0, deadline - time.monotonic())
+            return price_data, stats_future.result(timeout=remaining), True
+        except FutureTimeout:
+            logger.warning(f"Stats for release {release_id} slower than {stats_wait}s - returning partial estimate")
+            return price_data, {}, False
+
+    @staticmethod
+    def confidence(wants: int, haves: int) -> int:
+        confidence = 50  # Base confidence
+        if wants > 0:
+            confidence += 10
+        if haves > 0:
+            confidence += 10
+        if wants > 100:
+            confidence += 10
+        if haves > 100:
+            confidence += 10
+        return min(confidence, 100)
+
+    def estimate(self, catalog_number: str, media_condition: str, release: Dict = None,
+                 stats_wait: float = None) -> Dict:
+        """
+        Price one record. Raises PriceEstimateError when there is no usable price.
+
+        Pass release to skip the search (batch callers resolve releases once).
+        """
+        start = time.time()
+        condition_key = self.condition_key(media_condition)
+        if not condition_key:
+            raise PriceEstimateError(f'Unknown condition: {media_condition}', 400,
+                                     valid_conditions=list(CONDITION_MAP.values()))
+
+        release = release or self.find_release(catalog_number)
+        release_data = self.fetch_release_data(release['id'], stats_wait)
+        result = self._price(catalog_number, condition_key, release['id'], *release_data)
+        result['estimate_time'] = round((time.time() - start) * 1000, 1)
+        return result
+
+    def _price(self, catalog_number: str, condition_key: str, release_id: int,
+               price_data: Optional[Dict], stats: Dict, stats_complete: bool) -> Dict:
+        if price_data is None:
+            raise PriceEstimateError(f'Failed to get price suggestions for release {release_id}', 500)
+        if not price_data:
+            raise PriceEstimateError(f'No price data available for release {release_id}', 404)
+        if condition_key not in price_data:
+            raise PriceEstimateError(f'No price data for condition: {condition_key}', 404,
+                                     available_conditions=list(price_data.keys()))
+
+        estimated_price = price_data[condition_key].get('value')
+        if estimated_price is None or estimated_price == 0:
+            raise PriceEstimateError(f'Price is $0 for condition: {condition_key}', 404)
+
+        wants = stats.get('community', {}).get('want', 0)
+        haves = stats.get('community', {}).get('have', 0)
+
+        # Min and max prices across all conditions
+        all_prices = [data.get('value', 0) for data in price_data.values() if data.get('value')]
+        min_price = min(all_prices) if all_prices else estimated_price
+        max_price = max(all_prices) if all_prices else estimated_price
+
+        return {
+            'status': 'success',
+            'catalog_number': catalog_number,
+            'release_id': release_id,
+            'condition': condition_key,
+            'estimated_price': round(estimated_price, 2),
+            'price_range_low': round(min_price, 2),
+            'price_range_high': round(max_price, 2),
+            'confidence_score': self.confidence(wants, haves),
+            'condition_multiplier': 1.0,  # Not needed since Discogs gives condition-specific prices
+            'demand_adjustment': 1.0,  # Not needed
+            'base_median_price': round(estimated_price, 2),
+            'want_have_ratio': round(wants / haves, 2) if haves > 0 else 0,
+            'num_sales': 0,  # Not available from price_suggestions
+            'stats_complete': stats_complete
+        }
+
+    # ==================== BATCH ====================
+
+    @staticmethod
+    def parse_batch_rows(payload) -> List[Dict]:
+        """
+        Normalize a JSON list of objects or CSV text into
+        [{'catalog_number', 'media_condition', 'sleeve_condition'}].
+        Accepts the short column names catno/catalog, media and sleeve.
+        """
+        if isinstance(payload, str):
+            payload = list(csv.DictReader(io.StringIO(payload.lstrip('\ufeff'))))
+        if not isinstance(payload, list):
+            raise PriceEstimateError('Expected a list of rows or CSV text', 400)
+
+        rows = []
+        for index, item in enumerate(payload):
+            if not isinstance(item, dict):
+                raise PriceEstimateError(f'Row {index} must be an object', 400)
+            item = {str(k).strip().lower(): v for k, v in item.items() if k is not None}
+            rows.append({
+                'catalog_number': str(item.get('catalog_number') or item.get('catno') or item.get('catalog') or '').strip(),
+                'media_condition': str(item.get('media_condition') or item.get('media') or '').strip(),
+                'sleeve_condition': str(item.get('sleeve_condition') or item.get('sleeve') or '').strip()
+            })
+        return rows
+
+    def _row_result(self, index: int, row: Dict, result: Dict) -> Dict:
+        result = {'index': index, **row, **result}
+        if result['status'] == 'success':
+            result['store_price'] = RoundingHandler.round_to_store_price(result['estimated_price'])
+        return result
+
+    def _estimate_group(self, catalog_number: str, indexed_rows: List[Tuple[int, Dict]],
+                        stats_wait: float) -> List[Dict]:
+        """Resolve one catalog number once and price every row that shares it"""
+        try:
+            release = self.find_release(catalog_number)
+            release_data = self.fetch_release_data(release['id'], stats_wait)
+        except PriceEstimateError as e:
+            return [self._row_result(index, row, e.to_dict()) for index, row in indexed_rows]
+
+        results = []
+        for index, row in indexed_rows:
+            try:
+                result = self._price(row['catalog_number'], self.condition_key(row['media_condition']),
+                                     release['id'], *release_data)
+            except PriceEstimateError as e:
+                result = e.to_dict()
+            results.append(self._row_result(index, row, result))
+        return results
+
+    def estimate_batch(self, rows: List[Dict], max_workers: int = 4, stats_wait: float = None) -> Iterator[Dict]:
+        """
+        Price a whole lot, yielding one result per row (with its input index) as
+        soon as it is ready. Rows sharing a catalog number are resolved once;
+        live Discogs calls go through the mirror's rate limiter, so max_workers
+        only bounds how many lookups wait on it at once.
+        """
+        groups = {}
+        for index, row in enumerate(rows):
+            if not row['catalog_number']:
+                yield self._row_result(index, row, {'status': 'error', 'error': 'catalog_number is required'})
+            elif not self.condition_key(row['media_condition']):
+                yield self._row_result(index, row, PriceEstimateError(
+                    f"Unknown condition: {row['media_condition']}", 400).to_dict())
+            else:
+                key = self.normalize_catalog(row['catalog_number'])
+                groups.setdefault(key, []).append((index, row))
+
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='price-batch') as pool:
+            futures = [
+                pool.submit(self._estimate_group, indexed_rows[0][1]['catalog_number'], indexed_rows, stats_wait)
+                for indexed_rows in groups.values()
+            ]
+            for future in as_completed(futures):
+                yield from future.result()
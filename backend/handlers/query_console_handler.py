@@ -0,0 +1,372 @@
+"""Bounded, cancellable SQL execution for the admin query console"""
+import json
+import math
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, Iterator, Optional
+
+READ_PREFIXES = ('SELECT', 'WITH', 'PRAGMA', 'EXPLAIN', 'VALUES')
+
+TABLE_REF_PATTERN = re.compile(
+    r'\b(?:FROM|JOIN)\s+"?([A-Za-z_][\w]*)"?(?:\s+(?:AS\s+)?(?!ON\b|WHERE\b|JOIN\b|LEFT\b|INNER\b|CROSS\b|'
+    r'GROUP\b|ORDER\b|LIMIT\b|USING\b|NATURAL\b|OUTER\b|UNION\b|HAVING\b)([A-Za-z_]\w*))?',
+    re.IGNORECASE
+)
+PLAN_NODE_PATTERN = re.compile(r'^(SCAN|SEARCH)\s+(\w+)(?:\s+USING\s+(.*))?$')
+PRAGMA_PATTERN = re.compile(r'^\s*PRAGMA\s+(?:\w+\s*\.\s*)?(\w+)\s*(=|\()?', re.IGNORECASE)
+
+# Introspection PRAGMAs that take an argument without changing anything
+PRAGMA_LOOKUPS = {'table_info', 'table_xinfo', 'table_list', 'index_list', 'index_info', 'index_xinfo',
+                  'foreign_key_list', 'foreign_key_check', 'integrity_check', 'quick_check'}
+# PRAGMAs the read-only console connection can answer; settings among them may be read, not set
+READ_PRAGMAS = PRAGMA_LOOKUPS | {
+    'application_id', 'auto_vacuum', 'automatic_index', 'busy_timeout', 'cache_size', 'collation_list',
+    'compile_options', 'data_version', 'database_list', 'encoding', 'foreign_keys', 'freelist_count',
+    'function_list', 'journal_mode', 'journal_size_limit', 'max_page_count', 'mmap_size', 'module_list',
+    'page_count', 'page_size', 'pragma_list', 'query_only', 'recursive_triggers', 'schema_version',
+    'secure_delete', 'synchronous', 'temp_store', 'user_version', 'wal_autocheckpoint'
+}
+
+
+class QueryCancelled(Exception):
+    """Raised when a query hits its deadline or is cancelled by the user"""
+
+
+class QueryNotAllowed(Exception):
+    """Raised for statements the console refuses to run, such as PRAGMAs that write"""
+
+
+class QueryConsoleHandler:
+    """
+    Runs admin console queries with a row cap, wall-clock timeout and cancellation.
+
+    With a store (SharedStateHandler) running queries are also registered in
+    shared_state, so a cancel that reaches a different gunicorn worker than
+    the one running the query still lands: it flags the shared entry, and the
+    running worker's guard polls that flag every CANCEL_POLL_S.
+    """
+
+    DEFAULT_MAX_ROWS = 5000
+    HARD_MAX_ROWS = 100000
+    DEFAULT_TIMEOUT_MS = 10000
+    HARD_TIMEOUT_MS = 60000
+    CHUNK_SIZE = 250
+    PROGRESS_OPCODES = 5000  # VM instructions between deadline checks
+    CANCEL_POLL_S = 0.25     # seconds between shared cancel-flag reads
+    NAMESPACE = 'query_console'
+
+    def __init__(self, db_path: str, store=None):
+        self.db_path = db_path
+        self.store = store
+        self._running = {}
+        self._lock = threading.Lock()
+
+    # ==================== LIMITS & CANCELLATION ====================
+
+    def clamp_limits(self, max_rows=None, timeout_ms=None):
+        max_rows = int(max_rows) if max_rows else self.DEFAULT_MAX_ROWS
+        timeout_ms = int(timeout_ms) if timeout_ms else self.DEFAULT_TIMEOUT_MS
+        return (max(1, min(max_rows, self.HARD_MAX_ROWS)),
+                max(100, min(timeout_ms, self.HARD_TIMEOUT_MS)))
+
+    def cancel(self, query_id: str) -> bool:
+        """Flag a running query for cancellation. Returns False if it is not running."""
+        with self._lock:
+            state = self._running.get(query_id)
+            if state:
+                state['cancelled'] = True
+                return True
+        if self.store is None:
+            return False
+        # Running on another worker: its guard picks the flag up from shared_state
+        return self.store.update(self.NAMESPACE, query_id, cancelled=True) is not None
+
+    def _register(self, query_id: Optional[str], timeout_ms: int) -> Dict:
+        state = {
+            'query_id': query_id or uuid.uuid4().hex,
+            'deadline': time.monotonic() + timeout_ms / 1000.0,
+            'cancelled': False,
+            'timeout_ms': timeout_ms,
+            'checked_at': time.monotonic()
+        }
+        with self._lock:
+            self._running[state['query_id']] = state
+        if self.store is not None:
+            # Outlives the deadline a little so a late cancel still finds it
+            self.store.set(self.NAMESPACE, state['query_id'], {'cancelled': False}, ttl=timeout_ms / 1000.0 + 60)
+        return state
+
+    def _unregister(self, state: Dict):
+        with self._lock:
+            self._running.pop(state['query_id'], None)
+        if self.store is not None:
+            self.store.delete(self.NAMESPACE, state['query_id'])
+
+    def _shared_cancelled(self, state: Dict) -> bool:
+        now = time.monotonic()
+        if self.store is None or now - state['checked_at'] < self.CANCEL_POLL_S:
+            return False
+        state['checked_at'] = now
+        if (self.store.get(self.NAMESPACE, state['query_id']) or {}).get('cancelled'):
+            state['cancelled'] = True
+        return state['cancelled']
+
+    def _install_guard(self, conn, state: Dict):
+        """Abort the running statement once the deadline passes or a cancel arrives"""
+        def guard():
+            if state['cancelled'] or time.monotonic() > state['deadline']:
+                return 1
+            return 1 if self._shared_cancelled(state) else 0
+        conn.set_progress_handler(guard, self.PROGRESS_OPCODES)
+
+    def _cancel_reason(self, state: Dict) -> str:
+        if state['cancelled']:
+            return 'Query cancelled'
+        return f"Query exceeded the {state['timeout_ms']} ms time limit"
+
+    # ==================== CONNECTIONS ====================
+
+    def _read_connection(self):
+        """Separate read-only connection so console reads never take the writer lock"""
+        conn = sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA query_only = 1')
+        return conn
+
+    def _write_connection(self):
+        conn = sqlite3.connect(self.db_path, timeout=5)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def is_read_query(query: str) -> bool:
+        return query.lstrip().upper().startswith(READ_PREFIXES)
+
+    @staticmethod
+    def check_pragma(query: str):
+        """
+        PRAGMAs run on the read-only connection, where setting one or running a
+        maintenance PRAGMA (optimize, wal_checkpoint...) fails inside SQLite.
+        Refuse those up front; only READ_PRAGMAS, read without a value, pass.
+        """
+        match = PRAGMA_PATTERN.match(query)
+        if not match:
+            return
+        name, operator = match.group(1).lower(), match.group(2)
+        if name not in READ_PRAGMAS:
+            raise QueryNotAllowed(f'PRAGMA {name} is not allowed: the console only runs read-only PRAGMAs')
+        if operator == '=' or (operator == '(' and name not in PRAGMA_LOOKUPS):
+            raise QueryNotAllowed(f'Setting PRAGMA {name} is not allowed: the console only reads PRAGMA values')
+
+    # ==================== EXECUTION ====================
+
+    def execute_read(self, query: str, max_rows: int, timeout_ms: int, query_id: str = None) -> Dict:
+        """Run a read query and return at most max_rows rows"""
+        state = self._register(query_id, timeout_ms)
+        conn = self._read_connection()
+        self._install_guard(conn, state)
+        start = time.time()
+        try:
+            cursor = conn.execute(query)
+            columns = [d[0] for d in cursor.description] if cursor.description else []
+            rows = cursor.fetchmany(max_rows + 1)
+            truncated = len(rows) > max_rows
+            return {
+                'query_id': state['query_id'],
+                'columns': columns,
+                'results': [dict(row) for row in rows[:max_rows]],
+                'row_count': min(len(rows), max_rows),
+                'truncated': truncated,
+                'max_rows': max_rows,
+                'execution_time': round((time.time() - start) * 1000, 2)
+            }
+        except sqlite3.OperationalError as e:
+            if 'interrupted' in str(e):
+                raise QueryCancelled(self._cancel_reason(state))
+            raise
+        finally:
+            conn.close()
+            self._unregister(state)
+
+    def execute_write(self, query: str, timeout_ms: int, query_id: str = None) -> Dict:
+        """Run a write on a short-lived connection, rolled back if the deadline passes"""
+        state = self._register(query_id, timeout_ms)
+        conn = self._write_connection()
+        self._install_guard(conn, state)
+        start = time.time()
+        try:
+            cursor = conn.execute(query)
+            conn.commit()
+            return {
+                'query_id': state['query_id'],
+                'affected_rows': cursor.rowcount,
+                'last_insert_id': cursor.lastrowid,
+                'execution_time': round((time.time() - start) * 1000, 2)
+            }
+        except sqlite3.OperationalError as e:
+            conn.rollback()
+            if 'interrupted' in str(e):
+                raise QueryCancelled(self._cancel_reason(state))
+            raise
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+            self._unregister(state)
+
+    def stream_ndjson(self, query: str, max_rows: int, timeout_ms: int, query_id: str = None) -> Iterator[str]:
+        """
+        Yield NDJSON lines: one "columns" line, "rows" lines of CHUNK_SIZE rows,
+        then an "end" (or "error") line. Rows are never held in memory beyond one chunk.
+        """
+        state = self._register(query_id, timeout_ms)
+        conn = self._read_connection()
+        self._install_guard(conn, state)
+        start = time.time()
+        sent = 0
+        try:
+            cursor = conn.execute(query)
+            columns = [d[0] for d in cursor.description] if cursor.description else []
+            yield self._line({'type': 'columns', 'query_id': state['query_id'], 'columns': columns})
+
+            truncated = False
+            while sent < max_rows:
+                rows = cursor.fetchmany(min(self.CHUNK_SIZE, max_rows - sent))
+                if not rows:
+                    break
+                sent += len(rows)
+                yield self._line({'type': 'rows', 'rows': [list(row) for row in rows]})
+            else:
+                truncated = cursor.fetchone() is not None
+
+            yield self._line({
+                'type': 'end',
+                'row_count': sent,
+                'truncated': truncated,
+                'max_rows': max_rows,
+                'execution_time': round((time.time() - start) * 1000, 2)
+            })
+        except sqlite3.Error as e:
+            message = self._cancel_reason(state) if 'interrupted' in str(e) else f'SQL Error: {str(e)}'
+            yield self._line({'type': 'error', 'message': message, 'row_count': sent})
+        finally:
+            conn.close()
+            self._unregister(state)
+
+    @staticmethod
+    def _line(payload: Dict) -> str:
+        return json.dumps(payload, default=str) + '\n'
+
+    # ==================== EXPLAIN ====================
+
+    def explain(self, query: str, timeout_ms: int) -> Dict:
+        """Return EXPLAIN QUERY PLAN rows with a rough nested-loop cost estimate"""
+        state = self._register(None, timeout_ms)
+        conn = self._read_connection()
+        self._install_guard(conn, state)
+        try:
+            plan = [
+                {'id': row[0], 'parent': row[1], 'detail': row[3]}
+                for row in conn.execute(f'EXPLAIN QUERY PLAN {query}')
+            ]
+            aliases = self._table_aliases(query)
+            stats = self._load_stat1(conn)
+
+            outer_rows = 1.0
+            total_cost = 0.0
+            for node in plan:
+                estimate = self._estimate_node(conn, node['detail'], aliases, stats)
+                node.update(estimate)
+                if estimate.get('estimated_rows') is not None:
+                    total_cost += outer_rows * estimate['estimated_cost']
+                    outer_rows *= max(estimate['estimated_rows'], 1)
+                elif 'TEMP B-TREE' in node['detail']:
+                    sort_cost = outer_rows * math.log2(outer_rows + 1)
+                    node['estimated_cost'] = round(sort_cost, 1)
+                    total_cost += sort_cost
+
+            return {
+                'plan': plan,
+                'estimated_cost': round(total_cost, 1),
+                'estimated_rows': round(outer_rows),
+                'full_scans': [n['table'] for n in plan if n.get('operation') == 'SCAN' and not n.get('index')],
+                'has_statistics': bool(stats)
+            }
+        except sqlite3.OperationalError as e:
+            if 'interrupted' in str(e):
+                raise QueryCancelled(self._cancel_reason(state))
+            raise
+        finally:
+            conn.close()
+            self._unregister(state)
+
+    @staticmethod
+    def _table_aliases(query: str) -> Dict[str, str]:
+        aliases = {}
+        for table, alias in TABLE_REF_PATTERN.findall(query):
+            aliases[table] = table
+            if alias:
+                aliases[alias] = table
+        return aliases
+
+    @staticmethod
+    def _load_stat1(conn) -> Dict:
+        """Read ANALYZE statistics if they exist: {(table, index): [n, avg rows per key, ...]}"""
+        try:
+            rows = conn.execute('SELECT tbl, idx, stat FROM sqlite_stat1').fetchall()
+        except sqlite3.OperationalError:
+            return {}
+        stats = {}
+        for tbl, idx, stat in rows:
+            numbers = [int(part) for part in str(stat).split() if part.isdigit()]
+            if numbers:
+                stats[(tbl, idx)] = numbers
+        return stats
+
+    def _table_rows(self, conn, table: str, stats: Dict) -> Optional[int]:
+        for (tbl, _), numbers in stats.items():
+            if tbl == table:
+                return numbers[0]
+        try:
+            # MAX(rowid) is an O(log n) stand-in for COUNT(*) when there are no stats
+            return conn.execute(f'SELECT MAX(rowid) FROM "{table}"').fetchone()[0] or 0
+        except sqlite3.Error:
+            return None
+
+    def _estimate_node(self, conn, detail: str, aliases: Dict, stats: Dict) -> Dict:
+        match = PLAN_NODE_PATTERN.match(detail)
+        if not match:
+            return {}
+        operation, name, using = match.groups()
+        table = aliases.get(name, name)
+        table_rows = self._table_rows(conn, table, stats)
+        if table_rows is None:
+            return {'operation': operation, 'table': table}
+
+        index = None
+        if using:
+            index_match = re.search(r'INDEX (\w+)', using)
+            index = index_match.group(1) if index_match else ('PRIMARY KEY' if 'PRIMARY KEY' in using else None)
+
+        depth = math.log2(table_rows + 1) + 1
+        if operation == 'SCAN':
+            rows, cost = table_rows, float(table_rows)
+        elif index == 'PRIMARY KEY':
+            rows, cost = 1, depth
+        else:
+            per_key = stats.get((table, index), [table_rows, 10])
+            rows = per_key[1] if len(per_key) > 1 else 10
+            cost = depth * rows
+
+        return {
+            'operation': operation,
+            'table': table,
+            'index': index,
+            'table_rows': table_rows,
+            'estimated_rows': rows,
+            'estimated_cost': round(cost, 1)
+        }
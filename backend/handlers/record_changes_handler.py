@@ -0,0 +1,111 @@
+"""Delta sync over the records change log (records_changes, migration 0011)"""
+import logging
+import sqlite3
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class RecordChangesHandler:
+    """
+    Reads and compacts records_changes.
+
+    A page of changes is the latest entry per record with version > since,
+    ordered by that version, so a record edited ten times shows up once and
+    the last version in the page is the client's next `since`. Upserted
+    rows are read from records; deleted ones are returned as ids.
+
+    compact() keeps only the newest entry per record and drops delete
+    tombstones older than TOMBSTONE_DAYS. The highest version dropped that
+    way becomes the horizon: a client whose `since` is below it may have
+    missed a delete and is told to start over from 0 (a full snapshot,
+    since every live record keeps its newest entry).
+    """
+
+    NAMESPACE = 'records_changes'
+    TOMBSTONE_DAYS = 30
+    DEFAULT_LIMIT = 5000
+    MAX_LIMIT = 20000
+
+    # Latest entry per record after :since, first :limit of them by version
+    PAGE_SQL = '''
+        WITH page AS (
+            SELECT record_id, MAX(version) AS version, op
+            FROM records_changes
+            WHERE version > ?
+            GROUP BY record_id
+            ORDER BY version
+            LIMIT ?
+        )
+    '''
+
+    def __init__(self, db_path: str, store):
+        self.db_path = db_path
+        self.store = store
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def horizon(self) -> int:
+        return (self.store.get(self.NAMESPACE, 'horizon') or {}).get('version', 0)
+
+    def clamp_limit(self, limit: Optional[int]) -> int:
+        return max(1, min(limit or self.DEFAULT_LIMIT, self.MAX_LIMIT))
+
+    def needs_reset(self, since: int) -> bool:
+        """True when deletes after `since` may have been compacted away"""
+        return 0 < since < self.horizon()
+
+    def page(self, conn, since: int, limit: int) -> Tuple[List[int], int, int, bool]:
+        """
+        (deleted record ids, last version in the page, latest version, has_more)
+        on conn, which the caller keeps in one read transaction with the
+        upsert query from upsert_sql() so both see the same snapshot.
+        """
+        latest = conn.execute('SELECT COALESCE(MAX(version), 0) FROM records_changes').fetchone()[0]
+        rows = conn.execute(f'{self.PAGE_SQL} SELECT record_id, version, op FROM page ORDER BY version',
+                            (since, limit)).fetchall()
+        deletes = [row['record_id'] for row in rows if row['op'] == 'delete']
+        version = rows[-1]['version'] if rows else max(since, 0)
+        return deletes, version, latest, version < latest
+
+    def upsert_sql(self, select_sql: str) -> str:
+        """Query for the page's live rows (params: since, limit), in change order"""
+        return f'''
+            {self.PAGE_SQL}
+            SELECT {select_sql}
+            FROM page
+            JOIN records r ON r.id = page.record_id
+            WHERE page.op = 'upsert'
+            ORDER BY page.version
+        '''
+
+    def compact(self, tombstone_days: int = None) -> Dict:
+        tombstone_days = self.TOMBSTONE_DAYS if tombstone_days is None else tombstone_days
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            superseded = conn.execute('''
+                DELETE FROM records_changes
+                WHERE version NOT IN (SELECT MAX(version) FROM records_changes GROUP BY record_id)
+            ''').rowcount
+            purged = conn.execute('''
+                DELETE FROM records_changes
+                WHERE op = 'delete' AND changed_at < datetime('now', ?)
+                RETURNING version
+            ''', (f'-{int(tombstone_days)} days',)).fetchall()
+            remaining = conn.execute('SELECT COUNT(*) FROM records_changes').fetchone()[0]
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+        horizon = max([self.horizon()] + [row[0] for row in purged])
+        self.store.set(self.NAMESPACE, 'horizon', {'version': horizon})
+        logger.info(f"records_changes compacted: {superseded} superseded, {len(purged)} tombstones dropped, "
+                    f"{remaining} left, horizon {horizon}")
+        return {'superseded': superseded, 'tombstones': len(purged), 'remaining': remaining, 'horizon': horizon}
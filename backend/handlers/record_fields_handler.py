@@ -0,0 +1,122 @@
+"""Sparse field selection (?fields=) for record listings"""
+import logging
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+from handlers.dimension_cache_handler import RECORD_LOOKUPS, LISTING_FIELDS
+
+logger = logging.getLogger(__name__)
+
+# Fields computed after the query -> record columns they are computed from
+DERIVED_FIELDS = {
+    **{field: (column,) for field, (_, column, _) in RECORD_LOOKUPS.items()},
+    'combined_quality': ('condition_disc_id', 'condition_sleeve_id'),
+    'condition': ('condition_sleeve_id',),
+    'image_srcset': ('image_url',),
+    'image_srcset_avif': ('image_url',)
+}
+SRCSET_FIELDS = ('image_srcset', 'image_srcset_avif')
+
+# What each endpoint adds to r.* when no fields are requested
+SEARCH_FIELDS = ('status_name', 'sleeve_condition_name', 'disc_condition_name', 'format_name', 'location_name',
+                 'condition')
+FILTER_FIELDS = ('status_name', 'sleeve_condition_name', 'disc_condition_name', 'format_name', 'location_name')
+RECORDS_FIELDS = LISTING_FIELDS + SRCSET_FIELDS
+
+
+class FieldSelectionError(Exception):
+    """Unknown or malformed fields= parameter"""
+
+    def __init__(self, message: str, allowed: List[str] = None, status_code: int = 400):
+        super().__init__(message)
+        self.allowed = allowed or []
+        self.status_code = status_code
+
+    def to_dict(self) -> Dict:
+        return {'status': 'error', 'error': str(self), 'allowed_fields': self.allowed}
+
+
+class RecordProjection:
+    """The SELECT list and post-query steps for one listing request"""
+
+    def __init__(self, columns: Optional[List[str]], derived: List[str], fields: Optional[List[str]]):
+        self.columns = columns  # record columns to select; None means r.*
+        self.derived = derived  # derived fields to compute
+        self.fields = fields    # output keys in order; None means everything
+
+    @property
+    def select_sql(self) -> str:
+        if self.columns is None:
+            return 'r.*'
+        return ', '.join(f'r."{column}"' for column in self.columns)
+
+    @property
+    def wants_srcsets(self) -> bool:
+        return any(field in self.derived for field in SRCSET_FIELDS)
+
+
+class RecordFieldsHandler:
+    """
+    Turns ?fields=id,artist,title,store_price,image_url into a projection.
+
+    Allowed fields are the records table's own columns (read once from the
+    schema) plus the derived names in DERIVED_FIELDS. Derived fields come from
+    the dimension cache, so a thin listing selects a handful of columns from
+    records alone and computes only what was asked for.
+    """
+
+    def __init__(self, db_path: str, dimensions, image_derivatives=None):
+        self.db_path = db_path
+        self.dimensions = dimensions
+        self.image_derivatives = image_derivatives
+        self._columns = None
+        self._lock = threading.Lock()
+
+    def record_columns(self) -> List[str]:
+        with self._lock:
+            if self._columns is None:
+                conn = sqlite3.connect(self.db_path, timeout=10)
+                try:
+                    self._columns = [row[1] for row in conn.execute('PRAGMA table_info(records)')]
+                finally:
+                    conn.close()
+            return self._columns
+
+    def allowed_fields(self) -> List[str]:
+        columns = self.record_columns()
+        return columns + [field for field in DERIVED_FIELDS if field not in columns]
+
+    def parse(self, fields_param: Optional[str], default_derived) -> RecordProjection:
+        """Projection for a request; without fields= it is r.* plus the endpoint's default derived fields"""
+        if not fields_param or not fields_param.strip():
+            return RecordProjection(None, list(default_derived), None)
+
+        fields = list(dict.fromkeys(f.strip() for f in fields_param.split(',') if f.strip()))
+        columns = self.record_columns()
+        unknown = [f for f in fields if f not in columns and f not in DERIVED_FIELDS]
+        if unknown:
+            raise FieldSelectionError(f"Unknown fields: {', '.join(unknown)}", self.allowed_fields())
+
+        # A real column always wins over a derived field of the same name
+        derived = [f for f in fields if f not in columns]
+        needed = [f for f in fields if f in columns]
+        for field in derived:
+            needed.extend(c for c in DERIVED_FIELDS[field] if c in columns)
+        return RecordProjection(list(dict.fromkeys(needed)), derived, fields)
+
+    def apply(self, conn, records: List[Dict], projection: RecordProjection) -> List[Dict]:
+        """Compute derived fields and trim to the requested ones"""
+        derived = projection.derived
+        if 'condition' in derived and 'sleeve_condition_name' not in derived:
+            derived = derived + ['sleeve_condition_name']
+        self.dimensions.decorate_records(records, derived)
+        if 'condition' in derived:
+            for record in records:
+                if record.get('sleeve_condition_name'):
+                    record['condition'] = record['sleeve_condition_name']
+        if projection.wants_srcsets and self.image_derivatives is not None:
+            self.image_derivatives.attach_srcsets(conn, records)
+        if projection.fields is None:
+            return records
+        return [{field: record.get(field) for field in projection.fields} for record in records]
@@ -0,0 +1,132 @@
+"""ETag / conditional GET and short-lived body cache for public catalog reads"""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Callable, Iterable, Optional
+
+from flask import Response, request
+
+from handlers.table_version_handler import TableVersionHandler
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCacheHandler:
+    """
+    Wraps read endpoints whose output depends only on a few tables.
+
+    The ETag is a hash of the endpoint, its normalized query string, any
+    extra vary values and the table_versions counters of the tables it reads,
+    so it is known before the view runs: a matching If-None-Match gets a 304
+    without touching the database, and a fresh hit in the body cache is
+    returned without running the query or re-serializing. Bodies are kept at
+    most TTL seconds and only while the counters are unchanged.
+
+    When table_versions is missing (migration 0005 not applied) the views run
+    uncached.
+    """
+
+    TTL = 10.0
+    MAX_ENTRIES = 256
+    MAX_BODY_BYTES = 2 * 1024 * 1024
+
+    def __init__(self, versions: TableVersionHandler):
+        self.versions = versions
+        self._bodies = OrderedDict()  # key -> (etag, expires_at, body, mimetype)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.not_modified = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalized_query(args) -> str:
+        """Query string with keys sorted and empty values dropped, so equivalent URLs share an entry"""
+        items = sorted((k, v) for k in args for v in args.getlist(k) if v != '')
+        return '&'.join(f'{k}={v}' for k, v in items)
+
+    def etag_for(self, key: str, tables: Iterable[str]) -> Optional[str]:
+        versions = self.versions.get(tables)
+        if versions is None:
+            return None
+        return hashlib.sha1(f'{key}|{versions}'.encode('utf-8')).hexdigest()[:24]
+
+    def _lookup(self, key: str, etag: str):
+        with self._lock:
+            entry = self._bodies.get(key)
+            if entry is None:
+                return None
+            if entry[0] != etag or entry[1] < time.monotonic():
+                del self._bodies[key]
+                return None
+            self._bodies.move_to_end(key)
+            return entry
+
+    def _store(self, key: str, etag: str, body: bytes, mimetype: str):
+        if len(body) > self.MAX_BODY_BYTES:
+            return
+        with self._lock:
+            self._bodies[key] = (etag, time.monotonic() + self.TTL, body, mimetype)
+            self._bodies.move_to_end(key)
+            while len(self._bodies) > self.MAX_ENTRIES:
+                self._bodies.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._bodies.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = len(self._bodies)
+        return {'entries': entries, 'hits': self.hits, 'not_modified': self.not_modified, 'misses': self.misses}
+
+    @staticmethod
+    def _with_etag(response: Response, etag: str) -> Response:
+        response.set_etag(etag)
+        # Clients may keep the body but must revalidate, which is a cheap 304
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    def cached(self, tables: Iterable[str], vary: Callable[[], str] = None):
+        """
+        Decorator for GET views. tables are the tables the view reads; vary
+        returns anything else the body depends on (session role, today's date).
+        """
+        tables = tuple(tables)
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if request.method != 'GET':
+                    return view(*args, **kwargs)
+                key = f'{request.path}?{self.normalized_query(request.args)}'
+                if vary is not None:
+                    key += f'|{vary()}'
+                etag = self.etag_for(key, tables)
+                if etag is None:
+                    return view(*args, **kwargs)
+
+                if request.if_none_match.contains(etag):
+                    self.not_modified += 1
+                    return self._with_etag(Response(status=304), etag)
+
+                entry = self._lookup(key, etag)
+                if entry is not None:
+                    self.hits += 1
+                    return self._with_etag(Response(entry[2], mimetype=entry[3]), etag)
+
+                self.misses += 1
+                response = view(*args, **kwargs)
+                if isinstance(response, tuple):
+                    # (body, status) returns are errors in these views; never cache them
+                    return response
+                if response.status_code == 200:
+                    # Streamed exports are too big to keep but still revalidate with a 304
+                    if not response.is_streamed:
+                        self._store(key, etag, response.get_data(), response.mimetype)
+                    self._with_etag(response, etag)
+                return response
+            return wrapper
+        return decorator
@@ -0,0 +1,220 @@
+"""Buffered shelf-scan sessions applied to records in one transaction"""
+import json
+import logging
+import sqlite3
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ScanSessionError(Exception):
+    """Invalid scan session operation; carries the HTTP status to return"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def apply_location_updates(cursor, updates: List[tuple], last_seen: str) -> int:
+    """
+    Set location_id, location_index and last_seen for many records with one
+    executemany. updates is a list of (location_id, location_index, record_id).
+    """
+    cursor.executemany('''
+        UPDATE records
+        SET location_id = ?,
+            location_index = ?,
+            last_seen = ?
+        WHERE id = ?
+    ''', [(location_id, location_index, last_seen, record_id) for location_id, location_index, record_id in updates])
+    return cursor.rowcount
+
+
+class ScanSessionHandler:
+    """
+    Scanners stream barcodes into an open session (stored in
+    scan_session_items, so any worker can take the next batch). Committing
+    resolves every scan against records with one join, assigns shelf
+    positions in scan order and applies them with one executemany.
+    """
+
+    MAX_SCANS_PER_REQUEST = 5000
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _session(self, conn, session_id: str, require_open: bool = True) -> sqlite3.Row:
+        session = conn.execute('SELECT * FROM scan_sessions WHERE id = ?', (session_id,)).fetchone()
+        if not session:
+            raise ScanSessionError('Scan session not found', 404)
+        if require_open and session['status'] != 'open':
+            raise ScanSessionError(f"Scan session is {session['status']}", 409)
+        return session
+
+    def create(self, location_id: int, location_index_start: int = 1, created_by: int = None) -> Dict:
+        conn = self._connect()
+        try:
+            if not conn.execute('SELECT id FROM locations WHERE id = ?', (location_id,)).fetchone():
+                raise ScanSessionError('Invalid location_id')
+            session_id = uuid.uuid4().hex
+            conn.execute('''
+                INSERT INTO scan_sessions (id, location_id, location_index_start, created_by)
+                VALUES (?, ?, ?, ?)
+            ''', (session_id, location_id, location_index_start, created_by))
+            return {'session_id': session_id, 'location_id': location_id,
+                    'location_index_start': location_index_start}
+        finally:
+            conn.close()
+
+    def add_scans(self, session_id: str, barcodes: List[str]) -> int:
+        """Append barcodes in scan order. Returns the session's total scan count."""
+        barcodes = [str(b).strip() for b in barcodes if b is not None and str(b).strip()]
+        if len(barcodes) > self.MAX_SCANS_PER_REQUEST:
+            raise ScanSessionError(f'At most {self.MAX_SCANS_PER_REQUEST} scans per request')
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._session(conn, session_id)
+                next_seq = conn.execute('SELECT COALESCE(MAX(seq), 0) + 1 FROM scan_session_items WHERE session_id = ?',
+                                        (session_id,)).fetchone()[0]
+                conn.executemany('INSERT INTO scan_session_items (session_id, seq, barcode) VALUES (?, ?, ?)',
+                                 [(session_id, next_seq + i, barcode) for i, barcode in enumerate(barcodes)])
+                total = next_seq - 1 + len(barcodes)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            return total
+        finally:
+            conn.close()
+
+    def status(self, session_id: str) -> Dict:
+        conn = self._connect()
+        try:
+            session = self._session(conn, session_id, require_open=False)
+            count = conn.execute('SELECT COUNT(*) FROM scan_session_items WHERE session_id = ?',
+                                 (session_id,)).fetchone()[0]
+            result = dict(session)
+            result['result'] = json.loads(session['result']) if session['result'] else None
+            result['scan_count'] = count
+            return result
+        finally:
+            conn.close()
+
+    def cancel(self, session_id: str):
+        conn = self._connect()
+        try:
+            self._session(conn, session_id)
+            conn.execute("UPDATE scan_sessions SET status = 'cancelled' WHERE id = ?", (session_id,))
+        finally:
+            conn.close()
+
+    def _resolve(self, conn, session: sqlite3.Row) -> Dict:
+        """Match every scan to a record (barcode first, then record id) and plan the updates"""
+        rows = conn.execute('''
+            SELECT i.seq, i.barcode,
+                   COALESCE(rb.id, ri.id) AS record_id,
+                   COALESCE(rb.location_id, ri.location_id) AS old_location_id,
+                   COALESCE(rb.location_index, ri.location_index) AS old_location_index,
+                   l.name AS old_location_name
+            FROM scan_session_items i
+            LEFT JOIN records rb ON rb.barcode = i.barcode
+            LEFT JOIN records ri ON rb.id IS NULL
+                                AND i.barcode NOT GLOB '*[^0-9]*'
+                                AND ri.id = CAST(i.barcode AS INTEGER)
+            LEFT JOIN locations l ON l.id = COALESCE(rb.location_id, ri.location_id)
+            WHERE i.session_id = ?
+            ORDER BY i.seq
+        ''', (session['id'],)).fetchall()
+
+        location_id = session['location_id']
+        next_index = session['location_index_start']
+        seen_seqs = set()
+        placed = {}
+        updates = []
+        unknown = []
+        moved = []
+        duplicates = 0
+        for row in rows:
+            if row['seq'] in seen_seqs:
+                # A barcode shared by several records: the first match wins
+                continue
+            seen_seqs.add(row['seq'])
+            record_id = row['record_id']
+            if record_id is None:
+                unknown.append(row['barcode'])
+                continue
+            if record_id in placed:
+                duplicates += 1
+                continue
+            placed[record_id] = next_index
+            updates.append((location_id, next_index, record_id))
+            if row['old_location_id'] != location_id:
+                moved.append({
+                    'record_id': record_id,
+                    'barcode': row['barcode'],
+                    'from_location_id': row['old_location_id'],
+                    'from_location_name': row['old_location_name'],
+                    'location_index': next_index
+                })
+            next_index += 1
+
+        return {
+            'updates': updates,
+            'scan_count': len(seen_seqs),
+            'unknown_barcodes': list(dict.fromkeys(unknown)),
+            'moved': moved,
+            'duplicate_scans': duplicates
+        }
+
+    def commit(self, session_id: str, dry_run: bool = False, last_seen: Optional[str] = None) -> Dict:
+        """
+        Apply the session: every resolved record gets the session location, a
+        shelf index in scan order and last_seen = today. Returns the report of
+        unknown barcodes and records that moved from another location.
+        """
+        start = time.time()
+        last_seen = last_seen or datetime.now().strftime('%Y-%m-%d')
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                session = self._session(conn, session_id)
+                plan = self._resolve(conn, session)
+                updates = plan.pop('updates')
+                report = {
+                    'session_id': session_id,
+                    'location_id': session['location_id'],
+                    'updated_count': len(updates),
+                    **plan,
+                    'dry_run': dry_run
+                }
+                if dry_run:
+                    conn.execute('ROLLBACK')
+                    return report
+
+                apply_location_updates(conn.cursor(), updates, last_seen)
+                report['execution_time'] = round((time.time() - start) * 1000, 2)
+                conn.execute('''
+                    UPDATE scan_sessions SET status = 'committed', committed_at = CURRENT_TIMESTAMP, result = ?
+                    WHERE id = ?
+                ''', (json.dumps(report), session_id))
+                conn.execute('COMMIT')
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                raise
+            logger.info(f"Scan session {session_id} committed: {report['updated_count']} records, "
+                        f"{len(report['unknown_barcodes'])} unknown, {len(report['moved'])} moved")
+            return report
+        finally:
+            conn.close()
@@ -0,0 +1,162 @@
+"""Fast JSON encoding, streamed list responses and the compact columnar format"""
+import json
+import logging
+from typing import Callable, Dict, Iterable, Iterator, List
+
+from flask import Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+STREAM_MIN_ROWS = 1000
+CHUNK_SIZE = 500
+
+
+def dumps(obj, default: Callable = None) -> bytes:
+    """
+    Compact JSON with sorted keys (matching jsonify) as bytes. Uses orjson when
+    installed; dates and other non-JSON types go through default, so output is
+    the same as the standard library encoder's.
+    """
+    if orjson is not None:
+        return orjson.dumps(
+            obj, default=default,
+            option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        )
+    return json.dumps(obj, default=default, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider that encodes jsonify() responses with orjson. Debug
+    mode keeps the standard library's indented output.
+    """
+
+    def dumps(self, obj, **kwargs) -> str:
+        if kwargs or orjson is None:
+            kwargs.setdefault('default', self.default)
+            kwargs.setdefault('ensure_ascii', self.ensure_ascii)
+            kwargs.setdefault('sort_keys', self.sort_keys)
+            return json.dumps(obj, **kwargs)
+        return dumps(obj, default=self.default).decode('utf-8')
+
+    def response(self, *args, **kwargs) -> Response:
+        if orjson is None or (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj, default=self.default) + b'\n', mimetype=self.mimetype)
+
+
+def wants_columnar(args) -> bool:
+    """?format=columnar opts a list endpoint into {"columns": [...], "rows": [[...]]}"""
+    return (args.get('format') or '').lower() == 'columnar'
+
+
+def to_columnar(rows: List[Dict], columns: List[str] = None) -> Dict:
+    """List of dicts to {'columns', 'rows'}; columns default to the first row's keys"""
+    if columns is None:
+        columns = list(rows[0].keys()) if rows else []
+    return {'columns': columns, 'rows': [[row.get(c) for c in columns] for row in rows]}
+
+
+class _RowSource:
+    """Normalizes sqlite3.Row / dict input into dict chunks or positional chunks"""
+
+    def __init__(self, rows: Iterable, prepare: Callable[[List[Dict]], List[Dict]] = None):
+        self._rows = iter(rows)
+        self.prepare = prepare
+        self.columns = None
+        self._positions = None
+
+    def take(self, n: int) -> List:
+        chunk = []
+        for row in self._rows:
+            chunk.append(row)
+            if len(chunk) >= n:
+                break
+        return chunk
+
+    def as_dicts(self, chunk: List) -> List[Dict]:
+        dicts = [row if isinstance(row, dict) else dict(row) for row in chunk]
+        return self.prepare(dicts) if self.prepare else dicts
+
+    def as_lists(self, chunk: List) -> List[List]:
+        if not chunk:
+            return []
+        if self.prepare or isinstance(chunk[0], dict):
+            dicts = self.as_dicts(chunk)
+            if self.columns is None:
+                self.columns = list(dicts[0].keys())
+            return [[row.get(c) for c in self.columns] for row in dicts]
+        # sqlite3.Row straight to lists; a duplicated column name keeps its first value, like dict(row)
+        if self.columns is None:
+            keys = chunk[0].keys()
+            first = {}
+            for i, key in enumerate(keys):
+                first.setdefault(key, i)
+            self.columns = list(first)
+            self._positions = list(first.values())
+        return [[row[i] for i in self._positions] for row in chunk]
+
+
+def json_list_response(rows: Iterable, key: str, head: Dict = None, columnar: bool = False,
+                       prepare: Callable[[List[Dict]], List[Dict]] = None,
+                       on_close: Callable[[], None] = None, default: Callable = None,
+                       stream_min_rows: int = STREAM_MIN_ROWS, chunk_size: int = CHUNK_SIZE) -> Response:
+    """
+    Serialize a list endpoint as {**head, key: [...], 'count': n}, or with
+    columnar=True as {**head, 'columns': [...], 'rows': [[...]], 'count': n}.
+
+    rows may be a cursor: up to stream_min_rows are read first, and if the
+    result is bigger it is streamed in chunk_size pieces straight from the
+    cursor instead of being materialized. prepare(chunk) can decorate each
+    chunk of dicts before it is encoded; on_close (e.g. conn.close) runs
+    once everything has been read.
+    """
+    head = dict(head or {})
+    source = _RowSource(rows, prepare)
+    first = source.take(stream_min_rows + 1)
+
+    if len(first) <= stream_min_rows:
+        try:
+            if columnar:
+                body = {**head, 'rows': source.as_lists(first)}
+                body['columns'] = source.columns or []
+            else:
+                body = {**head, key: source.as_dicts(first)}
+            body['count'] = len(first)
+        finally:
+            if on_close:
+                on_close()
+        return Response(dumps(body, default=default) + b'\n', mimetype='application/json')
+
+    def generate() -> Iterator[bytes]:
+        count = 0
+        try:
+            # Head fields first, then the array; count goes last since it is only known at the end
+            yield dumps(head, default=default)[:-1] + (b',' if head else b'')
+            yield b'"rows":[' if columnar else b'"' + key.encode('utf-8') + b'":['
+            chunk = first
+            while chunk:
+                items = source.as_lists(chunk) if columnar else source.as_dicts(chunk)
+                encoded = dumps(items, default=default)[1:-1]
+                if encoded:
+                    yield (b',' if count else b'') + encoded
+                count += len(chunk)
+                chunk = source.take(chunk_size)
+            yield b']'
+            if columnar:
+                yield b',"columns":' + dumps(source.columns or [])
+            yield b',"count":' + str(count).encode('ascii') + b'}\n'
+        finally:
+            if on_close:
+                on_close()
+
+    response = Response(stream_with_context(generate()), mimetype='application/json')
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,190 @@
+"""SQLite-backed key/value state shared by every API worker process"""
+import json
+import logging
+import sqlite3
+import time
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class SharedStateHandler:
+    """
+    Namespaced JSON values in the shared_state table (migration 0006).
+
+    Under gunicorn every worker is a separate process, so anything kept in a
+    module-level dict is invisible to the others and lost on restart. Entries
+    here survive both. Expired entries read as missing and are purged lazily.
+    """
+
+    PURGE_EVERY = 300  # seconds between opportunistic purges of expired rows
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._purged_at = 0.0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _maybe_purge(self, conn):
+        now = time.time()
+        if now - self._purged_at > self.PURGE_EVERY:
+            self._purged_at = now
+            conn.execute('DELETE FROM shared_state WHERE expires_at IS NOT NULL AND expires_at < ?', (now,))
+
+    def get(self, namespace: str, key: str, default=None) -> Any:
+        conn = self._connect()
+        try:
+            row = conn.execute('''
+                SELECT value FROM shared_state
+                WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at >= ?)
+            ''', (namespace, str(key), time.time())).fetchone()
+            return json.loads(row['value']) if row else default
+        finally:
+            conn.close()
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        conn = self._connect()
+        try:
+            self._maybe_purge(conn)
+            conn.execute('''
+                INSERT INTO shared_state (namespace, key, value, expires_at, updated_at)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(namespace, key) DO UPDATE SET
+                    value = excluded.value, expires_at = excluded.expires_at, updated_at = CURRENT_TIMESTAMP
+            ''', (namespace, str(key), json.dumps(value), time.time() + ttl if ttl else None))
+        finally:
+            conn.close()
+
+    def update(self, namespace: str, key: str, **fields) -> Optional[Dict]:
+        """
+        Merge fields into a stored dict atomically (read and write under one
+        write lock). Returns the merged value, or None if the key is missing.
+        """
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('''
+                    SELECT value FROM shared_state
+                    WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at >= ?)
+                ''', (namespace, str(key), time.time())).fetchone()
+                if not row:
+                    conn.execute('ROLLBACK')
+                    return None
+                value = json.loads(row['value'])
+                value.update(fields)
+                conn.execute('''
+                    UPDATE shared_state SET value = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE namespace = ? AND key = ?
+                ''', (json.dumps(value), namespace, str(key)))
+                conn.execute('COMMIT')
+                return value
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                raise
+        finally:
+            conn.close()
+
+    def modify(self, namespace: str, key: str, func: Callable[[Any], Tuple[Any, Any]],
+               ttl: Optional[float] = None) -> Any:
+        """
+        Atomic read-modify-write: func(current value or None) returns
+        (new value, result); the new value is stored under the same write
+        lock the read took and result is returned. Lets counters and claims
+        (rate limits, refresh locks) be shared safely between workers.
+        """
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                now = time.time()
+                row = conn.execute('''
+                    SELECT value FROM shared_state
+                    WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at >= ?)
+                ''', (namespace, str(key), now)).fetchone()
+                value, result = func(json.loads(row['value']) if row else None)
+                conn.execute('''
+                    INSERT INTO shared_state (namespace, key, value, expires_at, updated_at)
+                    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT(namespace, key) DO UPDATE SET
+                        value = excluded.value, expires_at = excluded.expires_at, updated_at = CURRENT_TIMESTAMP
+                ''', (namespace, str(key), json.dumps(value), now + ttl if ttl else None))
+                conn.execute('COMMIT')
+                return result
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                raise
+        finally:
+            conn.close()
+
+    def delete(self, namespace: str, key: str) -> bool:
+        conn = self._connect()
+        try:
+            cursor = conn.execute('DELETE FROM shared_state WHERE namespace = ? AND key = ?', (namespace, str(key)))
+            return cursor.rowcount > 0
+        finally:
+            conn.close()
+
+    def items(self, namespace: str) -> Iterator[Tuple[str, Any]]:
+        conn = self._connect()
+        try:
+            rows = conn.execute('''
+                SELECT key, value FROM shared_state
+                WHERE namespace = ? AND (expires_at IS NULL OR expires_at >= ?)
+                ORDER BY key
+            ''', (namespace, time.time())).fetchall()
+        finally:
+            conn.close()
+        return iter([(row['key'], json.loads(row['value'])) for row in rows])
+
+
+class SharedDict:
+    """
+    Dict-style view of one namespace, standing in for the old module-level
+    dicts. Values are copies: write changes back with d[key] = value or
+    d.update_item(key, field=...), never by mutating what was read.
+    """
+
+    def __init__(self, store: SharedStateHandler, namespace: str, ttl: Optional[float] = None):
+        self.store = store
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def __contains__(self, key) -> bool:
+        return self.store.get(self.namespace, key, _MISSING) is not _MISSING
+
+    def __getitem__(self, key):
+        value = self.store.get(self.namespace, key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.store.set(self.namespace, key, value, self.ttl)
+
+    def __delitem__(self, key):
+        if not self.store.delete(self.namespace, key):
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return self.store.get(self.namespace, key, default)
+
+    def pop(self, key, default=None):
+        value = self.store.get(self.namespace, key, _MISSING)
+        if value is _MISSING:
+            return default
+        self.store.delete(self.namespace, key)
+        return value
+
+    def update_item(self, key, **fields) -> Optional[Dict]:
+        return self.store.update(self.namespace, key, **fields)
+
+    def items(self):
+        return self.store.items(self.namespace)
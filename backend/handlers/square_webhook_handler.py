@@ -0,0 +1,160 @@
+"""Verification and storage of Square webhook notifications"""
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import sqlite3
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_HEADER = 'X-Square-HmacSha256-Signature'
+
+
+class SquareWebhookError(Exception):
+    """Rejected notification (bad signature, malformed body, not configured)"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+    def to_dict(self) -> Dict:
+        return {'status': 'error', 'error': str(self)}
+
+
+def verify_signature(signature_key: str, notification_url: str, body: bytes, signature: Optional[str]) -> bool:
+    """
+    Square signs base64(HMAC-SHA256(key, notification_url + raw body)). The
+    URL must be exactly the one configured on the webhook subscription.
+    """
+    if not signature:
+        return False
+    digest = hmac.new(signature_key.encode('utf-8'), notification_url.encode('utf-8') + body,
+                      hashlib.sha256).digest()
+    return hmac.compare_digest(base64.b64encode(digest).decode('ascii'), signature.strip())
+
+
+def event_object(event: Dict) -> Tuple[Optional[str], Optional[str], Dict]:
+    """(object type, object id, object) for an event, e.g. ('payment', 'R2X...', {...payment...})"""
+    data = event.get('data') or {}
+    object_type = data.get('type')
+    wrapper = data.get('object') or {}
+    obj = wrapper.get(object_type)
+    if obj is None and wrapper:
+        obj = next(iter(wrapper.values()))
+    return object_type, data.get('id'), obj if isinstance(obj, dict) else {}
+
+
+class SquareWebhookHandler:
+    """
+    Receives Square notifications into square_webhook_events (migration
+    0008). receive() verifies the signature and inserts the event unless its
+    event_id is already stored, so Square's at-least-once redeliveries are
+    recorded once; applying the event is left to the job queue.
+
+    The event row and its job are written separately, so a redelivery of an
+    event whose row never got a job_id (the enqueue failed and Square was
+    answered 500) is reported as needing a job again rather than as a
+    duplicate. Applying an event twice is harmless: it sets a checkout
+    status or completes an order that is already complete.
+    """
+
+    def __init__(self, db_path: str, signature_key: Optional[str], notification_url: Optional[str] = None):
+        self.db_path = db_path
+        self.signature_key = signature_key
+        self.notification_url = notification_url
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def _row_to_event(row) -> Optional[Dict]:
+        if row is None:
+            return None
+        event = dict(row)
+        event['payload'] = json.loads(event['payload'])
+        return event
+
+    def receive(self, body: bytes, signature: Optional[str], request_url: str) -> Tuple[Dict, bool]:
+        """Verify and store a notification; returns (event, needs_job)"""
+        if not self.signature_key:
+            raise SquareWebhookError('Square webhook signature key not configured', 503)
+        if not verify_signature(self.signature_key, self.notification_url or request_url, body, signature):
+            raise SquareWebhookError('Invalid signature', 403)
+        try:
+            event = json.loads(body)
+        except ValueError:
+            raise SquareWebhookError('Body is not valid JSON')
+        if not isinstance(event, dict) or not event.get('event_id') or not event.get('type'):
+            raise SquareWebhookError('Missing event_id or type')
+
+        object_type, object_id, obj = event_object(event)
+        conn = self._connect()
+        try:
+            cursor = conn.execute('''
+                INSERT OR IGNORE INTO square_webhook_events
+                    (event_id, event_type, merchant_id, object_type, object_id, object_status, payload, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (event['event_id'], event['type'], event.get('merchant_id'), object_type, object_id,
+                  obj.get('status'), body.decode('utf-8'), event.get('created_at')))
+            if cursor.rowcount > 0:
+                return event, True
+            row = conn.execute('SELECT job_id FROM square_webhook_events WHERE event_id = ?',
+                               (event['event_id'],)).fetchone()
+        finally:
+            conn.close()
+        if row is not None and row['job_id'] is None:
+            logger.warning(f"Square event {event['event_id']} ({event['type']}) redelivered without a job, queueing it")
+            return event, True
+        logger.info(f"Duplicate Square event {event['event_id']} ({event['type']}) ignored")
+        return event, False
+
+    def get(self, event_id: str) -> Optional[Dict]:
+        conn = self._connect()
+        try:
+            return self._row_to_event(conn.execute(
+                'SELECT * FROM square_webhook_events WHERE event_id = ?', (event_id,)).fetchone())
+        finally:
+            conn.close()
+
+    def latest_object(self, object_id: str, event_prefix: str = '') -> Optional[Dict]:
+        """Most recent object (payment, checkout, ...) delivered for object_id, or None"""
+        conn = self._connect()
+        try:
+            row = conn.execute('''
+                SELECT payload FROM square_webhook_events
+                WHERE object_id = ? AND event_type LIKE ?
+                ORDER BY COALESCE(created_at, received_at) DESC, rowid DESC
+                LIMIT 1
+            ''', (object_id, event_prefix + '%')).fetchone()
+        finally:
+            conn.close()
+        return event_object(json.loads(row['payload']))[2] if row else None
+
+    def mark(self, event_id: str, status: str, job_id: Optional[int] = None, error: Optional[str] = None):
+        conn = self._connect()
+        try:
+            conn.execute('''
+                UPDATE square_webhook_events SET status = ?, job_id = COALESCE(?, job_id), error = ?,
+                    processed_at = CASE WHEN ? = 'received' THEN processed_at ELSE CURRENT_TIMESTAMP END
+                WHERE event_id = ?
+            ''', (status, job_id, error, status, event_id))
+        finally:
+            conn.close()
+
+    def recent(self, limit: int = 50, event_type: Optional[str] = None) -> List[Dict]:
+        query = 'SELECT * FROM square_webhook_events'
+        params = []
+        if event_type:
+            query += ' WHERE event_type = ?'
+            params.append(event_type)
+        query += ' ORDER BY received_at DESC, rowid DESC LIMIT ?'
+        params.append(max(1, min(int(limit), 500)))
+        conn = self._connect()
+        try:
+            return [self._row_to_event(row) for row in conn.execute(query, params).fetchall()]
+        finally:
+            conn.close()
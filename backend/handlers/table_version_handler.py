@@ -0,0 +1,59 @@
+"""Per-table change counters shared by the in-process caches"""
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def read_versions(conn) -> Optional[Dict[str, int]]:
+    """All counters from table_versions, or None before migration 0005 has run"""
+    try:
+        return {row[0]: row[1] for row in conn.execute('SELECT table_name, version FROM table_versions')}
+    except sqlite3.OperationalError:
+        return None
+
+
+class TableVersionHandler:
+    """
+    Reads table_versions (bumped by triggers on every insert, update and
+    delete) at most once per CHECK_INTERVAL, so callers can ask "did this
+    table change?" on every request without a query each time.
+
+    expire() forces the next call to re-read; the API calls it after every
+    write request so the worker that made a change never serves stale data.
+    Other workers see the change within CHECK_INTERVAL.
+    """
+
+    CHECK_INTERVAL = 1.0
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._versions = None
+        self._read_at = 0.0
+        self._lock = threading.Lock()
+
+    def current(self, force: bool = False) -> Optional[Dict[str, int]]:
+        with self._lock:
+            now = time.monotonic()
+            if force or now - self._read_at >= self.CHECK_INTERVAL:
+                conn = sqlite3.connect(self.db_path, timeout=10)
+                try:
+                    self._versions = read_versions(conn)
+                finally:
+                    conn.close()
+                self._read_at = now
+            return self._versions
+
+    def get(self, tables: Iterable[str]) -> Optional[Tuple[int, ...]]:
+        """Counters for the given tables, or None when versions are unavailable"""
+        versions = self.current()
+        if versions is None:
+            return None
+        return tuple(versions.get(table, 0) for table in tables)
+
+    def expire(self):
+        with self._lock:
+            self._read_at = 0.0
@@ -0,0 +1,126 @@
+"""
+Accounting and checkout integration tables.
+
+This is the schema the old ad-hoc migrate_database.py produced. Every statement
+is guarded so databases migrated by that script are adopted unchanged.
+"""
+from handlers.migration_handler import add_column, table_exists
+
+
+def upgrade(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS accounts (
+            id INTEGER PRIMARY KEY,
+            code TEXT UNIQUE NOT NULL,
+            name TEXT NOT NULL,
+            type TEXT NOT NULL
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS journal_entries (
+            id INTEGER PRIMARY KEY,
+            transaction_date TEXT NOT NULL,
+            description TEXT,
+            source_type TEXT NOT NULL,
+            source_id TEXT NOT NULL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS journal_lines (
+            id INTEGER PRIMARY KEY,
+            journal_entry_id INTEGER NOT NULL,
+            account_id INTEGER NOT NULL,
+            debit_amount INTEGER DEFAULT 0,
+            credit_amount INTEGER DEFAULT 0,
+            FOREIGN KEY (journal_entry_id) REFERENCES journal_entries(id),
+            FOREIGN KEY (account_id) REFERENCES accounts(id)
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY,
+            order_id TEXT NOT NULL,
+            source TEXT NOT NULL,
+            gross_amount INTEGER NOT NULL,
+            transaction_date TEXT NOT NULL,
+            external_transaction_id TEXT UNIQUE,
+            FOREIGN KEY (order_id) REFERENCES orders(id)
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS fees (
+            id INTEGER PRIMARY KEY,
+            order_id TEXT NOT NULL,
+            fee_type TEXT NOT NULL,
+            amount INTEGER NOT NULL,
+            source TEXT,
+            external_transaction_id TEXT,
+            FOREIGN KEY (order_id) REFERENCES orders(id)
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS shipments (
+            id INTEGER PRIMARY KEY,
+            order_id TEXT NOT NULL UNIQUE,
+            shipment_date TEXT,
+            tracking_number TEXT,
+            shipping_charged INTEGER DEFAULT 0,
+            postage_cost INTEGER DEFAULT 0,
+            FOREIGN KEY (order_id) REFERENCES orders(id)
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS bank_accounts (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            institution TEXT
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS bank_transactions (
+            id INTEGER PRIMARY KEY,
+            bank_account_id INTEGER NOT NULL,
+            transaction_date TEXT NOT NULL,
+            amount INTEGER NOT NULL,
+            description TEXT,
+            external_id TEXT UNIQUE,
+            FOREIGN KEY (bank_account_id) REFERENCES bank_accounts(id)
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS reconciliation_matches (
+            id INTEGER PRIMARY KEY,
+            bank_transaction_id INTEGER NOT NULL,
+            source_type TEXT NOT NULL,
+            source_id INTEGER NOT NULL,
+            matched_amount INTEGER NOT NULL,
+            FOREIGN KEY (bank_transaction_id) REFERENCES bank_transactions(id)
+        )
+    ''')
+
+    if table_exists(conn, 'records'):
+        add_column(conn, 'records', 'batch_id', 'INTEGER')
+        add_column(conn, 'records', 'acquisition_date', 'TEXT')
+
+    if table_exists(conn, 'batches'):
+        add_column(conn, 'batches', 'total_cost', 'REAL')
+
+    if table_exists(conn, 'orders'):
+        add_column(conn, 'orders', 'channel', 'TEXT', default="'website'")
+        add_column(conn, 'orders', 'external_order_id', 'TEXT')
+        add_column(conn, 'orders', 'is_accounted', 'INTEGER', default=0)
+        add_column(conn, 'orders', 'shipping_charged', 'REAL', default=0)
+        add_column(conn, 'orders', 'tax_total', 'REAL', default=0)
+        conn.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_external_id
+            ON orders(external_order_id) WHERE external_order_id IS NOT NULL
+        ''')
@@ -0,0 +1,24 @@
+"""
+Indexes for the hot lookup paths (barcode scans, status/location filters and
+journal line joins).
+
+Runs batched: each index is built in its own short transaction so the live
+API can write between builds.
+"""
+from handlers.migration_handler import create_index, table_exists
+
+BATCHED = True
+
+
+def upgrade(conn):
+    if table_exists(conn, 'records'):
+        create_index(conn, 'idx_records_barcode', 'records', 'barcode')
+        create_index(conn, 'idx_records_status_id', 'records', 'status_id')
+        create_index(conn, 'idx_records_location', 'records', 'location_id, location_index')
+
+    if table_exists(conn, 'journal_lines'):
+        create_index(conn, 'idx_journal_lines_entry', 'journal_lines', 'journal_entry_id')
+        create_index(conn, 'idx_journal_lines_account', 'journal_lines', 'account_id')
+
+    if table_exists(conn, 'journal_entries'):
+        create_index(conn, 'idx_journal_entries_source', 'journal_entries', 'source_type, source_id')
@@ -0,0 +1,33 @@
+"""
+Responsive image derivatives.
+
+image_sources tracks every original the derivative worker has seen (uploads
+under /static and hotlinked Discogs images) so failures are not retried on
+every listing request. image_variants holds one row per generated file.
+"""
+
+
+def upgrade(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS image_sources (
+            source_url TEXT PRIMARY KEY,
+            status TEXT NOT NULL DEFAULT 'pending',
+            width INTEGER,
+            height INTEGER,
+            error TEXT,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS image_variants (
+            id INTEGER PRIMARY KEY,
+            source_url TEXT NOT NULL,
+            width INTEGER NOT NULL,
+            format TEXT NOT NULL,
+            url TEXT NOT NULL,
+            bytes INTEGER,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (source_url, width, format)
+        )
+    ''')
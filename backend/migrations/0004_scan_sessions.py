@@ -0,0 +1,31 @@
+"""
+Server-side scan sessions for shelf audits.
+
+The scanner appends barcodes to scan_session_items as they are read; the
+session is applied to records in one transaction when it is committed.
+"""
+
+
+def upgrade(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS scan_sessions (
+            id TEXT PRIMARY KEY,
+            location_id INTEGER NOT NULL,
+            location_index_start INTEGER NOT NULL DEFAULT 1,
+            status TEXT NOT NULL DEFAULT 'open',
+            created_by INTEGER,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            committed_at TEXT,
+            result TEXT
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS scan_session_items (
+            session_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            barcode TEXT NOT NULL,
+            scanned_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (session_id, seq)
+        )
+    ''')
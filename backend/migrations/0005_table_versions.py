@@ -0,0 +1,36 @@
+"""
+Change counters for dimension and catalog tables.
+
+Every insert, update or delete on a versioned table bumps its row in
+table_versions through a trigger. Each API worker's in-process lookup cache
+can tell with one tiny query that another worker (or a manual sqlite3
+session) changed a dimension table, and read endpoints derive ETags from the
+counters of the tables they read without running their queries.
+"""
+from handlers.migration_handler import table_exists
+
+DIMENSION_TABLES = ('d_condition', 'd_status', 'formats', 'locations', 'genres', 'accounts', 'app_config', 'areas')
+VERSIONED_TABLES = DIMENSION_TABLES + ('records', 'accessories', 'events', 'image_variants')
+EVENTS = ('insert', 'update', 'delete')
+
+
+def upgrade(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS table_versions (
+            table_name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+    for table in VERSIONED_TABLES:
+        if not table_exists(conn, table):
+            continue
+        conn.execute('INSERT OR IGNORE INTO table_versions (table_name, version) VALUES (?, 0)', (table,))
+        for event in EVENTS:
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{event}
+                AFTER {event.upper()} ON {table}
+                BEGIN
+                    UPDATE table_versions SET version = version + 1 WHERE table_name = '{table}';
+                END
+            ''')
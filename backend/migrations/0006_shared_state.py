@@ -0,0 +1,24 @@
+"""
+Shared key/value state for multi-worker deployments.
+
+Replaces the per-process dicts in api.py (user_tokens, background_jobs,
+square_payment_sessions) so every gunicorn worker sees the same entries.
+Values are JSON; expires_at (unix seconds) is optional.
+"""
+
+
+def upgrade(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS shared_state (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            expires_at REAL,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (namespace, key)
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_shared_state_expires
+        ON shared_state(expires_at) WHERE expires_at IS NOT NULL
+    ''')
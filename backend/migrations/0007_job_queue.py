@@ -0,0 +1,46 @@
+"""
+Durable job queue.
+
+Slow admin actions (reconciliation, Discogs fetches, bulk rule application)
+run as rows in jobs and are picked up by the worker threads each API process
+starts (handlers/job_queue_handler.py). run_after and heartbeat_at are unix
+seconds; payload and result are JSON.
+"""
+
+
+def upgrade(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            type TEXT NOT NULL,
+            payload TEXT NOT NULL DEFAULT '{}',
+            priority INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'queued'
+                CHECK (status IN ('queued', 'running', 'succeeded', 'failed', 'cancelled')),
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 1,
+            progress REAL,
+            progress_message TEXT,
+            result TEXT,
+            error TEXT,
+            cancel_requested INTEGER NOT NULL DEFAULT 0,
+            run_after REAL NOT NULL DEFAULT 0,
+            locked_by TEXT,
+            heartbeat_at REAL,
+            created_by INTEGER,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            started_at TEXT,
+            finished_at TEXT,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Claim order: highest priority first, then oldest
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_jobs_queued
+        ON jobs(priority DESC, id) WHERE status = 'queued'
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_jobs_running
+        ON jobs(heartbeat_at) WHERE status = 'running'
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_type_created ON jobs(type, created_at)')
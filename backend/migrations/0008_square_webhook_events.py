@@ -0,0 +1,37 @@
+"""
+Square webhook events.
+
+Every verified notification is stored once, keyed by Square's event_id, so
+redeliveries are acknowledged without being applied twice. status moves
+from received to processed / ignored / failed as the job queue works
+through them (job_id points at the jobs row).
+"""
+
+
+def upgrade(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS square_webhook_events (
+            event_id TEXT PRIMARY KEY,
+            event_type TEXT NOT NULL,
+            merchant_id TEXT,
+            object_type TEXT,
+            object_id TEXT,
+            object_status TEXT,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'received'
+                CHECK (status IN ('received', 'processed', 'ignored', 'failed')),
+            job_id INTEGER,
+            error TEXT,
+            created_at TEXT,
+            received_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            processed_at TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_square_webhook_events_object
+        ON square_webhook_events(object_id, received_at)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_square_webhook_events_type
+        ON square_webhook_events(event_type, received_at)
+    ''')
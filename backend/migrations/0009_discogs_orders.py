@@ -0,0 +1,68 @@
+"""
+Local copy of Discogs marketplace orders.
+
+discogs_orders holds one row per order with the filterable fields as
+columns and the parsed order (DiscogsHandler._parse_order) as JSON in
+payload. discogs_order_items has one row per line item, with record_id set
+from the [PIGSTYLE ID: n] tag in the listing comments so sold items can be
+looked up by record. last_activity is Discogs' ISO timestamp and is the
+incremental sync watermark.
+"""
+
+
+def upgrade(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS discogs_orders (
+            order_id TEXT PRIMARY KEY,
+            status TEXT,
+            buyer_username TEXT,
+            buyer_name TEXT,
+            buyer_email TEXT,
+            total_amount REAL,
+            shipping_amount REAL,
+            fee_amount REAL,
+            currency TEXT,
+            created_at TEXT,
+            paid_at TEXT,
+            shipped_at TEXT,
+            last_activity TEXT,
+            item_count INTEGER NOT NULL DEFAULT 0,
+            payload TEXT NOT NULL,
+            synced_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS discogs_order_items (
+            order_id TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            item_id INTEGER,
+            listing_id INTEGER,
+            release_id INTEGER,
+            record_id INTEGER,
+            artist TEXT,
+            title TEXT,
+            price REAL,
+            quantity INTEGER,
+            PRIMARY KEY (order_id, position)
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_discogs_orders_created
+        ON discogs_orders(created_at)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_discogs_orders_status
+        ON discogs_orders(status, created_at)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_discogs_orders_last_activity
+        ON discogs_orders(last_activity)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_discogs_order_items_record
+        ON discogs_order_items(record_id)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_discogs_order_items_listing
+        ON discogs_order_items(listing_id)
+    ''')
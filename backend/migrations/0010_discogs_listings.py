@@ -0,0 +1,38 @@
+"""
+Local copy of the shop's Discogs marketplace inventory.
+
+One row per listing, keyed by Discogs listing id and indexed by release id;
+record_id comes from the [PIGSTYLE ID: n] tag the listing was created with.
+A sync rewrites the whole inventory: rows carry the sync_id that last saw
+them and rows from earlier syncs are dropped once every page has loaded.
+"""
+
+
+def upgrade(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS discogs_listings (
+            listing_id INTEGER PRIMARY KEY,
+            release_id INTEGER NOT NULL,
+            record_id INTEGER,
+            status TEXT,
+            price REAL,
+            currency TEXT,
+            media_condition TEXT,
+            sleeve_condition TEXT,
+            comments TEXT,
+            artist TEXT,
+            title TEXT,
+            catalog_number TEXT,
+            posted_at TEXT,
+            sync_id TEXT,
+            synced_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_discogs_listings_release
+        ON discogs_listings(release_id, listing_id)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_discogs_listings_record
+        ON discogs_listings(record_id, status)
+    ''')
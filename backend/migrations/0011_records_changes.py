@@ -0,0 +1,53 @@
+"""
+Change log for records.
+
+Every insert, update and delete on records appends (record_id, op) to
+records_changes; version is AUTOINCREMENT so it only ever grows, even after
+compaction removes rows. The log is seeded with one upsert per existing
+record, so asking for changes since version 0 returns the whole inventory.
+"""
+from handlers.migration_handler import table_exists
+
+
+def upgrade(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS records_changes (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            record_id INTEGER NOT NULL,
+            op TEXT NOT NULL CHECK (op IN ('upsert', 'delete')),
+            changed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_records_changes_record
+        ON records_changes(record_id, version)
+    ''')
+    if not table_exists(conn, 'records'):
+        return
+
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_records_changes_insert
+        AFTER INSERT ON records
+        BEGIN
+            INSERT INTO records_changes (record_id, op) VALUES (NEW.id, 'upsert');
+        END
+    ''')
+    # Price, status, location, last_seen... any column change means clients must refetch the row
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_records_changes_update
+        AFTER UPDATE ON records
+        BEGIN
+            INSERT INTO records_changes (record_id, op)
+            SELECT OLD.id, 'delete' WHERE OLD.id IS NOT NEW.id;
+            INSERT INTO records_changes (record_id, op) VALUES (NEW.id, 'upsert');
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_records_changes_delete
+        AFTER DELETE ON records
+        BEGIN
+            INSERT INTO records_changes (record_id, op) VALUES (OLD.id, 'delete');
+        END
+    ''')
+    if conn.execute('SELECT 1 FROM records_changes LIMIT 1').fetchone() is None:
+        conn.execute("INSERT INTO records_changes (record_id, op) SELECT id, 'upsert' FROM records ORDER BY id")
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Import-time profile of the API, from python -X importtime.
+
+Imports a module (default: api) in a fresh interpreter, which is what every
+gunicorn master, dev server and script pays before serving anything, and
+prints the total plus the slowest imports by cumulative and by self time.
+
+Usage:
+    python3 profile_startup.py
+    python3 profile_startup.py --top 30 --runs 5
+    python3 profile_startup.py --budget 400      # exit 1 when the median import exceeds 400ms
+    python3 profile_startup.py --module wsgi     # includes create_app(): migrations, logging
+
+Heavy SDKs (Plaid, discogs_client, smtplib/email.mime) are imported inside
+the functions that use them; one showing up here means a module-level import
+crept back in.
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+BACKEND = os.path.dirname(os.path.abspath(__file__))
+LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+WATCHED = ('plaid', 'discogs_client', 'smtplib', 'email.mime')
+
+
+def profile(module):
+    """[(module, self_us, cumulative_us, depth)] for one cold import of module"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=BACKEND, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        sys.exit(f"import {module} failed:\n{result.stderr[-2000:]}")
+    entries = []
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            entries.append((match.group(4), int(match.group(1)), int(match.group(2)), len(match.group(3)) // 2))
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--module', default='api')
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--runs', type=int, default=3, help='Cold imports to take the median of')
+    parser.add_argument('--budget', type=float, help='Fail when the median import takes longer (ms)')
+    args = parser.parse_args()
+
+    runs = [profile(args.module) for _ in range(max(args.runs, 1))]
+    top_level = args.module.split('.')[0]
+    totals = [next((e[2] for e in run if e[0] == top_level and e[3] == 0), 0) / 1000 for run in runs]
+    median = statistics.median(totals)
+    # Report the run closest to the median so the breakdown matches the headline number
+    entries = min(zip(totals, runs), key=lambda pair: abs(pair[0] - median))[1]
+
+    print(f"import {args.module}: {median:.0f}ms median of {len(runs)} "
+          f"(min {min(totals):.0f}ms, max {max(totals):.0f}ms), {len(entries)} modules")
+    for title, key in (('cumulative', 2), ('self', 1)):
+        print(f"\nSlowest by {title} time:")
+        for name, self_us, cumulative_us, depth in sorted(entries, key=lambda e: e[key], reverse=True)[:args.top]:
+            print(f"  {cumulative_us / 1000:8.1f}ms {self_us / 1000:8.1f}ms  {name}")
+
+    loaded = sorted({name for name, *_ in entries if name.startswith(WATCHED)})
+    if loaded:
+        print(f"\nLazily-imported SDKs loaded at startup: {', '.join(loaded)}")
+
+    if args.budget is not None and median > args.budget:
+        print(f"\nOver budget: {median:.0f}ms > {args.budget:.0f}ms")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
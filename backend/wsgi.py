@@ -0,0 +1,11 @@
+"""
+WSGI entry point for production:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Job queue workers are started per worker process by post_fork in
+gunicorn.conf.py, not here: with preload_app this module runs in the master.
+"""
+from api import create_app
+
+app = create_app(start_workers=False)
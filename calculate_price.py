@@ -1,11 +1,23 @@
+import argparse
+import csv
 import requests
 import json
+import os
+import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, as_completed
 from dataclasses import dataclass
 from typing import Optional, Dict, Any, Tuple
 from enum import Enum
 import logging
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+from handlers.discogs_mirror_handler import DiscogsMirrorHandler, DiscogsLookupError
+from handlers.price_estimate_handler import PriceEstimateHandler
+from handlers.rounding_handler import RoundingHandler
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -173,9 +185,15 @@ class DiscogsPriceEstimator:
     Main class for estimating record prices using Discogs data.
     """
     
-    def __init__(self, user_token: str):
+    # Community stats only adjust demand; don't hold an estimate hostage to them
+    STATS_WAIT_SECONDS = 1.5
+    MARKETPLACE_CACHE_SECONDS = 300
+    
+    def __init__(self, user_token: str, mirror_path: str = None):
         """
         Initialize with your Discogs API token.
+        Searches and community stats go through the local release mirror
+        (backend/data/discogs_mirror.db unless mirror_path is given).
         """
         logger.info("Initializing DiscogsPriceEstimator")
         self.user_token = user_token
@@ -185,6 +203,12 @@ class DiscogsPriceEstimator:
             'Authorization': f'Discogs token={user_token}'
         }
         logger.debug("Headers configured for Discogs API")
+        self.mirror = DiscogsMirrorHandler(user_token, mirror_path, user_agent='RecordPriceEstimator/1.0')
+        # Pooled keep-alive session shared with the mirror
+        self.session = self.mirror.session
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='estimator')
+        self._marketplace_cache = {}
+        self._marketplace_lock = threading.Lock()
         
     def search_by_catalog(self, catalog_number: str) -> Dict:
         """
@@ -193,21 +217,11 @@ class DiscogsPriceEstimator:
         Raises ValueError if no release found.
         """
         logger.info(f"Searching Discogs for catalog number: '{catalog_number}'")
-        search_url = f"{self.base_url}/database/search"
-        params = {
-            'q': catalog_number,
-            'type': 'release',
-            'per_page': 5
-        }
-        logger.debug(f"Search URL: {search_url}, Params: {params}")
         
         try:
-            logger.info("Sending search request to Discogs API")
-            response = requests.get(search_url, headers=self.headers, params=params)
-            logger.debug(f"Response status code: {response.status_code}")
-            response.raise_for_status()
-            data = response.json()
-            logger.debug(f"Response received, results count: {len(data.get('results', []))}")
+            logger.info("Looking up catalog number in the release mirror")
+            data = {'results': self.mirror.search_results(catalog_number, per_page=5)}
+            logger.debug(f"Results count: {len(data.get('results', []))}")
             
             if not data.get('results'):
                 logger.error(f"No results found for catalog number: {catalog_number}")
@@ -226,7 +240,7 @@ class DiscogsPriceEstimator:
             logger.warning(f"No exact catalog match found for: {catalog_number}")
             raise ValueError(f"No exact catalog match found for: {catalog_number}")
                 
-        except requests.exceptions.RequestException as e:
+        except DiscogsLookupError as e:
             logger.error(f"API error searching for catalog {catalog_number}: {e}")
             raise RuntimeError(f"Discogs API error: {e}")
     
@@ -236,40 +250,36 @@ class DiscogsPriceEstimator:
         Raises RuntimeError if stats unavailable.
         """
         logger.info(f"Fetching community stats for release ID: {release_id}")
-        stats_url = f"{self.base_url}/releases/{release_id}/stats"
-        logger.debug(f"Stats URL: {stats_url}")
         
-        try:
-            logger.info("Sending stats request to Discogs API")
-            response = requests.get(stats_url, headers=self.headers)
-            logger.debug(f"Response status code: {response.status_code}")
-            response.raise_for_status()
-            data = response.json()
-            
-            if not data.get('community'):
-                logger.error(f"No community data in stats response for release {release_id}")
-                raise RuntimeError(f"No community data available for release {release_id}")
-                
-            community = data.get('community', {})
-            logger.info(f"Community stats retrieved - Wants: {community.get('want', 0)}, Haves: {community.get('have', 0)}")
-            return data
+        data = self.mirror.release_stats(release_id)
+        
+        if not data.get('community'):
+            logger.error(f"No community data in stats response for release {release_id}")
+            raise RuntimeError(f"No community data available for release {release_id}")
             
-        except requests.exceptions.RequestException as e:
-            logger.error(f"API error fetching stats for release {release_id}: {e}")
-            raise RuntimeError(f"Failed to fetch community stats: {e}")
+        community = data.get('community', {})
+        logger.info(f"Community stats retrieved - Wants: {community.get('want', 0)}, Haves: {community.get('have', 0)}")
+        return data
     
     def get_marketplace_stats(self, release_id: int) -> Dict:
         """
         Get marketplace statistics including price history.
         Raises RuntimeError if no marketplace data available.
         """
+        with self._marketplace_lock:
+            cached = self._marketplace_cache.get(release_id)
+        if cached and time.time() - cached['timestamp'] < self.MARKETPLACE_CACHE_SECONDS:
+            logger.info(f"Marketplace cache hit for release ID: {release_id}")
+            return cached['data']
+        
         logger.info(f"Fetching marketplace stats for release ID: {release_id}")
         marketplace_url = f"{self.base_url}/marketplace/stats/{release_id}"
         logger.debug(f"Marketplace URL: {marketplace_url}")
         
         try:
             logger.info("Sending marketplace stats request to Discogs API")
-            response = requests.get(marketplace_url, headers=self.headers)
+            self.mirror.rate_limiter.acquire()
+            response = self.session.get(marketplace_url, timeout=15)
             logger.debug(f"Response status code: {response.status_code}")
             response.raise_for_status()
             data = response.json()
@@ -285,6 +295,8 @@ class DiscogsPriceEstimator:
                 raise RuntimeError(f"Median price is $0 - no sales data available")
                 
             logger.info(f"Marketplace stats retrieved - Median: ${data['median']}, Sales: {data.get('num_sales', 0)}")
+            with self._marketplace_lock:
+                self._marketplace_cache[release_id] = {'data': data, 'timestamp': time.time()}
             return data
             
         except requests.exceptions.RequestException as e:
@@ -324,10 +336,10 @@ class DiscogsPriceEstimator:
         title = release.get('title', 'Unknown')
         logger.info(f"STEP 1 COMPLETE: Found release '{title}' (ID: {release_id})")
         
-        # Step 2: Get community stats
-        logger.info("STEP 2: Fetching community statistics")
-        stats = self.get_release_stats(release_id)
-        logger.info(f"STEP 2 COMPLETE: Community stats retrieved successfully")
+        # Step 2: Community stats and marketplace data are independent - fetch both at once
+        logger.info("STEP 2: Fetching community and marketplace statistics in parallel")
+        stats_future = self._executor.submit(self.get_release_stats, release_id)
+        marketplace_future = self._executor.submit(self.get_marketplace_stats, release_id)
         
         # Step 3: Parse conditions
         logger.info("STEP 3: Parsing condition inputs")
@@ -335,13 +347,20 @@ class DiscogsPriceEstimator:
         sleeve_cond = Condition.from_string(sleeve_condition)
         logger.info(f"STEP 3 COMPLETE: Media: {media_cond.value}, Sleeve: {sleeve_cond.value}")
         
-        # Step 4: Get marketplace data - MUST HAVE MEDIAN PRICE
-        logger.info("STEP 4: Fetching marketplace statistics")
-        marketplace = self.get_marketplace_stats(release_id)
+        # Step 4: Marketplace data - MUST HAVE MEDIAN PRICE
+        marketplace = marketplace_future.result()
         base_median_price = marketplace['median']
         num_sales = marketplace.get('num_sales', 0)
         logger.info(f"STEP 4 COMPLETE: Base median price: ${base_median_price}, Sales: {num_sales}")
         
+        try:
+            stats = stats_future.result(timeout=self.STATS_WAIT_SECONDS)
+            logger.info(f"STEP 2 COMPLETE: Community stats retrieved successfully")
+        except FutureTimeout:
+            # The fetch keeps running and lands in the mirror for the next lookup
+            logger.warning(f"Community stats slower than {self.STATS_WAIT_SECONDS}s - using neutral demand")
+            stats = {}
+        
         # Step 5: Calculate condition multiplier
         logger.info("STEP 5: Calculating condition multiplier")
         condition_mult = get_condition_multiplier(media_cond, sleeve_cond)
@@ -398,6 +417,89 @@ class DiscogsPriceEstimator:
         
         return result
 
+    def estimate_batch(self, rows, max_workers: int = 4):
+        """
+        Estimate a whole lot of {'catalog_number', 'media_condition', 'sleeve_condition'}
+        rows, yielding (index, row, PriceEstimate or exception) as each finishes.
+        
+        Rows sharing a catalog number run one after another in the same worker,
+        so only the first one goes to Discogs; the rest hit the mirror and the
+        marketplace cache. Live calls share the mirror's rate limiter.
+        """
+        groups = {}
+        for index, row in enumerate(rows):
+            key = DiscogsMirrorHandler.normalize_catno(row['catalog_number'])
+            groups.setdefault(key, []).append((index, row))
+        
+        def run_group(indexed_rows):
+            results = []
+            for index, row in indexed_rows:
+                try:
+                    estimate = self.estimate_price(row['catalog_number'], row['media_condition'], row['sleeve_condition'])
+                except Exception as e:
+                    estimate = e
+                results.append((index, row, estimate))
+            return results
+        
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='estimator-batch') as pool:
+            futures = [pool.submit(run_group, indexed_rows) for indexed_rows in groups.values()]
+            for future in as_completed(futures):
+                yield from future.result()
+
+# ============================================
+# BATCH MODE
+# ============================================
+
+BATCH_COLUMNS = ['index', 'catalog_number', 'media_condition', 'sleeve_condition', 'status',
+                 'estimated_price', 'store_price', 'price_range_low', 'price_range_high',
+                 'confidence_score', 'num_sales', 'error']
+
+def run_batch(input_path: str, output_path: str = None, as_json: bool = False, max_workers: int = 4):
+    """
+    Price a CSV or JSON lot file and stream one result per row as it finishes
+    (CSV by default, NDJSON with --json). store_price is rounded with the
+    store's rules and can be pasted straight into a purchase draft.
+    """
+    with open(input_path, encoding='utf-8-sig') as f:
+        payload = json.load(f) if input_path.lower().endswith('.json') else f.read()
+    rows = PriceEstimateHandler.parse_batch_rows(payload)
+    
+    estimator = DiscogsPriceEstimator(DISCOGS_TOKEN)
+    out = open(output_path, 'w', newline='') if output_path else sys.stdout
+    writer = None if as_json else csv.DictWriter(out, fieldnames=BATCH_COLUMNS)
+    if writer:
+        writer.writeheader()
+    
+    start = time.time()
+    priced = 0
+    try:
+        for index, row, estimate in estimator.estimate_batch(rows, max_workers):
+            result = {'index': index, **row}
+            if isinstance(estimate, PriceEstimate):
+                priced += 1
+                result.update({
+                    'status': 'success',
+                    'estimated_price': estimate.estimated_price,
+                    'store_price': RoundingHandler.round_to_store_price(estimate.estimated_price),
+                    'price_range_low': estimate.price_range_low,
+                    'price_range_high': estimate.price_range_high,
+                    'confidence_score': estimate.confidence_score,
+                    'num_sales': estimate.num_sales
+                })
+            else:
+                result.update({'status': 'error', 'error': str(estimate)})
+            
+            if writer:
+                writer.writerow(result)
+            else:
+                out.write(json.dumps(result) + '\n')
+            out.flush()
+    finally:
+        if output_path:
+            out.close()
+    
+    print(f"\n✅ Priced {priced}/{len(rows)} rows in {time.time() - start:.1f}s", file=sys.stderr)
+
 # ============================================
 # MAIN FUNCTION
 # ============================================
@@ -516,8 +618,17 @@ def test_api_connection() -> bool:
         return False
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Estimate record prices from Discogs data')
+    parser.add_argument('--batch', metavar='FILE', help='Price every row of a CSV or JSON lot file')
+    parser.add_argument('--output', metavar='FILE', help='Write batch results to FILE instead of stdout')
+    parser.add_argument('--json', action='store_true', help='Emit batch results as NDJSON instead of CSV')
+    parser.add_argument('--concurrency', type=int, default=4, help='Parallel lookups in batch mode (default: 4)')
+    args = parser.parse_args()
+    
+    if args.batch:
+        run_batch(args.batch, args.output, args.json, max(1, min(args.concurrency, 8)))
     # Test API first
-    if test_api_connection():
+    elif test_api_connection():
         main()
     else:
         print("\n⚠️  CANNOT CONTINUE - Fix your Discogs API token!")
@@ -1,74 +1,64 @@
 #!/usr/bin/env python3
 """
-Pull Discogs Listings - Correct API Endpoint
+Sync the Discogs inventory into the local mirror and print the diff against records
+
+    DISCOGS_USER_TOKEN=... python discogs_listings.py [--json my_discogs_listings.json] [--tolerance 0.5]
+
+Uses the same DiscogsInventoryHandler as /api/discogs/inventory/sync, so the
+table the API reads is refreshed too. Apply the suggested actions from the
+admin API (/api/discogs/inventory/actions).
 """
 
-import requests
+import argparse
 import json
+import os
+import sys
 
-TOKEN = "HylxGPoAuRgKwLfzbybZRyTxvxqXbrYJUhsZAkZq"
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend')
+sys.path.insert(0, BACKEND)
 
-headers = {
-    'Authorization': f'Discogs token={TOKEN}',
-    'User-Agent': 'PigStyleMusic/1.0'
-}
+from handlers.discogs_inventory_handler import DiscogsInventoryHandler
+from handlers.discogs_mirror_handler import RateLimiter, DiscogsMirrorHandler
+from handlers.migration_handler import MigrationHandler
+from handlers.shared_state_handler import SharedStateHandler
 
-print("Fetching your Discogs inventory...")
-print()
+parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+parser.add_argument('--db', default=os.path.join(BACKEND, 'data', 'records.db'))
+parser.add_argument('--username', default=os.environ.get('DISCOGS_USERNAME', 'pigstyle'))
+parser.add_argument('--tolerance', type=float, default=DiscogsInventoryHandler.DEFAULT_TOLERANCE)
+parser.add_argument('--json', help='Also write the diff to this file')
+args = parser.parse_args()
 
-# Use the inventory endpoint correctly
-all_listings = []
-page = 1
+TOKEN = os.environ.get('DISCOGS_USER_TOKEN')
+if not TOKEN:
+    sys.exit('DISCOGS_USER_TOKEN is not set')
 
-while True:
-    response = requests.get(
-        f'https://api.discogs.com/users/pigstyle/inventory',
-        headers=headers,
-        params={'page': page, 'per_page': 100}
-    )
-    
-    if response.status_code != 200:
-        print(f"Error: {response.status_code}")
-        print(response.text)
-        break
-    
-    data = response.json()
-    listings = data.get('listings', [])
-    
-    if not listings:
-        break
-    
-    all_listings.extend(listings)
-    print(f"Page {page}: {len(listings)} listings")
-    
-    if page >= data.get('pagination', {}).get('pages', 1):
-        break
-    
-    page += 1
+MigrationHandler(args.db, log=print).migrate()
+# The rate-limit bucket lives in shared_state, so a sync while the API runs shares its Discogs budget
+shared_state = SharedStateHandler(args.db)
+inventory = DiscogsInventoryHandler(
+    args.db, TOKEN, shared_state,
+    RateLimiter(DiscogsMirrorHandler.RATE_PER_MINUTE, DiscogsMirrorHandler.RATE_BURST, store=shared_state),
+    username=args.username
+)
 
-print(f"\nTotal listings found: {len(all_listings)}")
+print("Fetching your Discogs inventory...")
+state = inventory.sync(progress=lambda fraction, message: print(f"  {message}"))
+print(f"Total listings found: {state['listings']} ({state['removed']} no longer on Discogs)")
 print()
 
-# Display your listings
-if all_listings:
-    for i, listing in enumerate(all_listings, 1):
-        title = listing.get('release', {}).get('title', 'Unknown')
-        release_id = listing.get('release_id')
-        listing_id = listing.get('id')
-        price = listing.get('price', {}).get('value', 0)
-        status = listing.get('status', 'Unknown')
-        
-        print(f"{i}. {title}")
-        print(f"   Listing ID: {listing_id}")
-        print(f"   Release ID: {release_id}")
-        print(f"   Price: ${price}")
-        print(f"   Status: {status}")
-        print()
-else:
-    print("No listings found")
-
-# Save to file
-with open('my_discogs_listings.json', 'w') as f:
-    json.dump(all_listings, f, indent=2)
+diff = inventory.diff(args.tolerance)
+for key, label in (('sold_locally', 'Listed but sold locally'),
+                   ('not_listed', 'Active locally but not listed'),
+                   ('price_drift', 'Price drift from markup curve'),
+                   ('unlinked', 'Listings without a PIGSTYLE ID')):
+    print(f"{label}: {diff['summary'][key]}")
+for item in diff['price_drift'][:20]:
+    print(f"   Listing {item['listing_id']} (record {item['record_id']}): "
+          f"${item['listed_price']} -> ${item['expected_price']}")
+print(f"\n{len(diff['actions'])} suggested actions")
 
-print(f"Saved to my_discogs_listings.json")
\ No newline at end of file
+if args.json:
+    with open(args.json, 'w') as f:
+        json.dump(diff, f, indent=2)
+    print(f"Saved to {args.json}")
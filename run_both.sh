@@ -55,15 +55,25 @@ echo ""
 # Start backend API
 echo "Starting backend API on port 5000..."
 cd "$SCRIPT_DIR/backend"
-python3 api.py &
+if python3 -c "import gunicorn" 2>/dev/null; then
+    # Production profile: preloaded app, one worker per core (see backend/gunicorn.conf.py)
+    gunicorn -c gunicorn.conf.py &
+else
+    echo "⚠️  gunicorn not installed - falling back to the Flask dev server"
+    python3 api.py &
+fi
 BACKEND_PID=$!
 
 # Wait a moment for backend to start
 sleep 3
 
+# Build fingerprinted, precompressed static assets
+echo "Building static assets..."
+cd "$SCRIPT_DIR/website"
+python3 static_pipeline.py || echo "⚠️  Static build failed - serving uncompressed assets"
+
 # Start frontend website
 echo "Starting frontend website on port 8000..."
-cd "$SCRIPT_DIR/website"
 python3 website_routes.py &
 FRONTEND_PID=$!
 
@@ -213,6 +213,8 @@ function reconnectPlaid(source, label) {
 // EXTERNAL BALANCE CARDS (KEPT FOR OTHER TABS)
 // ============================================================
 
+// Balances come from a server-side cache: { balance, fetched_at, stale, refreshing }.
+// A stale value is returned at once while the server refreshes it in the background.
 async function getSquareBalance() {
     console.log('[BALANCES] getSquareBalance called');
     const res = await fetch(`${AppConfig.baseUrl}/api/accounting/external/square/balance`, {
@@ -222,7 +224,7 @@ async function getSquareBalance() {
     const data = await res.json();
     console.log('[BALANCES] Square balance response:', data);
     if (data.status === 'success') {
-        return data.balance ?? 0;
+        return data;
     }
     const err = new Error(data.error || 'Unknown Square error');
     err.plaidError = data;
@@ -252,20 +254,22 @@ async function getPlaidBalance(source) {
     const data = await res.json();
     console.log('[BALANCES]', source, 'balance response:', data);
     if (data.status === 'success') {
-        return data.balance ?? 0;
+        return data;
     }
     const err = new Error(data.error || 'Unknown error');
     err.plaidError = data;
     throw err;
 }
 
-async function refreshAllBalances() {
+async function refreshAllBalances(isRecheck = false) {
     console.log('[BALANCES] refreshAllBalances called');
     const cardIds = ['balance-square', 'balance-fnbo', 'balance-paypal', 'balance-total-assets'];
-    cardIds.forEach(id => {
-        const el = document.getElementById(id);
-        if (el) el.textContent = 'Loading...';
-    });
+    if (!isRecheck) {
+        cardIds.forEach(id => {
+            const el = document.getElementById(id);
+            if (el) el.textContent = 'Loading...';
+        });
+    }
 
     const sources = [
         { id: 'balance-square', label: 'Square', fetcher: getSquareBalance, source: 'square' },
@@ -274,18 +278,27 @@ async function refreshAllBalances() {
     ];
 
     let anyError = false;
+    let anyRefreshing = false;
     const results = [];
+    // All three at once; cached answers come back without waiting on Square or Plaid
+    const outcomes = await Promise.allSettled(sources.map(src => src.fetcher()));
 
-    for (const src of sources) {
+    for (let i = 0; i < sources.length; i++) {
+        const src = sources[i];
         const el = document.getElementById(src.id);
         try {
-            const balance = await src.fetcher();
+            if (outcomes[i].status === 'rejected') throw outcomes[i].reason;
+            const data = outcomes[i].value;
+            const balance = data.balance ?? 0;
+            if (data.refreshing) anyRefreshing = true;
             results.push({ id: src.id, balance, error: null });
             if (el) {
                 el.textContent = formatCurrency(balance);
                 el.style.color = balance >= 0 ? '#28a745' : '#dc3545';
+                el.title = data.fetched_at ? 'As of ' + new Date(data.fetched_at).toLocaleString() : '';
             }
         } catch (error) {
+            if (isRecheck) continue;
             anyError = true;
             const errorMsg = error.message || 'Unknown error';
             console.error('[BALANCES] Error from', src.label, error);
@@ -317,6 +330,11 @@ async function refreshAllBalances() {
     }
 
     console.log('[BALANCES] Balance refresh complete', results);
+
+    // Pick up the values the server is refreshing in the background
+    if (anyRefreshing && !isRecheck) {
+        setTimeout(() => refreshAllBalances(true), 8000);
+    }
 }
 
 function formatCurrency(amount) {
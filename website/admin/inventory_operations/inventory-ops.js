@@ -378,6 +378,22 @@
         return res.json();
     }
 
+    // Slow admin actions run as server jobs: the request returns 202 with a job id straight away
+    // and the result is polled from /api/jobs/<id>, so no request outlives the proxy timeout
+    async function apiJob(method, endpoint, body) {
+        const separator = endpoint.indexOf('?') === -1 ? '?' : '&';
+        const queued = await apiRequest(method, endpoint + separator + 'async=true', body);
+        if (!queued.job_id) return queued;
+        while (true) {
+            await new Promise(function(resolve) { setTimeout(resolve, 1000); });
+            const job = (await apiRequest('GET', '/api/jobs/' + queued.job_id)).job;
+            if (job.status === 'succeeded') return job.result;
+            if (job.status === 'failed' || job.status === 'cancelled') {
+                throw new Error(job.error || 'Job ' + job.id + ' ' + job.status);
+            }
+        }
+    }
+
     // ============================================================
     // DOMAIN DATA LOADERS
     // ============================================================
@@ -2787,7 +2803,7 @@
         };
 
         try {
-            const result = await apiRequest('POST', '/api/discogs/create-listing-single', listingData);
+            const result = await apiJob('POST', '/api/discogs/create-listing-single', listingData);
             if (result.success) {
                 let discogsUrl = result.listing_url;
                 if (!discogsUrl && result.listing_id) {
@@ -2924,7 +2940,7 @@
                     }
                 };
 
-                const result = await apiRequest('POST', '/api/discogs/create-listing-single', listingData);
+                const result = await apiJob('POST', '/api/discogs/create-listing-single', listingData);
 
                 if (result.success) {
                     successCount++;
@@ -4048,6 +4064,22 @@
         return res.json();
     }
 
+    // Slow admin actions run as server jobs: the request returns 202 with a job id straight away
+    // and the result is polled from /api/jobs/<id>, so no request outlives the proxy timeout
+    async function apiJob(method, endpoint, body) {
+        const separator = endpoint.indexOf('?') === -1 ? '?' : '&';
+        const queued = await apiRequest(method, endpoint + separator + 'async=true', body);
+        if (!queued.job_id) return queued;
+        while (true) {
+            await new Promise(function(resolve) { setTimeout(resolve, 1000); });
+            const job = (await apiRequest('GET', '/api/jobs/' + queued.job_id)).job;
+            if (job.status === 'succeeded') return job.result;
+            if (job.status === 'failed' || job.status === 'cancelled') {
+                throw new Error(job.error || 'Job ' + job.id + ' ' + job.status);
+            }
+        }
+    }
+
     // ============================================================
     // DOMAIN DATA LOADERS
     // ============================================================
@@ -6457,7 +6489,7 @@
         };
 
         try {
-            const result = await apiRequest('POST', '/api/discogs/create-listing-single', listingData);
+            const result = await apiJob('POST', '/api/discogs/create-listing-single', listingData);
             if (result.success) {
                 let discogsUrl = result.listing_url;
                 if (!discogsUrl && result.listing_id) {
@@ -6594,7 +6626,7 @@
                     }
                 };
 
-                const result = await apiRequest('POST', '/api/discogs/create-listing-single', listingData);
+                const result = await apiJob('POST', '/api/discogs/create-listing-single', listingData);
 
                 if (result.success) {
                     successCount++;
@@ -51,6 +51,7 @@
     let squareAvailable = false;
     let squareCheckoutId = null;
     let squarePollInterval = null;
+    let squareEventSource = null;
     let availableTerminals = [];
     let checkoutDebtorData = null;
 
@@ -902,7 +903,7 @@
             statusDiv.textContent = '💳 Payment request sent to POS. Waiting for customer to complete payment...';
             statusDiv.className = 'status-message status-info';
 
-            startPollingSquareStatus(checkout.id);
+            startSquareStatusStream(checkout.id);
 
         } catch (error) {
             console.error('Square checkout error:', error);
@@ -913,6 +914,78 @@
         }
     }
 
+    function startSquareStatusStream(checkoutId) {
+        // Status is pushed from the Square webhook over server-sent events; polling is the fallback
+        if (!window.EventSource) {
+            startPollingSquareStatus(checkoutId);
+            return;
+        }
+        if (squareEventSource) {
+            squareEventSource.close();
+        }
+
+        var statusDiv = document.getElementById('checkout-square-status');
+        var startedAt = Date.now();
+        var source = new EventSource(getBaseUrl() + '/api/square/terminal/checkout/' + checkoutId + '/events?timeout=120', {
+            withCredentials: true
+        });
+        squareEventSource = source;
+
+        function stopStream() {
+            source.close();
+            if (squareEventSource === source) {
+                squareEventSource = null;
+            }
+        }
+
+        function resetCompleteButton() {
+            var completeBtn = document.getElementById('checkout-complete-payment');
+            completeBtn.disabled = false;
+            completeBtn.textContent = 'Complete Payment';
+        }
+
+        source.addEventListener('status', async function(event) {
+            var status = JSON.parse(event.data).status;
+
+            if (status === 'COMPLETED') {
+                stopStream();
+                statusDiv.textContent = '✅ Payment completed successfully!';
+                statusDiv.className = 'status-message status-success';
+                await completeCheckout();
+                setTimeout(function() {
+                    var modal = document.getElementById('checkout-payment-modal');
+                    if (modal) modal.style.display = 'none';
+                }, 1500);
+            } else if (status === 'CANCELED' || status === 'FAILED') {
+                stopStream();
+                statusDiv.textContent = '❌ Payment ' + status.toLowerCase() + '. Please try again.';
+                statusDiv.className = 'status-message status-error';
+                resetCompleteButton();
+            } else {
+                statusDiv.textContent = '⏳ Waiting for payment... (' + Math.round((Date.now() - startedAt) / 1000) + 's)';
+                statusDiv.className = 'status-message status-info';
+            }
+        });
+
+        source.addEventListener('timeout', function() {
+            stopStream();
+            statusDiv.textContent = '⏰ Payment timed out. Please try again.';
+            statusDiv.className = 'status-message status-warning';
+            resetCompleteButton();
+        });
+
+        source.addEventListener('error', function() {
+            // The server closes each stream after ~30s and the browser reconnects by itself;
+            // only a stream the browser gave up on (or a stale one) falls back to polling
+            if (squareEventSource !== source || source.readyState === EventSource.CONNECTING) {
+                return;
+            }
+            stopStream();
+            console.warn('Checkout status stream unavailable, polling instead');
+            startPollingSquareStatus(checkoutId);
+        });
+    }
+
     function startPollingSquareStatus(checkoutId) {
         if (squarePollInterval) {
             clearInterval(squarePollInterval);
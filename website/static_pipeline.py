@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Static asset pipeline for the storefront.
+
+Build step (run before starting the site, see run_both.sh):
+    python3 static_pipeline.py
+
+- fingerprints every file under static/ by content hash
+  (/static/js/shared.js -> /static/js/shared.<hash>.js)
+- rewrites /static/... references in HTML and CSS to the fingerprinted URLs
+- precomputes gzip (and brotli, when the `brotli` package is installed)
+  variants of text assets
+- writes everything to .static_build/ with a manifest.json
+
+At request time StaticAssetPipeline.send() serves the best encoding the client
+accepts with a strong ETag, answers If-None-Match with 304, and marks
+fingerprinted URLs as immutable. Without a build it still serves files with
+content-hash ETags, so a missing build only costs compression.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import threading
+import time
+
+from flask import Response, request, send_file
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BUILD_DIR = os.path.join(BASE_DIR, '.static_build')
+MANIFEST_PATH = os.path.join(BUILD_DIR, 'manifest.json')
+
+# Fingerprinted under /static/...; page roots only get ETags and precompression
+STATIC_ROOT = 'static'
+PAGE_ROOTS = ('index', 'admin', 'accounting', 'checkout')
+
+COMPRESSIBLE_EXTENSIONS = {'.html', '.css', '.js', '.json', '.svg', '.txt', '.xml', '.ico', '.ttf', '.map'}
+REWRITE_EXTENSIONS = {'.html', '.css'}
+SKIP_EXTENSIONS = {'.xcf'}
+MIN_COMPRESS_SIZE = 512
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+STATIC_REFERENCE_PATTERN = re.compile(r'(?P<prefix>["\'(])(?P<url>/static/[^"\'()?#\s]+)')
+
+
+def _content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _fingerprinted(rel_path, content_hash):
+    stem, ext = os.path.splitext(rel_path)
+    return f'{stem}.{content_hash[:10]}{ext}'
+
+
+# ==================== BUILD ====================
+
+def _walk(root):
+    root_dir = os.path.join(BASE_DIR, root)
+    for dirpath, _, filenames in os.walk(root_dir):
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() in SKIP_EXTENSIONS or filename.startswith('.'):
+                continue
+            full_path = os.path.join(dirpath, filename)
+            yield os.path.relpath(full_path, BASE_DIR).replace(os.sep, '/')
+
+
+def _rewrite_references(text, url_map):
+    def replace(match):
+        url = match.group('url')
+        return match.group('prefix') + url_map.get(url, url)
+    return STATIC_REFERENCE_PATTERN.sub(replace, text)
+
+
+def _write_variants(rel_path, data):
+    """Write data (and compressed variants) under BUILD_DIR. Returns the manifest fields."""
+    out_path = os.path.join(BUILD_DIR, rel_path)
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    with open(out_path, 'wb') as f:
+        f.write(data)
+    entry = {'built': rel_path}
+
+    if os.path.splitext(rel_path)[1].lower() in COMPRESSIBLE_EXTENSIONS and len(data) >= MIN_COMPRESS_SIZE:
+        gz_data = gzip.compress(data, compresslevel=9, mtime=0)
+        if len(gz_data) < len(data):
+            with open(out_path + '.gz', 'wb') as f:
+                f.write(gz_data)
+            entry['gzip'] = rel_path + '.gz'
+        if brotli:
+            br_data = brotli.compress(data, quality=11)
+            if len(br_data) < len(data):
+                with open(out_path + '.br', 'wb') as f:
+                    f.write(br_data)
+                entry['br'] = rel_path + '.br'
+    return entry
+
+
+def _manifest_entry(rel_path, data, content_hash):
+    source = os.path.join(BASE_DIR, rel_path)
+    stat = os.stat(source)
+    entry = {
+        'source': rel_path,
+        'hash': content_hash,
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size
+    }
+    ext = os.path.splitext(rel_path)[1].lower()
+    if ext in COMPRESSIBLE_EXTENSIONS or ext in REWRITE_EXTENSIONS:
+        entry.update(_write_variants(rel_path, data))
+    return entry
+
+
+def build():
+    """Fingerprint, rewrite and precompress all assets into BUILD_DIR"""
+    start = time.time()
+    if os.path.exists(BUILD_DIR):
+        shutil.rmtree(BUILD_DIR)
+    os.makedirs(BUILD_DIR)
+
+    files = {}
+    url_map = {}
+
+    # Pass 1: everything under static/ except CSS, which may reference other assets
+    static_files = list(_walk(STATIC_ROOT))
+    for rel_path in static_files:
+        if rel_path.endswith('.css'):
+            continue
+        content_hash = _file_hash(os.path.join(BASE_DIR, rel_path))
+        ext = os.path.splitext(rel_path)[1].lower()
+        data = None
+        if ext in COMPRESSIBLE_EXTENSIONS:
+            with open(os.path.join(BASE_DIR, rel_path), 'rb') as f:
+                data = f.read()
+        files[rel_path] = _manifest_entry(rel_path, data, content_hash)
+        url_map['/' + rel_path] = '/' + _fingerprinted(rel_path, content_hash)
+
+    # Pass 2: CSS under static/, with references rewritten before hashing
+    for rel_path in static_files:
+        if not rel_path.endswith('.css'):
+            continue
+        with open(os.path.join(BASE_DIR, rel_path), encoding='utf-8') as f:
+            data = _rewrite_references(f.read(), url_map).encode('utf-8')
+        content_hash = _content_hash(data)
+        files[rel_path] = _manifest_entry(rel_path, data, content_hash)
+        url_map['/' + rel_path] = '/' + _fingerprinted(rel_path, content_hash)
+
+    # Pass 3: pages and their local assets (not fingerprinted, revalidated by ETag)
+    for root in PAGE_ROOTS:
+        for rel_path in _walk(root):
+            with open(os.path.join(BASE_DIR, rel_path), 'rb') as f:
+                data = f.read()
+            if os.path.splitext(rel_path)[1].lower() in REWRITE_EXTENSIONS:
+                data = _rewrite_references(data.decode('utf-8'), url_map).encode('utf-8')
+            files[rel_path] = _manifest_entry(rel_path, data, _content_hash(data))
+
+    fingerprints = {
+        _fingerprinted(rel_path, entry['hash']): rel_path
+        for rel_path, entry in files.items()
+        if rel_path.startswith(STATIC_ROOT + '/')
+    }
+    manifest = {'built_at': time.time(), 'files': files, 'fingerprints': fingerprints}
+    with open(MANIFEST_PATH + '.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(MANIFEST_PATH + '.tmp', MANIFEST_PATH)
+
+    compressed = sum(1 for entry in files.values() if 'gzip' in entry)
+    print(f"✅ Static build: {len(files)} files, {len(fingerprints)} fingerprinted, "
+          f"{compressed} precompressed{' (gzip+br)' if brotli else ' (gzip)'} in {time.time() - start:.1f}s")
+    return manifest
+
+
+# ==================== SERVING ====================
+
+class StaticAssetPipeline:
+    """Serves built assets with content negotiation, strong ETags and 304s"""
+
+    MANIFEST_CHECK_INTERVAL = 2.0
+
+    def __init__(self, base_dir=BASE_DIR, build_dir=BUILD_DIR):
+        self.base_dir = base_dir
+        self.build_dir = build_dir
+        self.manifest_path = os.path.join(build_dir, 'manifest.json')
+        self._manifest = {'files': {}, 'fingerprints': {}}
+        self._manifest_mtime = None
+        self._manifest_checked = 0
+        self._hash_cache = {}
+        self._lock = threading.Lock()
+
+    def _load_manifest(self):
+        now = time.monotonic()
+        if now - self._manifest_checked < self.MANIFEST_CHECK_INTERVAL:
+            return self._manifest
+        with self._lock:
+            self._manifest_checked = now
+            try:
+                mtime = os.path.getmtime(self.manifest_path)
+            except OSError:
+                return self._manifest
+            if mtime != self._manifest_mtime:
+                with open(self.manifest_path) as f:
+                    self._manifest = json.load(f)
+                self._manifest_mtime = mtime
+        return self._manifest
+
+    def _lazy_hash(self, full_path, stat):
+        """Content hash for files missing from the build, cached per (mtime, size)"""
+        key = (full_path, stat.st_mtime_ns, stat.st_size)
+        content_hash = self._hash_cache.get(key)
+        if content_hash is None:
+            content_hash = _file_hash(full_path)
+            self._hash_cache[key] = content_hash
+        return content_hash
+
+    def url_for(self, rel_path):
+        """Fingerprinted URL for a static/ path, or the plain URL if it is not built"""
+        entry = self._load_manifest()['files'].get(rel_path)
+        if entry and rel_path.startswith(STATIC_ROOT + '/'):
+            return '/' + _fingerprinted(rel_path, entry['hash'])
+        return '/' + rel_path
+
+    def send(self, directory, filename):
+        """Serve directory/filename, preferring precompressed build output"""
+        manifest = self._load_manifest()
+        full_path = os.path.abspath(os.path.join(directory, filename))
+        if not full_path.startswith(os.path.abspath(directory) + os.sep):
+            return Response('File not found', status=404)
+        rel_path = os.path.relpath(full_path, self.base_dir).replace(os.sep, '/')
+
+        immutable = False
+        if not os.path.isfile(full_path):
+            # Fingerprinted URL: map back to the source file
+            source_rel = manifest['fingerprints'].get(rel_path)
+            if not source_rel:
+                return Response('File not found', status=404)
+            rel_path = source_rel
+            full_path = os.path.join(self.base_dir, rel_path)
+            immutable = True
+            if not os.path.isfile(full_path):
+                return Response('File not found', status=404)
+
+        stat = os.stat(full_path)
+        entry = manifest['files'].get(rel_path)
+        if entry and (entry['mtime_ns'] != stat.st_mtime_ns or entry['size'] != stat.st_size):
+            # Source changed since the last build: serve it directly and never as immutable
+            entry = None
+            immutable = False
+
+        content_hash = entry['hash'] if entry else self._lazy_hash(full_path, stat)
+        cache_control = IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+        encoding, served_path = None, full_path
+        if entry:
+            accepted = request.headers.get('Accept-Encoding', '')
+            if 'built' in entry:
+                served_path = os.path.join(self.build_dir, entry['built'])
+            if 'br' in entry and 'br' in accepted:
+                encoding, served_path = 'br', os.path.join(self.build_dir, entry['br'])
+            elif 'gzip' in entry and 'gzip' in accepted:
+                encoding, served_path = 'gzip', os.path.join(self.build_dir, entry['gzip'])
+        etag = f'"{content_hash[:20]}{"-" + encoding if encoding else ""}"'
+
+        if self._etag_matches(content_hash[:20]):
+            response = Response(status=304)
+        else:
+            response = send_file(served_path, mimetype=mimetype, conditional=False, etag=False)
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = cache_control
+        if entry and ('gzip' in entry or 'br' in entry):
+            response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+    @staticmethod
+    def _etag_matches(hash_prefix):
+        header = request.headers.get('If-None-Match')
+        if not header:
+            return False
+        if header.strip() == '*':
+            return True
+        for tag in header.split(','):
+            tag = tag.strip()
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            # Any encoding of the same content is a match
+            if tag.strip('"').split('-')[0] == hash_prefix:
+                return True
+        return False
+
+
+if __name__ == '__main__':
+    build()
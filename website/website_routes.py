@@ -1,11 +1,12 @@
 import os
 from dotenv import load_dotenv
-from flask import Flask, send_from_directory, send_file, session, redirect, request, abort
+from flask import Flask, session, redirect, request, abort
+from static_pipeline import StaticAssetPipeline
 
 load_dotenv()
 
 # Create app only if not already created (for local development)
-app = Flask(__name__, static_folder='static')
+app = Flask(__name__, static_folder=None)  # /static is served by the asset pipeline
 app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'a7f8e9d3c5b1n2m4k6l7j8h9g0f1d3s')
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -18,6 +19,9 @@ COMPONENTS_DIR  = os.path.join(BASE_DIR, 'index', 'components')  # ← FIXED: co
 ACCOUNTING_DIR  = os.path.join(BASE_DIR, 'accounting')
 CHECKOUT_DIR    = os.path.join(BASE_DIR, 'checkout')
 
+# Fingerprinted, precompressed assets (build with: python3 static_pipeline.py)
+assets = StaticAssetPipeline(BASE_DIR)
+
 # Track if routes have been registered to prevent duplicates
 _routes_registered = False
 
@@ -36,59 +40,59 @@ def register_routes(application):
     # ---------- MAIN HTML PAGES ----------
     @application.route('/')
     def index():
-        return send_from_directory(INDEX_DIR, 'index.html')
+        return assets.send(INDEX_DIR, 'index.html')
 
     @application.route('/login', methods=['GET'])
     def login():
-        return send_from_directory(INDEX_DIR, 'login.html')
+        return assets.send(INDEX_DIR, 'login.html')
 
     @application.route('/dashboard')
     def dashboard():
-        return send_from_directory(INDEX_DIR, 'dashboard.html')
+        return assets.send(INDEX_DIR, 'dashboard.html')
 
     @application.route('/payment-confirm')
     def payment_confirm():
-        return send_from_directory(INDEX_DIR, 'payment-confirm.html')
+        return assets.send(INDEX_DIR, 'payment-confirm.html')
 
     # ---------- ADMIN PAGES ----------
     @application.route('/admin')
     def admin_panel():
         if not is_admin():
             return redirect('/access-denied')
-        return send_from_directory(ADMIN_DIR, 'admin.html')
+        return assets.send(ADMIN_DIR, 'admin.html')
 
     @application.route('/admin.css')
     def admin_css():
-        return send_from_directory(ADMIN_DIR, 'admin.css')
+        return assets.send(ADMIN_DIR, 'admin.css')
 
     @application.route('/admin-components/<path:filename>')
     def serve_admin_component(filename):
         if '..' in filename:
             abort(404)
-        return send_from_directory(ADMIN_DIR, filename)
+        return assets.send(ADMIN_DIR, filename)
 
     @application.route('/admin/accounting')
     def admin_accounting():
         if not is_admin():
             return redirect('/access-denied')
-        return send_from_directory(ACCOUNTING_DIR, 'admin-accounting.html')
+        return assets.send(ACCOUNTING_DIR, 'admin-accounting.html')
 
     @application.route('/accounting/<path:filename>')
     def serve_accounting(filename):
-        return send_from_directory(ACCOUNTING_DIR, filename)
+        return assets.send(ACCOUNTING_DIR, filename)
 
     # ---------- CHECKOUT PAGE ----------
     @application.route('/checkout')
     @application.route('/checkout/')
     @application.route('/checkout/checkout.html')
     def checkout():
-        return send_from_directory(CHECKOUT_DIR, 'checkout.html')
+        return assets.send(CHECKOUT_DIR, 'checkout.html')
 
     @application.route('/checkout/<path:filename>')
     def serve_checkout_asset(filename):
         if '..' in filename:
             abort(404)
-        return send_from_directory(CHECKOUT_DIR, filename)
+        return assets.send(CHECKOUT_DIR, filename)
 
     # ---------- COMPONENTS ----------
     @application.route('/components/<path:filename>')
@@ -99,55 +103,55 @@ def register_routes(application):
         # Prevent path traversal
         if '..' in filename:
             abort(404)
-        return send_from_directory(COMPONENTS_DIR, filename)
+        return assets.send(COMPONENTS_DIR, filename)
 
     # ---------- OTHER PAGES ----------
     @application.route('/item-management')
     def item_management():
         if not is_admin():
             return redirect('/access-denied')
-        return send_from_directory(INDEX_DIR, 'item-management.html')
+        return assets.send(INDEX_DIR, 'item-management.html')
 
     @application.route('/access-denied')
     def access_denied():
-        return send_from_directory(INDEX_DIR, 'access_denied.html')
+        return assets.send(INDEX_DIR, 'access_denied.html')
 
     @application.route('/inventory')
     def inventory():
-        return send_from_directory(INDEX_DIR, 'inventory.html')
+        return assets.send(INDEX_DIR, 'inventory.html')
 
     @application.route('/consignment')
     def consignment():
-        return send_from_directory(INDEX_DIR, 'consignment.html')
+        return assets.send(INDEX_DIR, 'consignment.html')
 
     @application.route('/youtube-linker')
     def youtube_linker():
-        return send_from_directory(INDEX_DIR, 'youtube-linker.html')
+        return assets.send(INDEX_DIR, 'youtube-linker.html')
 
     @application.route('/kiosk')
     def kiosk():
-        return send_from_directory(INDEX_DIR, 'kiosk.html')
+        return assets.send(INDEX_DIR, 'kiosk.html')
 
     # ---------- STATIC ----------
     @application.route('/static/<path:path>')
     def serve_static(path):
-        return send_from_directory(STATIC_DIR, path)
+        return assets.send(STATIC_DIR, path)
 
     @application.route('/js/<path:path>')
     def serve_js(path):
-        return send_from_directory(os.path.join(STATIC_DIR, 'js'), path)
+        return assets.send(os.path.join(STATIC_DIR, 'js'), path)
 
     @application.route('/css/<path:path>')
     def serve_css(path):
-        return send_from_directory(os.path.join(STATIC_DIR, 'css'), path)
+        return assets.send(os.path.join(STATIC_DIR, 'css'), path)
 
     @application.route('/images/<path:path>')
     def serve_images(path):
-        return send_from_directory(os.path.join(STATIC_DIR, 'images'), path)
+        return assets.send(os.path.join(STATIC_DIR, 'images'), path)
 
     @application.route('/fonts/<path:path>')
     def serve_fonts(path):
-        return send_from_directory(os.path.join(STATIC_DIR, 'fonts'), path)
+        return assets.send(os.path.join(STATIC_DIR, 'fonts'), path)
 
     # ---------- DEBUG ----------
     @application.route('/debug')
@@ -165,12 +169,12 @@ def register_routes(application):
     # ---------- FALLBACK ----------
     @application.route('/<path:filename>')
     def serve_file(filename):
-        static_file = os.path.join(STATIC_DIR, filename)
-        if os.path.exists(static_file):
-            return send_file(static_file)
-        html_file = os.path.join(INDEX_DIR, filename)
-        if os.path.exists(html_file):
-            return send_file(html_file)
+        if '..' in filename:
+            abort(404)
+        if os.path.isfile(os.path.join(STATIC_DIR, filename)):
+            return assets.send(STATIC_DIR, filename)
+        if os.path.isfile(os.path.join(INDEX_DIR, filename)):
+            return assets.send(INDEX_DIR, filename)
         return "File not found", 404
 
     _routes_registered = True